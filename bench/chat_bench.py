@@ -0,0 +1,424 @@
+# server/bench/chat_bench.py
+"""
+聊天室负载生成与基准测试
+
+在同一进程中启动 Server + setup_web_server (临时目录中的 SQLite 数据库)，
+驱动 N 个模拟 WebSocket 客户端和 M 个 TCP 客户端依次完成:
+
+    login -> join -> chat -> tcp_command -> switch -> upload -> disconnect
+
+每个阶段在所有客户端之间同步开始，报告 p50/p99 延迟、吞吐量以及该阶段
+执行的数据库语句数，结果以 JSON 输出，便于在不同提交之间比较。
+TCP 会话不接收频道广播，也没有文件上传通道: chat 和 upload 阶段只包含 WebSocket 客户端，
+TCP 客户端在 tcp_command 阶段测量命令往返 (/whoami)。每个阶段的 transports 字段记录参与的客户端类型。
+服务器在登录成功后自动加入默认频道，join 阶段的延迟是从发出登录请求到收到 join_channel_success 的时间；
+disconnect 阶段计时到服务器移除全部会话为止。
+
+用法 (在仓库根目录下):
+    python bench/chat_bench.py --ws-clients 50 --tcp-clients 10 --messages 20 --output result.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BENCH_PASSWORD = 'benchpass123'
+PHASES = ("login", "join", "chat", "tcp_command", "switch", "upload", "disconnect")
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _write_config(path: str, web_port: int, tcp_port: int):
+    import yaml
+    data = {
+        'server': {
+            'tcp_server': {'enabled': True, 'host': '127.0.0.1', 'port': tcp_port, 'tls': {'enabled': False}},
+            'web_server': {'enabled': True, 'host': '127.0.0.1', 'port': web_port, 'tls': {'enabled': False}},
+            # 所有基准客户端同时在线且来自同一地址
+            'max_connections': 0,
+            'admission': {'max_per_ip': 0, 'max_unauthenticated': 0, 'accept_rate': 0},
+        },
+        'security': {
+            'builtin_admins': {'enabled': False, 'users': [], 'passwords': ''},
+            'email_verification': {'enabled': False},
+            # 基准测试的所有客户端都来自 127.0.0.1，测的是吞吐而不是限速
+            'rate_limit': {'enabled': False},
+        },
+        'logging': {'level': 'WARNING', 'dir': 'logs', 'debug': False, 'show_user_commands': False, 'show_user_chats': False},
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(data, f)
+
+
+def _percentile(samples: List[float], pct: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class BenchClient(ABC):
+    """模拟客户端基类: 读取任务把收到的消息放入队列，wait_for 按条件取出"""
+    def __init__(self, username: str, capabilities: List[str]):
+        self.username = username
+        self.capabilities = capabilities
+        self.token: Optional[str] = None
+        # (收到的时间, 消息)
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.login_started: Optional[float] = None
+        self.received = 0
+        self.frames = 0
+        self._reader_task: Optional[asyncio.Task] = None
+
+    async def wait_for(self, predicate: Callable[[dict], bool], timeout: float = 30.0) -> Tuple[float, dict]:
+        """返回第一条满足条件的消息及其到达时间 (perf_counter)"""
+        deadline = time.perf_counter() + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"{self.username} 等待消息超时")
+            received_at, message = await asyncio.wait_for(self.inbox.get(), timeout=remaining)
+            if predicate(message):
+                return received_at, message
+
+    def _deliver(self, message: dict):
+        self.frames += 1
+        messages = message["payload"]["messages"] if message.get("type") == "batch" else [message]
+        self.received += len(messages)
+        received_at = time.perf_counter()
+        for item in messages:
+            self.inbox.put_nowait((received_at, item))
+
+    @abstractmethod
+    async def connect(self):
+        ...
+
+    @abstractmethod
+    async def send(self, message: dict):
+        ...
+
+    @abstractmethod
+    async def close(self):
+        ...
+
+    async def login(self) -> float:
+        self.login_started = start = time.perf_counter()
+        await self.send({"type": "auth_request", "payload": {"action": "login", "username": self.username, "password": BENCH_PASSWORD, "capabilities": self.capabilities}})
+        received_at, response = await self.wait_for(lambda m: m.get("type") in ("auth_success", "auth_failure"))
+        if response["type"] != "auth_success":
+            raise RuntimeError(f"{self.username} 登录失败: {response['payload']}")
+        self.token = response["payload"].get("token")
+        return received_at - start
+
+    async def join(self) -> float:
+        # 登录成功后服务器自动加入默认频道: 从发出登录请求计时，而不是从本阶段开始，
+        # 否则所有客户端登录完成时 join_channel_success 通常已经在收件箱里
+        received_at, _ = await self.wait_for(lambda m: m.get("type") == "join_channel_success")
+        return received_at - self.login_started
+
+    async def switch(self, channel_name: str) -> float:
+        start = time.perf_counter()
+        await self.send({"type": "command", "payload": {"command": "join", "args": [channel_name]}})
+        received_at, _ = await self.wait_for(lambda m: m.get("type") == "join_channel_success" and m["payload"].get("channel_name") == channel_name)
+        return received_at - start
+
+
+class WebSocketBenchClient(BenchClient):
+    def __init__(self, username: str, capabilities: List[str], http, url: str):
+        super().__init__(username, capabilities)
+        self.http = http
+        self.url = url
+        self.ws = None
+
+    async def connect(self):
+        self.ws = await self.http.ws_connect(self.url)
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        async for msg in self.ws:
+            if msg.type.name == 'TEXT':
+                self._deliver(json.loads(msg.data))
+
+    async def send(self, message: dict):
+        await self.ws.send_str(json.dumps(message))
+
+    async def chat(self, text: str) -> float:
+        client_msg_id = uuid.uuid4().hex
+        start = time.perf_counter()
+        await self.send({"type": "chat_message", "payload": {"message": text, "client_msg_id": client_msg_id}})
+        received_at, _ = await self.wait_for(lambda m: m.get("type") == "chat_broadcast" and m["payload"].get("client_msg_id") == client_msg_id)
+        return received_at - start
+
+    async def upload(self, base_url: str, channel_id: int, data: bytes) -> float:
+        import aiohttp
+        form = aiohttp.FormData()
+        form.add_field('file', data, filename=f'{self.username}.bin', content_type='application/octet-stream')
+        form.add_field('channel_id', str(channel_id))
+        start = time.perf_counter()
+        async with self.http.post(f'{base_url}/api/files/upload', data=form, headers={'Authorization': f'Bearer {self.token}'}) as resp:
+            await resp.read()
+            if resp.status != 200:
+                raise RuntimeError(f"{self.username} 上传失败: HTTP {resp.status}")
+        return time.perf_counter() - start
+
+    async def close(self):
+        await self.ws.close()
+        if self._reader_task:
+            await self._reader_task
+
+
+class TcpBenchClient(BenchClient):
+    def __init__(self, username: str, capabilities: List[str], host: str, port: int, framing: str):
+        super().__init__(username, capabilities)
+        self.host = host
+        self.port = port
+        self.framing = framing
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        if self.framing != 'line':
+            self.writer.write(json.dumps({"type": "protocol_negotiate", "payload": {"framing": self.framing}}).encode() + b'\n')
+            await self.writer.drain()
+            await self.reader.readline()
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        from utils import framing
+        try:
+            while True:
+                if self.framing == 'line':
+                    line = await self.reader.readline()
+                    if not line:
+                        return
+                    self._deliver(json.loads(line))
+                else:
+                    length, _ = framing.FRAME_HEADER.unpack(await self.reader.readexactly(framing.FRAME_HEADER.size))
+                    self._deliver(json.loads(await self.reader.readexactly(length)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+
+    async def send(self, message: dict):
+        from utils import framing
+        data = json.dumps(message).encode()
+        if self.framing == 'line':
+            self.writer.write(data + b'\n')
+        else:
+            self.writer.write(framing.FRAME_HEADER.pack(len(data), 0) + data)
+        await self.writer.drain()
+
+    async def command(self) -> float:
+        # TCP 会话不接收频道广播，测量的是一次命令往返
+        start = time.perf_counter()
+        await self.send({"type": "command", "payload": {"command": "whoami"}})
+        received_at, _ = await self.wait_for(lambda m: m.get("type") == "whoami_response")
+        return received_at - start
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+        if self._reader_task:
+            await self._reader_task
+
+
+class PhaseRecorder:
+    def __init__(self):
+        from utils import metrics
+        self._db_histogram = metrics.db_query_duration
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    async def run(self, name: str, coroutines: List, operations: Optional[int] = None, transports: Tuple[str, ...] = ("websocket", "tcp")):
+        db_before = self._db_histogram.total_count()
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*coroutines, return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        latencies: List[float] = []
+        errors = []
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                errors.append(repr(outcome))
+            elif isinstance(outcome, list):
+                latencies.extend(outcome)
+            elif outcome is not None:
+                latencies.append(outcome)
+        ops = operations if operations is not None else len(latencies)
+        self.results[name] = {
+            "transports": list(transports),
+            "operations": ops,
+            "errors": len(errors),
+            "error_samples": errors[:5],
+            "duration_s": elapsed,
+            "ops_per_s": ops / elapsed if elapsed > 0 else None,
+            "latency_p50_ms": _ms(_percentile(latencies, 50)),
+            "latency_p99_ms": _ms(_percentile(latencies, 99)),
+            "latency_mean_ms": _ms(statistics.fmean(latencies)) if latencies else None,
+            "db_queries": self._db_histogram.total_count() - db_before,
+        }
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000, 3) if value is not None else None
+
+
+async def _run(args) -> Dict[str, Any]:
+    import aiohttp
+    from aiohttp import web
+    from utils.migration import run_migrations
+    from utils.database import db_manager
+    from utils.config import config
+    from server import Server
+    from core.web_server import setup_web_server
+
+    await run_migrations(db_manager)
+    server = Server()
+    await server.initialize()
+
+    web_runner = web.AppRunner(setup_web_server(server))
+    await web_runner.setup()
+    web_port = config.get('server.web_server.port')
+    await web.TCPSite(web_runner, '127.0.0.1', web_port).start()
+    tcp_task = asyncio.create_task(server.start_tcp_server())
+
+    switch_channel = 'benchswitch'
+    await server.channel_manager.create_channel(switch_channel, "benchmark")
+    server.add_channel_to_session_manager(server.channel_manager.get_channel(switch_channel))
+
+    total_clients = args.ws_clients + args.tcp_clients
+    usernames = [f"bench{i}" for i in range(total_clients)]
+    setup_start = time.perf_counter()
+    await asyncio.gather(*(server.user_manager.register(name, BENCH_PASSWORD, f"{name}@bench.local") for name in usernames))
+    setup_seconds = time.perf_counter() - setup_start
+
+    recorder = PhaseRecorder()
+    base_url = f'http://127.0.0.1:{web_port}'
+    async with aiohttp.ClientSession() as http:
+        capabilities = [c for c in args.capabilities.split(',') if c]
+        ws_clients = [WebSocketBenchClient(name, capabilities, http, f'{base_url}/ws') for name in usernames[:args.ws_clients]]
+        tcp_clients = [TcpBenchClient(name, capabilities, '127.0.0.1', config.get('server.tcp_server.port'), args.tcp_framing) for name in usernames[args.ws_clients:]]
+        clients: List[BenchClient] = ws_clients + tcp_clients
+        await asyncio.sleep(0.2)
+        await asyncio.gather(*(c.connect() for c in clients))
+
+        await recorder.run("login", [c.login() for c in clients])
+        await recorder.run("join", [c.join() for c in clients])
+
+        async def chat_many(client: WebSocketBenchClient) -> List[float]:
+            return [await client.chat(f"benchmark message {i} from {client.username}") for i in range(args.messages)]
+
+        async def command_many(client: TcpBenchClient) -> List[float]:
+            return [await client.command() for _ in range(args.messages)]
+
+        received_before = sum(c.received for c in ws_clients)
+        frames_before = sum(c.frames for c in ws_clients)
+        await recorder.run("chat", [chat_many(c) for c in ws_clients], transports=("websocket",))
+        chat_result = recorder.results["chat"]
+        delivered = sum(c.received for c in ws_clients) - received_before
+        chat_result["messages_delivered"] = delivered
+        chat_result["frames_delivered"] = sum(c.frames for c in ws_clients) - frames_before
+        chat_result["delivered_per_s"] = delivered / chat_result["duration_s"] if chat_result["duration_s"] > 0 else None
+        if tcp_clients:
+            await recorder.run("tcp_command", [command_many(c) for c in tcp_clients], transports=("tcp",))
+
+        await recorder.run("switch", [c.switch(switch_channel) for c in clients])
+
+        channel_id = server.channel_manager.get_channel(switch_channel).id
+        payload = os.urandom(args.upload_size)
+        # TCP 协议没有文件上传通道，只有 WebSocket 客户端经 HTTP 上传
+        await recorder.run("upload", [c.upload(base_url, channel_id, payload) for c in ws_clients], transports=("websocket",))
+
+        async def disconnect_all():
+            start = time.perf_counter()
+            await asyncio.gather(*(c.close() for c in clients))
+            while server.sessions and time.perf_counter() - start < 30:
+                await asyncio.sleep(0.01)
+            return time.perf_counter() - start
+        await recorder.run("disconnect", [disconnect_all()], operations=len(clients))
+        # 不计时: 等待断线后的用户列表广播等清理任务完成再关闭服务器
+        await asyncio.sleep(0.2)
+
+    await web_runner.cleanup()
+    tcp_task.cancel()
+    await server.shutdown()
+
+    return {
+        "benchmark": "chat_bench",
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "params": {
+            "ws_clients": args.ws_clients,
+            "tcp_clients": args.tcp_clients,
+            "messages_per_client": args.messages,
+            "upload_size": args.upload_size,
+            "tcp_framing": args.tcp_framing,
+            "capabilities": args.capabilities,
+        },
+        "setup_s": setup_seconds,
+        "phases": {name: recorder.results[name] for name in PHASES if name in recorder.results},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="聊天室端到端基准测试")
+    parser.add_argument('--ws-clients', type=int, default=20)
+    parser.add_argument('--tcp-clients', type=int, default=5)
+    parser.add_argument('--messages', type=int, default=10, help="每个客户端在 chat 阶段发送的消息数")
+    parser.add_argument('--upload-size', type=int, default=64 * 1024)
+    parser.add_argument('--tcp-framing', choices=('line', 'length_prefixed'), default='line')
+    parser.add_argument('--capabilities', default='', help="客户端在 auth_request 中声明的能力，逗号分隔 (例如 batch,compact_user_list)")
+    parser.add_argument('--output', help="结果 JSON 文件路径，默认输出到 stdout")
+    parser.add_argument('--keep-workdir', action='store_true', help="保留临时工作目录 (数据库、上传文件) 以便排查")
+    args = parser.parse_args()
+
+    # 服务器模块在导入时读取当前目录下的 config.yml 和 data/chat.db，因此先切换到临时目录
+    output_path = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix='chat_bench_')
+    _write_config(os.path.join(workdir, 'config.yml'), _free_port(), _free_port())
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+
+    try:
+        result = asyncio.run(_run(args))
+    finally:
+        if not args.keep_workdir:
+            import shutil
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
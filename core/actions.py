@@ -1,12 +1,13 @@
 # server/core/actions.py
 import logging
-from typing import TYPE_CHECKING, Tuple
+from typing import TYPE_CHECKING, Dict, Tuple
 from datetime import datetime, timezone, timedelta
 
-from utils.i18n import translator
 from utils import protocol as proto, database as db
 from utils.config import config
+from utils.backplane import EVENT_KICK, EVENT_CHANNEL_CREATED, EVENT_CHANNEL_DELETED
 from .constants import *
+from .commands import command, Arg, SECTIONS, SECTION_FILES, SECTION_CHANNEL_ADMIN, SECTION_USER_ADMIN
 
 if TYPE_CHECKING:
     from core.session import BaseSession # 修改
@@ -15,17 +16,22 @@ if TYPE_CHECKING:
 class ActionHandler:
     def __init__(self, server: 'Server'):
         self.server = server
+        # 帮助信息只取决于权限，按权限掩码缓存预编码的消息
+        self._help_messages: Dict[int, str] = {}
 
+    @command("list")
     async def list_channel_users(self, session: 'BaseSession'): # 修改
         if session.current_channel:
-            # 修改: list_channel_users 现在依赖于 broadcast_all_registered_users_status
-            # 因此这里直接调用广播，让所有客户端更新用户列表 (包括当前会话)
-            await self.server.broadcast_all_registered_users_status(exclude_session=None)
+            # 重新下发当前频道成员列表的第一页
+            channel_id = session.current_channel.id
+            payload = await self.server.channel_members.page_payload(session, channel_id)
+            await session.send(proto.create_message(proto.MSG_TYPE_CHANNEL_MEMBERS, {"channel_id": channel_id, **payload}))
             await session.send(proto.create_system_message("用户列表已刷新。"))
         else:
             await session.send(proto.create_error_message("请先加入一个频道"))
 
 
+    @command("whoami")
     async def show_whoami(self, session: 'BaseSession'): # 修改
         if session.user:
             # 修改: 使用统一格式化函数，包含 display_name
@@ -34,63 +40,66 @@ class ActionHandler:
             user_info['username'] = session.user.username
             await session.send(proto.create_message(proto.MSG_TYPE_WHOAMI_RESPONSE, user_info))
 
+    @command("help")
     async def show_help(self, session: 'BaseSession'): # 修改
-        help_text = "Commands: /help, /list, /whoami, /channels, /join <channel>\n"
-        help_text += "File Commands: /files, /upload <path>, /download <id>"
-        if session.user and any(role in [ROLE_MODERATOR, ROLE_OPERATOR, ROLE_OWNER, ROLE_SUPERUSER] for role in session.user.roles):
-            help_text += ", /deletefile <id>"
-        if session.user and any(role in [ROLE_OWNER, ROLE_SUPERUSER] for role in session.user.roles):
-             help_text += "\nAdmin-Chan: /createchannel, /deletechannel"
-        if session.user and any(role in [ROLE_OPERATOR, ROLE_OWNER, ROLE_SUPERUSER] for role in session.user.roles):
-            help_text += "\nAdmin-User: /kick"
-        await session.send(proto.create_system_message(help_text))
-
+        permissions = session.user.permissions if session.user else 0
+        message = self._help_messages.get(permissions)
+        if message is None:
+            # 帮助信息由命令注册表生成，只列出当前用户有权限使用的命令
+            usages = {section: [] for section in SECTIONS}
+            for spec in self.server.command_handler.available_commands(session):
+                usages[spec.section].append(spec.usage)
+            # /upload 和 /download 由客户端处理
+            usages[SECTION_FILES][1:1] = ["/upload <path>", "/download <id>"]
+            help_text = "\n".join(f"{section}: {', '.join(items)}" for section, items in usages.items() if items)
+            message = self._help_messages[permissions] = proto.create_system_message(help_text)
+        await session.send(message)
+
+    @command("kick", Arg("username"), permission=PERM_KICK, section=SECTION_USER_ADMIN)
     async def kick_user(self, actor_session: 'BaseSession', target_username: str): # 修改
-        required_roles = [ROLE_OPERATOR, ROLE_OWNER, ROLE_SUPERUSER]
-        if not actor_session.user or not any(role in required_roles for role in actor_session.user.roles):
-            await actor_session.send(proto.create_error_message(translator.t('permission_denied', command='kick')))
-            return
         if actor_session.user and target_username.lower() == actor_session.user.username.lower():
             await actor_session.send(proto.create_error_message("You cannot kick yourself"))
             return
+        # 修改: 使用 display_name
+        actor_display_name = actor_session.user.display_name if actor_session.user.display_name else actor_session.user.username
         target_session = await self.server.get_session_by_username(target_username)
         if not target_session or not target_session.user:
-            await actor_session.send(proto.create_error_message(translator.t('user_not_found', username=target_username)))
+            if self.server.user_manager.is_online(target_username):
+                # 目标用户连接在其它节点上，由该节点执行踢出
+                await self.server.backplane.publish(EVENT_KICK, {"username": target_username, "admin": actor_display_name})
+                logging.info(f"用户 '{target_username}' 在其它节点上，已通过背板请求踢出 (操作者: '{actor_display_name}')")
+                return
+            await actor_session.send(proto.create_error_message(actor_session.t('user_not_found', username=target_username)))
             return
-        # 修改: 使用 display_name
-        actor_display_name = actor_session.user.display_name if actor_session.user.display_name else actor_session.user.username
+        await self.kick_local_session(target_session, actor_display_name)
+
+    async def kick_local_session(self, target_session: 'BaseSession', actor_display_name: str):
+        """踢出连接在本节点上的会话，并向其所在频道广播"""
+        target_username = target_session.user.username
         target_display_name = target_session.user.display_name if target_session.user.display_name else target_session.user.username
 
-        kick_notification = translator.t('kick_notification', admin=actor_display_name)
+        kick_notification = target_session.t('kick_notification', admin=actor_display_name)
         await target_session.send(proto.create_system_message(kick_notification, level="warning"))
         target_channel_id = target_session.current_channel.id if target_session.current_channel else None
         await target_session.close()
-        if target_channel_id and actor_session.user:
-            kick_broadcast = translator.t('kick_broadcast', target_user=target_display_name, admin=actor_display_name)
-            await self.server.broadcast_to_channel(target_channel_id, proto.create_system_message(kick_broadcast, level="warning"))
+        if target_channel_id:
+            await self.server.broadcast_localized_to_channel(target_channel_id, 'kick_broadcast', level="warning", target_user=target_display_name, admin=actor_display_name)
         logging.info(f"用户 '{target_display_name}' (username: {target_username}) 已被 '{actor_display_name}' 踢出") # 修改: 记录 display_name 和 username
 
+    @command("createchannel", Arg("channel"), permission=PERM_MANAGE_CHANNELS, section=SECTION_CHANNEL_ADMIN)
     async def create_channel(self, session: 'BaseSession', channel_name: str): # 修改
-        required_roles = [ROLE_OWNER, ROLE_SUPERUSER]
-        if not session.user or not any(role in required_roles for role in session.user.roles):
-            await session.send(proto.create_error_message(translator.t('permission_denied', command='createchannel')))
-            return
         success, message, new_channel = await self.server.channel_manager.create_channel(channel_name)
         if success and new_channel:
             self.server.add_channel_to_session_manager(new_channel)
+            await self.server.backplane.publish(EVENT_CHANNEL_CREATED, {"channel_id": new_channel.id})
             # 创建成功后，向所有人广播新的频道列表
-            all_channels = self.server.channel_manager.get_all_channels()
-            await self.server.broadcast_to_all(proto.create_message("channel_list_update", {"channels": all_channels}))
+            await self.server.broadcast_to_all(self.server.channel_manager.channel_list_message())
         
         await session.send(proto.create_system_message(message))
 
+    @command("createvoicechannel", Arg("channel"), permission=PERM_MANAGE_CHANNELS, section=SECTION_CHANNEL_ADMIN)
     async def create_voice_channel(self, session: 'BaseSession', channel_name: str): # 添加
         """处理创建语音频道的动作"""
-        required_roles = [ROLE_OWNER, ROLE_SUPERUSER]
-        if not session.user or not any(role in required_roles for role in session.user.roles):
-            await session.send(proto.create_error_message(translator.t('permission_denied', command='createvoicechannel')))
-            return
-        
         # 调用 channel_manager 并指定类型为 'voice'
         success, message, new_channel = await self.server.channel_manager.create_channel(
             name=channel_name, 
@@ -99,17 +108,14 @@ class ActionHandler:
         
         if success and new_channel:
             self.server.add_channel_to_session_manager(new_channel)
+            await self.server.backplane.publish(EVENT_CHANNEL_CREATED, {"channel_id": new_channel.id})
             # 广播新的频道列表给所有用户
-            all_channels = self.server.channel_manager.get_all_channels()
-            await self.server.broadcast_to_all(proto.create_message("channel_list_update", {"channels": all_channels}))
+            await self.server.broadcast_to_all(self.server.channel_manager.channel_list_message())
         
         await session.send(proto.create_system_message(message))
 
+    @command("deletechannel", Arg("channel"), permission=PERM_MANAGE_CHANNELS, section=SECTION_CHANNEL_ADMIN)
     async def delete_channel(self, session: 'BaseSession', channel_name: str): # 修改
-        required_roles = [ROLE_OWNER, ROLE_SUPERUSER]
-        if not session.user or not any(role in required_roles for role in session.user.roles):
-            await session.send(proto.create_error_message(translator.t('permission_denied', command='deletechannel')))
-            return
         channel_to_delete = self.server.channel_manager.get_channel(channel_name)
         if not channel_to_delete:
             await session.send(proto.create_error_message(f"频道 #{channel_name} 不存在"))
@@ -117,8 +123,10 @@ class ActionHandler:
         success, message = await self.server.channel_manager.delete_channel(channel_name)
         if success:
             await self.server.remove_channel_from_session_manager(channel_to_delete)
+            await self.server.backplane.publish(EVENT_CHANNEL_DELETED, {"channel_id": channel_to_delete.id})
         await session.send(proto.create_system_message(message))
 
+    @command("join", Arg("channel"))
     async def join_channel(self, session: 'BaseSession', channel_name: str): # 修改
         channel = self.server.channel_manager.get_channel(channel_name)
         if not channel:
@@ -126,19 +134,16 @@ class ActionHandler:
             return
         await self.server.join_channel(session, channel)
 
+    @command("channels")
     async def list_channels(self, session: 'BaseSession'): # 修改
-        channels = self.server.channel_manager.get_all_channels()
-        payload = {"channels": channels}
-        await session.send(proto.create_message(proto.MSG_TYPE_CHANNEL_LIST, payload))
+        await session.send(self.server.channel_manager.channel_list_message(proto.MSG_TYPE_CHANNEL_LIST))
 
+    @command("files", section=SECTION_FILES)
     async def list_files(self, session: 'BaseSession'): # 修改
         await self.server.file_manager.list_files(session)
 
+    @command("deletefile", Arg("id", int, "文件ID必须是数字"), permission=PERM_DELETE_FILE, section=SECTION_FILES)
     async def delete_file(self, session: 'BaseSession', file_id: int): # 修改
-        required_roles = [ROLE_MODERATOR, ROLE_OPERATOR, ROLE_OWNER, ROLE_SUPERUSER]
-        if not session.user or not any(role in required_roles for role in session.user.roles):
-            await session.send(proto.create_error_message(translator.t('permission_denied', command='deletefile')))
-            return
         success, message = await self.server.file_manager.delete_file(session, file_id)
         response_func = proto.create_system_message if success else proto.create_error_message
         await session.send(response_func(message))
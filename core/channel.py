@@ -1,7 +1,9 @@
+import json
 import logging
 from typing import Dict, Optional, List, Any, Tuple
 
 from utils.database import db_manager
+from utils import protocol as proto
 
 class Channel:
     def __init__(self, id: int, name: str, topic: Optional[str] = None, created_at: Optional[str] = None, type: str = 'text'): # 修改
@@ -20,6 +22,13 @@ class ChannelManager:
         self.channels_by_name: Dict[str, Channel] = {}
         self.channels_by_id: Dict[int, Channel] = {}
         self.default_channel: Optional[Channel] = None
+        # 频道列表每次变化时递增；按版本缓存预编码的频道列表，变化时清空
+        self.version = 0
+        self._encoded: Dict[str, Any] = {}
+
+    def _changed(self):
+        self.version += 1
+        self._encoded.clear()
 
     async def initialize_channels(self):
         """从数据库加载频道，如果为空则创建默认频道"""
@@ -34,6 +43,7 @@ class ChannelManager:
             # 同时在两个字典中存储
             self.channels_by_name[channel.name.lower()] = channel
             self.channels_by_id[channel.id] = channel
+        self._changed()
         
         if self.channels_by_name:
             self.default_channel = list(self.channels_by_name.values())[0]
@@ -53,6 +63,7 @@ class ChannelManager:
             channel = Channel(**new_channel_data)
             self.channels_by_name[name] = channel
             self.channels_by_id[channel.id] = channel
+            self._changed()
             logging.info(f"新频道 #{name} (类型: {channel_type}) 已创建") # 修改
             return True, f"频道 #{name} 已成功创建", channel
         return False, "创建频道失败", None
@@ -66,11 +77,32 @@ class ChannelManager:
         
         channel = self.channels_by_name[name]
         await db_manager.execute("DELETE FROM channels WHERE id = ?", (channel.id,))
+        await db_manager.execute("DELETE FROM channel_members WHERE channel_id = ?", (channel.id,))
         del self.channels_by_name[name]
         del self.channels_by_id[channel.id]
+        self._changed()
         logging.info(f"频道 #{name} 已被删除")
         return True, f"频道 #{name} 已成功删除"
 
+    async def load_channel(self, channel_id: int) -> Optional[Channel]:
+        """从数据库加载 (其它节点创建的) 频道"""
+        channel_data = await db_manager.fetchone("SELECT * FROM channels WHERE id = ?", (channel_id,))
+        if not channel_data:
+            return None
+        channel = Channel(**channel_data)
+        self.channels_by_name[channel.name.lower()] = channel
+        self.channels_by_id[channel.id] = channel
+        self._changed()
+        return channel
+
+    def forget_channel(self, channel_id: int) -> Optional[Channel]:
+        """移除 (已被其它节点删除的) 频道，不操作数据库"""
+        channel = self.channels_by_id.pop(channel_id, None)
+        if channel:
+            self.channels_by_name.pop(channel.name.lower(), None)
+            self._changed()
+        return channel
+
     def get_channel(self, name: str) -> Optional[Channel]:
         """通过名称获取频道"""
         return self.channels_by_name.get(name.lower())
@@ -81,4 +113,21 @@ class ChannelManager:
         return self.channels_by_id.get(channel_id)
 
     def get_all_channels(self) -> List[Dict[str, Any]]:
-        return [{"id": ch.id, "name": ch.name, "topic": ch.topic, "type": ch.type} for ch in self.channels_by_name.values()] # 修改
\ No newline at end of file
+        channels = self._encoded.get('channels')
+        if channels is None:
+            channels = self._encoded['channels'] = [{"id": ch.id, "name": ch.name, "topic": ch.topic, "type": ch.type} for ch in self.channels_by_name.values()] # 修改
+        return channels
+
+    def channel_list_message(self, msg_type: str = proto.MSG_TYPE_CHANNEL_LIST_UPDATE) -> str:
+        """预编码的频道列表消息 (channel_list_update 或 /channels 的 channel_list)，频道不变时复用"""
+        message = self._encoded.get(msg_type)
+        if message is None:
+            message = self._encoded[msg_type] = proto.create_message(msg_type, {"channels": self.get_all_channels()})
+        return message
+
+    def channel_list_json(self) -> bytes:
+        """GET /api/channels 的响应体"""
+        body = self._encoded.get('json')
+        if body is None:
+            body = self._encoded['json'] = json.dumps({"channels": self.get_all_channels()}).encode('utf-8')
+        return body
\ No newline at end of file
@@ -1,91 +1,123 @@
-from typing import TYPE_CHECKING, Dict, Callable, List
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
 import logging
 
-from utils.i18n import translator
-from utils import protocol as proto
+from utils import protocol as proto, metrics
 from .constants import *
 
 if TYPE_CHECKING:
     from core.session import BaseSession
     from server import Server
 
+# 帮助信息中的分组，按此顺序显示
+SECTION_GENERAL = "Commands"
+SECTION_FILES = "File Commands"
+SECTION_CHANNEL_ADMIN = "Admin-Chan"
+SECTION_USER_ADMIN = "Admin-User"
+SECTIONS = (SECTION_GENERAL, SECTION_FILES, SECTION_CHANNEL_ADMIN, SECTION_USER_ADMIN)
+
+
+class Arg:
+    """命令参数声明: 名称、类型 (str/int) 以及转换失败时的提示"""
+    __slots__ = ('name', 'type', 'error')
+
+    def __init__(self, name: str, arg_type: type = str, error: Optional[str] = None):
+        self.name = name
+        self.type = arg_type
+        self.error = error or f"参数 {name} 格式不正确"
+
+
+class CommandSpec:
+    """一条命令的声明: 处理函数名、参数表、所需权限位和帮助信息"""
+    __slots__ = ('name', 'handler_name', 'args', 'permission', 'section', 'usage')
+
+    def __init__(self, name: str, handler_name: str, args: Tuple[Arg, ...], permission: int, section: str):
+        self.name = name
+        self.handler_name = handler_name
+        self.args = args
+        self.permission = permission
+        self.section = section
+        self.usage = '/' + ' '.join([name] + [f"<{arg.name}>" for arg in args])
+
+
+# 命令名 -> 声明，由 @command 在模块加载时填充
+COMMAND_REGISTRY: Dict[str, CommandSpec] = {}
+
+
+def command(name: str, *args: Arg, permission: int = 0, section: str = SECTION_GENERAL):
+    """
+    把 ActionHandler 的方法注册为聊天命令，方法签名为 (session, *参数)。
+    新命令只需在 ActionHandler 中添加带此装饰器的方法，无需修改分发代码。
+    """
+    def decorator(func: Callable) -> Callable:
+        COMMAND_REGISTRY[name] = CommandSpec(name, func.__name__, args, permission, section)
+        return func
+    return decorator
+
+
+class _BoundCommand:
+    """CommandHandler 初始化时为每条命令绑定好处理方法、参数转换函数和耗时指标"""
+    __slots__ = ('spec', 'handler', 'arity', 'converters', 'timer')
+
+    def __init__(self, spec: CommandSpec, handler: Callable):
+        self.spec = spec
+        self.handler = handler
+        self.arity = len(spec.args)
+        self.converters = tuple(arg.type for arg in spec.args)
+        self.timer = metrics.command_duration.labels(spec.name)
+
+
 class CommandHandler:
     def __init__(self, server: 'Server'):
         self.server = server
-        self.command_to_action_map = {
-            "kick": "kick_user",
-            "createchannel": "create_channel",
-            "createvoicechannel": "create_voice_channel", # 添加
-            "deletechannel": "delete_channel",
-            "join": "join_channel",
-            "deletefile": "delete_file",
-        }
-        self.commands: Dict[str, Callable] = {
-            "help": self.server.action_handler.show_help,
-            "list": self.server.action_handler.list_channel_users,
-            "whoami": self.server.action_handler.show_whoami,
-            "channels": self.server.action_handler.list_channels,
-            "files": self.server.action_handler.list_files,
-            # 移除: "verify": self.handle_verify_command,
-            **{cmd: self.handle_generic_command for cmd in self.command_to_action_map.keys()}
-        }
-    
-    async def handle_generic_command(self, session: 'BaseSession', command: str, args: List[str]):
-        """一个通用的处理器，用于需要参数的动作"""
-        action_name = self.command_to_action_map.get(command)
-        if not action_name:
-            await session.send(proto.create_error_message(f"未知命令: {command}"))
-            return
-            
-        action = getattr(self.server.action_handler, action_name, None)
-        if not action:
-            logging.error(f"Action '{action_name}' not found in ActionHandler for command '{command}'")
-            await session.send(proto.create_error_message("执行命令时发生内部错误"))
-            return
-
-        # 参数数量检查
-        if command in ["kick", "createchannel", "deletechannel", "join", "createvoicechannel"] and len(args) == 1: # 修改
-            await action(session, args[0])
-        elif command == "deletefile" and len(args) == 1:
+        self.commands: Dict[str, _BoundCommand] = {}
+        for name, spec in COMMAND_REGISTRY.items():
+            handler = getattr(self.server.action_handler, spec.handler_name, None)
+            if handler is None:
+                logging.error(f"Action '{spec.handler_name}' not found in ActionHandler for command '{name}'")
+                continue
+            self.commands[name] = _BoundCommand(spec, handler)
+
+    def available_commands(self, session: 'BaseSession') -> List[CommandSpec]:
+        """当前用户有权限使用的命令"""
+        if not session.user:
+            return []
+        return [bound.spec for bound in self.commands.values() if session.user.has_permission(bound.spec.permission)]
+
+    def _convert_args(self, bound: _BoundCommand, args: List[Any]) -> Tuple[Optional[list], Optional[str]]:
+        """返回 (转换后的参数, 错误信息)"""
+        if len(args) != bound.arity:
+            return None, f"'{bound.spec.name}' 命令的参数数量不正确，用法: {bound.spec.usage}"
+        converted = []
+        for arg, converter, value in zip(bound.spec.args, bound.converters, args):
             try:
-                await action(session, int(args[0]))
-            except ValueError:
-                await session.send(proto.create_error_message("文件ID必须是数字"))
-        else:
-             await session.send(proto.create_error_message(f"'{command}' 命令的参数数量不正确"))
-
-    # 移除: handle_verify_command 方法，因为逻辑已移至 session.py
-    # async def handle_verify_command(self, session: 'BaseSession', args: List[str]):
-    #     if len(args) != 2:
-    #         usage = "/verify <username> <token>"
-    #         await session.send(proto.create_error_message(f"用法: {usage}"))
-    #         return
-    #     username, token = args[0], args[1]
-    #     success, message = await self.server.action_handler.verify_email_token(username, token)
-    #     response_func = proto.create_system_message if success else proto.create_error_message
-    #     await session.send(response_func(message))
+                converted.append(converter(value))
+            except (TypeError, ValueError):
+                return None, arg.error
+        return converted, None
 
     async def handle(self, session: 'BaseSession', payload: dict):
-        command = payload.get("command", "").lower()
+        command_name = payload.get("command", "").lower()
         args = payload.get("args", [])
-        
-        # 移除: 对 verify 命令的特殊处理
-        # if command == 'verify':
-        #     await self.handle_verify_command(session, args)
-        #     return
-            
+        if not isinstance(args, list):
+            args = []
+
         if not session.user:
             await session.send(proto.create_error_message("请先登录")); return
 
-        handler = self.commands.get(command)
-        if not handler:
-            await session.send(proto.create_error_message(translator.t('command_not_found', command=command))); return
-        
+        bound = self.commands.get(command_name)
+        if not bound:
+            await session.send(proto.create_error_message(session.t('command_not_found', command=command_name))); return
+
+        if not session.user.has_permission(bound.spec.permission):
+            await session.send(proto.create_error_message(session.t('permission_denied', command=command_name))); return
+
+        converted, error = self._convert_args(bound, args)
+        if error:
+            await session.send(proto.create_error_message(error)); return
+
         try:
-            if command in self.command_to_action_map:
-                await handler(session, command, args)
-            else:
-                await handler(session)
+            with bound.timer.time():
+                await bound.handler(session, *converted)
         except Exception as e:
-            logging.error(f"执行命令 '{command}' 时出错: {e}", exc_info=True)
-            await session.send(proto.create_error_message(f"执行命令时发生内部错误"))
\ No newline at end of file
+            logging.error(f"执行命令 '{command_name}' 时出错: {e}", exc_info=True)
+            await session.send(proto.create_error_message(f"执行命令时发生内部错误"))
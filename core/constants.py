@@ -5,4 +5,25 @@ ROLE_SUPERUSER = "SuperUser"
 ROLE_OWNER = "Owner"
 ROLE_OPERATOR = "Operator"
 ROLE_MODERATOR = "Moderator"
-ROLE_MEMBER = "Member"
\ No newline at end of file
+ROLE_MEMBER = "Member"
+
+# 权限位: 角色在用户登录时合并为一个位掩码 (User.permissions)，权限检查只需一次按位与
+PERM_DELETE_FILE = 1 << 0
+PERM_KICK = 1 << 1
+PERM_MANAGE_CHANNELS = 1 << 2
+PERM_ALL = PERM_DELETE_FILE | PERM_KICK | PERM_MANAGE_CHANNELS
+
+ROLE_PERMISSIONS = {
+    ROLE_SUPERUSER: PERM_ALL,
+    ROLE_OWNER: PERM_ALL,
+    ROLE_OPERATOR: PERM_DELETE_FILE | PERM_KICK,
+    ROLE_MODERATOR: PERM_DELETE_FILE,
+    ROLE_MEMBER: 0,
+}
+
+
+def permissions_for_roles(roles) -> int:
+    mask = 0
+    for role in roles:
+        mask |= ROLE_PERMISSIONS.get(role, 0)
+    return mask
@@ -6,7 +6,7 @@ from typing import TYPE_CHECKING, Dict, Tuple, Any, Optional
 from datetime import datetime, timezone
 
 from .transfer_session import TransferSession
-from utils import protocol as proto
+from utils import protocol as proto, metrics
 from utils.database import db_manager
 from aiohttp import web
 from utils import config
@@ -91,14 +91,14 @@ class FileManager:
                 f.write(file_data)
             
             filesize = len(file_data)
+            metrics.upload_bytes.labels('http').inc(filesize)
             upload_time = datetime.now(timezone.utc).isoformat()
 
-            await db_manager.execute(
+            file_id = await db_manager.insert(
                 """INSERT INTO files (channel_id, uploader_id, original_filename, stored_filename, filesize, upload_time)
                    VALUES (?, ?, ?, ?, ?, ?)""",
                 (current_channel_id, user_id, original_filename, stored_filename, filesize, upload_time)
             )
-            file_id = await db_manager.fetchval("SELECT last_insert_rowid()")
             
             uploader_user = await self.server.user_manager.get_user_by_id(user_id)
             if not uploader_user:
@@ -112,7 +112,7 @@ class FileManager:
                 "url": f"/uploads/{stored_filename}"
             })
 
-            await db_manager.add_message(
+            message_id = await db_manager.add_message(
                 channel_id=current_channel_id,
                 user_id=user_id,
                 username=uploader_user.username,
@@ -120,6 +120,7 @@ class FileManager:
             )
 
             broadcast_payload = {
+                "id": message_id,
                 "sender_username": uploader_user.username,
                 "sender_display_name": uploader_user.display_name or uploader_user.username,
                 "message": message_content,
@@ -133,7 +134,8 @@ class FileManager:
 
             await self.server.broadcast_to_channel(
                 current_channel_id,
-                proto.create_message(proto.MSG_TYPE_CHAT_BROADCAST, broadcast_payload)
+                proto.create_message(proto.MSG_TYPE_CHAT_BROADCAST, broadcast_payload),
+                message_id=message_id
             )
 
             logging.info(f"用户 {uploader_user.display_name or uploader_user.username} 成功上传了文件: {original_filename}")
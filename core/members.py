@@ -0,0 +1,212 @@
+# server/core/members.py
+"""
+频道成员与按频道的成员列表
+
+用户第一次进入某个频道时成为它的成员 (channel_members 表)。进入频道时只下发该频道成员列表的第一页
+(按用户名排序，每页 page_size 个)，其余页由客户端用 channel_members_request {channel_id, cursor, limit}
+按需获取，进入频道的开销只与该频道的成员数有关，与全服注册用户数无关。
+用户上下线或修改资料时，只向聚焦在其所属频道的会话推送 channel_member_update (只含变化的成员)，
+update_delay 时间内的多次变化合并为一次推送 (例如重启后大量客户端同时重连)。
+内存中只缓存本节点在线用户所属的频道集合，用于判断进入频道时是否需要写入成员关系。
+"""
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+from utils.config import config
+from utils.database import db_manager
+from utils import protocol as proto, metrics
+from core.session import BaseSession, WebSocketClientSession
+
+if TYPE_CHECKING:
+    from core.user import User
+    from server import Server
+
+_update_fanout = metrics.broadcast_fanout.labels('members')
+_update_duration = metrics.broadcast_duration.labels('members')
+
+# SQLite 单条语句的参数个数有上限，IN 列表按此分批
+_CHUNK_SIZE = 500
+
+_PAGE_QUERY = """
+    SELECT u.id, u.username, u.display_name, u.avatar_filename
+    FROM channel_members m
+    JOIN users u ON u.id = m.user_id
+    WHERE m.channel_id = ? AND u.username > ?
+    ORDER BY u.username
+    LIMIT ?
+"""
+
+
+def _chunks(items: List[Any]):
+    for i in range(0, len(items), _CHUNK_SIZE):
+        yield items[i:i + _CHUNK_SIZE]
+
+
+def _placeholders(items: List[Any]) -> str:
+    return ', '.join('?' * len(items))
+
+
+class ChannelMembers:
+    def __init__(self, server: 'Server'):
+        self.server = server
+        self.page_size = int(config.get('server.members.page_size', 100))
+        self.max_page_size = int(config.get('server.members.max_page_size', 500))
+        self.update_delay = config.get('server.members.update_delay_ms', 100) / 1000
+        # user_id -> 所属频道，只缓存本节点在线的用户
+        self._user_channels: Dict[int, Set[int]] = {}
+        # 待推送的变化: 需要在其所有频道更新的用户名，以及只需在某个频道更新的用户名 (新成员)
+        self._pending_users: Set[str] = set()
+        self._pending_channels: Dict[int, Set[str]] = {}
+        self._update_task: Optional[asyncio.Task] = None
+
+    async def ensure_member(self, channel_id: int, user: 'User') -> bool:
+        """用户进入频道时调用，返回是否为新成员"""
+        channels = self._user_channels.get(user.id)
+        if channels is None:
+            rows = await db_manager.fetchall("SELECT channel_id FROM channel_members WHERE user_id = ?", (user.id,))
+            channels = self._user_channels[user.id] = {row['channel_id'] for row in rows}
+        if channel_id in channels:
+            return False
+        added = await db_manager.execute("INSERT OR IGNORE INTO channel_members (channel_id, user_id) VALUES (?, ?)", (channel_id, user.id))
+        channels.add(channel_id)
+        return added > 0
+
+    def forget_user(self, user_id: int):
+        self._user_channels.pop(user_id, None)
+
+    def drop_channel(self, channel_id: int):
+        for channels in self._user_channels.values():
+            channels.discard(channel_id)
+        self._pending_channels.pop(channel_id, None)
+
+    async def count(self, channel_id: int) -> int:
+        return await db_manager.fetchval("SELECT COUNT(*) FROM channel_members WHERE channel_id = ?", (channel_id,)) or 0
+
+    async def _describe(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """补充角色和在线状态，字段与 protocol.USER_LIST_FIELDS 一致"""
+        roles: Dict[int, List[str]] = {row['id']: [] for row in rows}
+        for chunk in _chunks(list(roles)):
+            role_rows = await db_manager.fetchall(
+                f"SELECT ur.user_id, r.name FROM user_roles ur JOIN roles r ON ur.role_id = r.id WHERE ur.user_id IN ({_placeholders(chunk)})",
+                tuple(chunk)
+            )
+            for row in role_rows:
+                roles[row['user_id']].append(row['name'])
+        is_online = self.server.user_manager.is_online
+        return [{
+            "id": row['id'],
+            "username": row['username'],
+            "display_name": row['display_name'] or row['username'],
+            "roles": roles[row['id']],
+            "avatar_url": f"/uploads/avatars/{row['avatar_filename']}" if row['avatar_filename'] else None,
+            "status": 'online' if is_online(row['username']) else 'offline'
+        } for row in rows]
+
+    async def page(self, channel_id: int, cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """按用户名取 cursor 之后的一页成员，返回 (成员, 下一页的 cursor 或 None)"""
+        limit = max(1, min(limit or self.page_size, self.max_page_size))
+        rows = await db_manager.fetchall(_PAGE_QUERY, (channel_id, cursor or '', limit + 1))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1]['username']
+        return await self._describe(rows), next_cursor
+
+    async def page_payload(self, session: BaseSession, channel_id: int, cursor: Optional[str] = None, limit: Optional[int] = None) -> Dict[str, Any]:
+        """join_channel_success / channel_members 中的成员列表部分，第一页附带成员总数"""
+        users, next_cursor = await self.page(channel_id, cursor, limit)
+        payload = _user_list_payload(session, users)
+        payload["members_cursor"] = next_cursor
+        if not cursor:
+            # 只有一页时不必再单独计数
+            payload["member_count"] = len(users) if next_cursor is None else await self.count(channel_id)
+        return payload
+
+    async def note_changed(self, username: str, channel_id: Optional[int] = None):
+        """
+        用户的在线状态或资料发生变化 (channel_id 为 None)，或成为 channel_id 的新成员，
+        在 update_delay 之后向相关频道推送
+        """
+        if self.server.draining:
+            return
+        if channel_id is None:
+            self._pending_users.add(username)
+        else:
+            self._pending_channels.setdefault(channel_id, set()).add(username)
+        if self.update_delay <= 0:
+            await self.flush()
+            return
+        if self._update_task is None:
+            self._update_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        try:
+            await asyncio.sleep(self.update_delay)
+        finally:
+            self._update_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"推送频道成员更新时出错: {e}", exc_info=True)
+
+    async def flush(self):
+        usernames, self._pending_users = self._pending_users, set()
+        targets, self._pending_channels = self._pending_channels, {}
+        added = set(targets)
+        for chunk in _chunks(list(usernames)):
+            rows = await db_manager.fetchall(
+                f"SELECT m.channel_id, u.username FROM users u JOIN channel_members m ON m.user_id = u.id WHERE u.username IN ({_placeholders(chunk)})",
+                tuple(chunk)
+            )
+            for row in rows:
+                targets.setdefault(row['channel_id'], set()).add(row['username'])
+        # 只推送给本节点上聚焦在这些频道的会话
+        targets = {channel_id: names for channel_id, names in targets.items() if self.server.channel_sessions.get(channel_id)}
+        if not targets:
+            return
+
+        infos: Dict[str, Dict[str, Any]] = {}
+        for chunk in _chunks(list(set().union(*targets.values()))):
+            rows = await db_manager.fetchall(
+                f"SELECT id, username, display_name, avatar_filename FROM users WHERE username IN ({_placeholders(chunk)})",
+                tuple(chunk)
+            )
+            for info in await self._describe(rows):
+                infos[info['username']] = info
+        counts = {channel_id: await self.count(channel_id) for channel_id in added if channel_id in targets}
+
+        start = time.perf_counter()
+        tasks = []
+        for channel_id, names in targets.items():
+            users = [infos[name] for name in sorted(names) if name in infos]
+            if not users:
+                continue
+            messages: Dict[bool, str] = {}
+            for s in self.server.channel_sessions.get(channel_id, ()):
+                if not s.user or not isinstance(s, WebSocketClientSession) or s.ws.closed:
+                    continue
+                compact = proto.CAPABILITY_COMPACT_USER_LIST in s.capabilities
+                message = messages.get(compact)
+                if message is None:
+                    payload = {"channel_id": channel_id, **_user_list_payload(s, users)}
+                    if channel_id in counts:
+                        payload["member_count"] = counts[channel_id]
+                    message = messages[compact] = proto.create_message(proto.MSG_TYPE_CHANNEL_MEMBER_UPDATE, payload)
+                tasks.append(s.send(message))
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        _update_fanout.observe(len(tasks))
+        _update_duration.observe(time.perf_counter() - start)
+
+    def stop(self):
+        if self._update_task:
+            self._update_task.cancel()
+            self._update_task = None
+
+
+def _user_list_payload(session: BaseSession, users: List[Dict[str, Any]]) -> Dict[str, Any]:
+    if proto.CAPABILITY_COMPACT_USER_LIST in session.capabilities:
+        return {"users_compact": proto.compact_user_list(users)}
+    return {"users": users}
@@ -1,34 +1,94 @@
 import asyncio
 import logging
-from typing import Optional, TYPE_CHECKING
+import time
+from typing import Optional, List, Set, Union, TYPE_CHECKING
 from datetime import datetime, timezone
 from abc import ABC, abstractmethod
 
-from utils import protocol as proto
+from utils import protocol as proto, framing, metrics
 from utils.config import config
 from utils.database import db_manager
+from utils.compression import ws_compression_stats
+from utils.logger import LogRateLimiter
+from utils.i18n import translator
+from utils.ratelimit import rate_limiter, peer_ip, RateLimitExceeded, THROTTLE, REJECT, DISCONNECT
+from utils.admission import admission
+from utils.timerwheel import timer_wheel, TimerEntry
+from utils.search import message_search, SearchError, ORDER_RANK
 from core.user import User
 
 if TYPE_CHECKING:
     from server import Server
     from core.channel import Channel
     from aiohttp import web
-    from aiortc import RTCPeerConnection, RTCSessionDescription # 添加
+    from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate # 添加
 
 from aiohttp import web_ws
 
+_SHOW_USER_COMMANDS = config.get('logging.show_user_commands', True)
+_SHOW_USER_CHATS = config.get('logging.show_user_chats', True)
+# 聊天/命令日志是每条消息一次的热路径，按配置采样和限速
+_user_log_limiter = LogRateLimiter(
+    config.get('logging.user_log_sample_rate', 1),
+    config.get('logging.user_log_rate_limit', 50)
+)
+# 出站消息合并: 声明了 batch 能力的客户端，窗口内的多条消息合并为一个 batch 帧
+_BATCH_ENABLED = config.get('server.batching.enabled', True)
+_BATCH_WINDOW = config.get('server.batching.window_ms', 5) / 1000
+_BATCH_MAX_MESSAGES = config.get('server.batching.max_messages', 64)
+_BATCH_MAX_BYTES = config.get('server.batching.max_bytes', 65536)
+# 会话超时的原因
+TIMEOUT_AUTH = 'auth'
+TIMEOUT_IDLE = 'idle'
+TIMEOUT_HEARTBEAT = 'heartbeat'
+_session_timeouts = metrics.registry.counter('session_timeouts_total', '因超时关闭的会话数', ('reason',))
+_outbox_overflows = metrics.registry.counter('tcp_outbox_overflow_total', '因待发送数据超过上限而断开的 TCP 连接数')
+_batch_size = metrics.registry.histogram('outbound_batch_size', '每个出站帧合并的消息数 (仅启用合并的会话)', buckets=metrics.SIZE_BUCKETS)
+
+# 只提示一次 aiohttp 不支持按帧压缩
+_per_frame_compression_warned = False
+
 class BaseSession(ABC):
     def __init__(self, server: 'Server', peername: str, session_type: str):
         self.server = server
         self.user: Optional[User] = None
         self.current_channel: Optional[Channel] = None
         self.current_voice_channel: Optional[Channel] = None 
+        # 订阅的频道 ID (包括当前频道)，None 表示客户端未使用多频道订阅
+        self.subscriptions: Optional[Set[int]] = None
         self.rtc_peer_connection: Optional['RTCPeerConnection'] = None # 添加
+        # 在远端描述设置之前到达的 ICE candidate 暂存于此 (trickle ICE)
+        self._pending_ice_candidates: List[Optional['RTCIceCandidate']] = []
+        self._webrtc_lock = asyncio.Lock()
+        self._renegotiation_pending = False
         self.peername = peername 
-        self.lang = config.get('server.language', 'en_US')
+        self.set_language(None)
         self.is_resumed_session = False
         self.session_type = session_type
+        # 客户端在 auth_request 中声明的可选协议能力
+        self.capabilities: Set[str] = set()
+        # 合并窗口 (秒)，0 表示逐条发送
+        self._batch_window = 0.0
+        self._batch: List[str] = []
+        self._batch_bytes = 0
+        self._batch_timer: Optional[asyncio.TimerHandle] = None
+        # 同一时刻只有一个 flush 在写，后来的调用者等它写完，返回时缓冲区中它之前加入的消息都已发出
+        self._flush_lock = asyncio.Lock()
         self._main_loop_task: Optional[asyncio.Task] = None
+        # 认证期限、空闲超时和心跳由全局时间轮统一检查，收到消息时只更新 last_activity
+        self.last_activity = time.monotonic()
+        self._auth_deadline = self.last_activity + admission.auth_timeout
+        # 已登录会话多久没有收到任何消息后断开，0 为不限
+        self.idle_timeout = 0.0
+        # 多久没有收到消息时发送 ping，ping 之后 heartbeat_interval / 2 内仍无响应则断开，0 为不发送
+        self.heartbeat_interval = 0.0
+        self._ping_sent_at: Optional[float] = None
+        self._liveness_timer: Optional[TimerEntry] = None
+        self.ip = peer_ip(peername)
+        self._rate_state = rate_limiter.new_session_state()
+        # 是否占用了准入控制的名额，以及是否已从未登录名额转为已登录
+        self.admitted = False
+        self.admission_authenticated = False
 
     @abstractmethod
     async def handle_session(self):
@@ -36,31 +96,162 @@ class BaseSession(ABC):
         pass
 
     @abstractmethod
-    async def send(self, message: str):
-        """向客户端发送消息"""
+    async def _send_frame(self, message: str):
+        """把一条 (可能是 batch) 消息作为一帧写给客户端"""
         pass
 
+    async def send(self, message: str):
+        """向客户端发送消息；启用合并时先进入缓冲区，窗口结束或缓冲区满时一并发出"""
+        metrics.messages_out.labels(proto.peek_message_type(message)).inc()
+        if not self._batch_window:
+            await self._send_frame(message)
+            return
+        self._batch.append(message)
+        self._batch_bytes += len(message)
+        if len(self._batch) >= _BATCH_MAX_MESSAGES or self._batch_bytes >= _BATCH_MAX_BYTES:
+            await self.flush()
+        elif self._batch_timer is None:
+            self._batch_timer = asyncio.get_running_loop().call_later(self._batch_window, self._on_batch_timer)
+
+    def _on_batch_timer(self):
+        self._batch_timer = None
+        self.server.spawn(self.flush())
+
+    def _take_batch(self) -> List[str]:
+        count = size = 0
+        for message in self._batch:
+            if count and (count >= _BATCH_MAX_MESSAGES or size + len(message) > _BATCH_MAX_BYTES):
+                break
+            count += 1
+            size += len(message)
+        messages = self._batch[:count]
+        del self._batch[:count]
+        self._batch_bytes -= size
+        return messages
+
+    async def flush(self):
+        """立即发出缓冲区中的消息；只有一条时按原样发送，不包装为 batch"""
+        if self._batch_timer:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        async with self._flush_lock:
+            while self._batch:
+                messages = self._take_batch()
+                _batch_size.observe(len(messages))
+                await self._send_frame(messages[0] if len(messages) == 1 else proto.create_batch_message(messages))
+
     @abstractmethod
     async def close(self):
         """关闭会话"""
         pass
 
-    async def _handle_message_data(self, message_data: str):
+    async def _send_ping(self):
+        """发送传输层的心跳探测，不支持的传输忽略"""
+        pass
+
+    def _arm_liveness(self, now: float):
+        deadlines = []
+        if not self.user:
+            deadlines.append(self._auth_deadline)
+        elif self.idle_timeout:
+            deadlines.append(self.last_activity + self.idle_timeout)
+        if self.heartbeat_interval:
+            if self._ping_sent_at is None:
+                deadlines.append(self.last_activity + self.heartbeat_interval)
+            else:
+                deadlines.append(self._ping_sent_at + self.heartbeat_interval / 2)
+        self._liveness_timer = timer_wheel.schedule(min(deadlines), self._check_liveness) if deadlines else None
+
+    def _cancel_liveness(self):
+        if self._liveness_timer:
+            self._liveness_timer.cancel()
+            self._liveness_timer = None
+
+    def _check_liveness(self, now: float):
+        """时间轮回调: 判断会话是否超时，未超时则按最后活动时间重新登记下一次检查"""
+        self._liveness_timer = None
+        reason = None
+        if not self.user:
+            if now >= self._auth_deadline:
+                reason = TIMEOUT_AUTH
+        elif self.idle_timeout and now - self.last_activity >= self.idle_timeout:
+            reason = TIMEOUT_IDLE
+        if reason is None and self.heartbeat_interval:
+            if self._ping_sent_at is not None and self.last_activity >= self._ping_sent_at:
+                # ping 之后收到了 pong 或其它消息
+                self._ping_sent_at = None
+            if self._ping_sent_at is not None:
+                if now - self._ping_sent_at >= self.heartbeat_interval / 2:
+                    reason = TIMEOUT_HEARTBEAT
+            elif now - self.last_activity >= self.heartbeat_interval:
+                self._ping_sent_at = now
+                self.server.spawn(self._send_ping())
+        if reason:
+            _session_timeouts.labels(reason).inc()
+            self.server.spawn(self._close_on_timeout(reason))
+        else:
+            self._arm_liveness(now)
+
+    async def _close_on_timeout(self, reason: str):
+        if reason == TIMEOUT_AUTH:
+            logging.info(f"{self.session_type} 认证超时，关闭连接 {self.peername}")
+            await self.send(proto.create_error_message("认证超时"))
+        elif reason == TIMEOUT_IDLE:
+            logging.info(f"用户 '{self.user.display_name or self.user.username}' ({self.session_type}) 空闲超时，关闭连接")
+        else:
+            logging.info(f"{self.session_type} 客户端 {self.peername} 心跳超时，关闭连接")
+        await self.close()
+
+    def set_language(self, requested: Optional[str]):
+        """解析客户端请求的语言并绑定对应的已编译 Catalog，之后通过 self.t(key, ...) 取翻译"""
+        self.lang = translator.resolve_language(requested)
+        self.t = translator.catalog(self.lang).t
+
+    def _log_user_activity(self, kind: str, content):
+        user_name = self.user.display_name if self.user.display_name else self.user.username
+        channel_name = self.current_channel.name if self.current_channel else 'N/A'
+        suppressed = _user_log_limiter.take_suppressed()
+        suffix = f" (此前省略 {suppressed} 条)" if suppressed else ""
+        logging.info("[#%s] [%s]: [%s] %s%s", channel_name, user_name, kind, content, suffix,
+                     extra={"event": kind, "channel": channel_name, "user": self.user.username, "suppressed": suppressed})
+
+    async def _handle_message_data(self, message_data: Union[str, bytes]):
         json_msg = proto.parse_message(message_data)
         if not json_msg: return
 
         msg_type, payload = json_msg.get("type"), json_msg.get("payload", {})
-        
+        if not isinstance(msg_type, str):
+            # type 可能是列表/对象等不可哈希的值，无法用于查表
+            msg_type = None
+        metrics.messages_in.labels(msg_type if msg_type in proto.C2S_MESSAGE_TYPES else "other").inc()
+
+        if not await self._check_rate_limit(msg_type):
+            return
+
         if not self.user:
             if msg_type == proto.MSG_TYPE_AUTH_REQUEST:
+                if payload.get("lang"):
+                    self.set_language(payload.get("lang"))
+                capabilities = payload.get("capabilities")
+                if isinstance(capabilities, list):
+                    self.capabilities = {c for c in capabilities if isinstance(c, str)}
+                    if _BATCH_ENABLED and proto.CAPABILITY_BATCH in self.capabilities:
+                        # 认证成功后的 auth_success、频道列表、加入频道等一连串消息即可合并发出
+                        self._batch_window = _BATCH_WINDOW
                 success, reason, user, token, is_resume = await self._handle_authentication(payload)
                 if success:
                     if user: 
                         self.user = user
                         self.is_resumed_session = is_resume
+                        if self.admitted and not self.admission_authenticated:
+                            self.admission_authenticated = True
+                            admission.authenticated()
                     
                     response_payload = {"message": reason}
-                    if token: response_payload["token"] = token
+                    if token:
+                        response_payload["token"] = token
+                        # 客户端据此设置 Cookie 的有效期，与服务器端令牌的 TTL 一致
+                        response_payload["token_ttl"] = self.server.user_manager.session_ttl
                     if user:
                         user_info_with_roles = self.server._format_user_info(user)
                         response_payload["user"] = user_info_with_roles
@@ -68,9 +259,10 @@ class BaseSession(ABC):
                     await self.send(proto.create_message(proto.MSG_TYPE_AUTH_SUCCESS, response_payload))
                     
                     if self.user:
-                        all_channels = self.server.channel_manager.get_all_channels()
-                        await self.send(proto.create_message("channel_list_update", {"channels": all_channels}))
-                        await self.server.join_default_channel(self)
+                        await self.server.announce_user_online(self)
+                        await self.send(self.server.channel_manager.channel_list_message())
+                        # 恢复会话时可带上最后收到的频道事件序号，只补发缺失的事件
+                        await self.server.join_initial_channel(self, payload.get("replay") if is_resume else None)
                     else:
                         await self.close()
 
@@ -79,22 +271,19 @@ class BaseSession(ABC):
             else:
                 await self.send(proto.create_error_message("请先登录或验证"))
         else:
-            log_user_name = self.user.display_name if self.user.display_name else self.user.username
-            log_channel_name = self.current_channel.name if self.current_channel else 'N/A'
-            log_prefix = f"[#{log_channel_name}] [{log_user_name}]:"
-            
             if msg_type == proto.MSG_TYPE_COMMAND:
-                if config.get('logging.show_user_commands'): logging.info(f"{log_prefix} [命令] {payload}")
+                if _SHOW_USER_COMMANDS and _user_log_limiter.allow(): self._log_user_activity("命令", payload)
                 await self.server.command_handler.handle(self, payload)
             elif msg_type == proto.MSG_TYPE_CHAT_MESSAGE:
                 content = payload.get("message", "")
                 if not content: return 
-                if config.get('logging.show_user_chats'): logging.info(f"{log_prefix} [聊天] {content}")
+                if _SHOW_USER_CHATS and _user_log_limiter.allow(): self._log_user_activity("聊天", content)
                 if self.current_channel and self.user:
-                    await db_manager.add_message(self.current_channel.id, self.user.id, self.user.username, content)
+                    message_id = await db_manager.add_message(self.current_channel.id, self.user.id, self.user.username, content)
                     
                     client_msg_id = payload.get("client_msg_id")
                     broadcast_payload = {
+                        "id": message_id,
                         "sender_username": self.user.username,
                         "sender_display_name": self.user.display_name if self.user.display_name else self.user.username,
                         "message": content,
@@ -105,7 +294,7 @@ class BaseSession(ABC):
                         broadcast_payload["client_msg_id"] = client_msg_id
                         
                     broadcast = proto.create_message(proto.MSG_TYPE_CHAT_BROADCAST, broadcast_payload)
-                    await self.server.broadcast_to_channel(self.current_channel.id, broadcast)
+                    await self.server.broadcast_to_channel(self.current_channel.id, broadcast, message_id=message_id)
             
             # 修改: 语音信令处理逻辑
             elif msg_type == proto.MSG_TYPE_JOIN_VOICE:
@@ -119,30 +308,164 @@ class BaseSession(ABC):
                     await self.server.leave_voice_channel(self, self.current_voice_channel)
 
             elif msg_type == proto.MSG_TYPE_WEBRTC_SIGNAL:
-                if self.rtc_peer_connection:
-                    from aiortc import RTCSessionDescription
-                    signal_data = payload.get("data")
-                    if signal_data and signal_data.get("type") == "offer":
-                        try:
-                            offer = RTCSessionDescription(sdp=signal_data["sdp"], type=signal_data["type"])
-                            await self.rtc_peer_connection.setRemoteDescription(offer)
-                            answer = await self.rtc_peer_connection.createAnswer()
-                            await self.rtc_peer_connection.setLocalDescription(answer)
-                            
-                            response_payload = {
-                                "data": {"sdp": self.rtc_peer_connection.localDescription.sdp, "type": self.rtc_peer_connection.localDescription.type}
-                            }
-                            await self.send(proto.create_message(proto.MSG_TYPE_WEBRTC_SIGNAL, response_payload))
-                        except Exception as e:
-                            logging.error(f"[SFU] 处理 offer 时出错: {e}", exc_info=True)
-                            await self.send(proto.create_error_message(f"WebRTC Offer Error: {e}"))
-                    elif signal_data and signal_data.get("type") == "ice_candidate":
-                        # 在 aiortc 中，ICE candidate 通常由库自动处理，客户端无需手动发送
-                        pass
+                await self._handle_webrtc_signal(payload.get("data"))
             
             elif msg_type == proto.MSG_TYPE_DOWNLOAD_REQUEST:
                 await self.server.file_manager.request_download(self, payload.get('file_id',0))
 
+            elif msg_type == proto.MSG_TYPE_SEARCH_REQUEST:
+                await self._handle_search_request(payload)
+
+            elif msg_type == proto.MSG_TYPE_SUBSCRIBE_CHANNELS:
+                channel_ids = payload.get("channel_ids")
+                await self.server.subscribe_channels(self, channel_ids if isinstance(channel_ids, list) else [])
+
+            elif msg_type == proto.MSG_TYPE_CHANNEL_MEMBERS_REQUEST:
+                await self._handle_channel_members_request(payload)
+
+    async def _handle_search_request(self, payload: dict):
+        """search_request: {query, channel_id?(默认当前频道), limit?, cursor?, order?}"""
+        channel_id = payload.get("channel_id")
+        if channel_id is None and self.current_channel:
+            channel_id = self.current_channel.id
+        try:
+            channel_id = int(channel_id)
+        except (TypeError, ValueError):
+            await self.send(proto.create_error_message("请指定要搜索的频道")); return
+        if not self.server.channel_manager.get_channel_by_id(channel_id):
+            await self.send(proto.create_error_message("频道不存在")); return
+        query = payload.get("query", "")
+        try:
+            result = await message_search.search(channel_id, query, payload.get("limit"), payload.get("cursor"), payload.get("order") or ORDER_RANK)
+        except SearchError as e:
+            await self.send(proto.create_error_message(str(e), code="search_invalid")); return
+        result.update({"channel_id": channel_id, "query": query})
+        if payload.get("request_id") is not None:
+            result["request_id"] = payload.get("request_id")
+        await self.send(proto.create_message(proto.MSG_TYPE_SEARCH_RESULTS, result))
+
+    async def _handle_channel_members_request(self, payload: dict):
+        """channel_members_request: {channel_id?(默认当前频道), cursor?, limit?}"""
+        channel_id = payload.get("channel_id")
+        if channel_id is None and self.current_channel:
+            channel_id = self.current_channel.id
+        try:
+            channel_id = int(channel_id)
+            limit = int(payload["limit"]) if payload.get("limit") is not None else None
+        except (TypeError, ValueError):
+            await self.send(proto.create_error_message("无效的成员列表请求")); return
+        if not self.server.channel_manager.get_channel_by_id(channel_id):
+            await self.send(proto.create_error_message("频道不存在")); return
+        cursor = payload.get("cursor")
+        result = await self.server.channel_members.page_payload(self, channel_id, cursor if isinstance(cursor, str) else None, limit)
+        result["channel_id"] = channel_id
+        if payload.get("request_id") is not None:
+            result["request_id"] = payload.get("request_id")
+        await self.send(proto.create_message(proto.MSG_TYPE_CHANNEL_MEMBERS, result))
+
+    async def _check_rate_limit(self, msg_type: str) -> bool:
+        """按会话/用户/IP 令牌桶限速，返回是否继续处理这条消息"""
+        result, seconds = rate_limiter.check(self._rate_state, msg_type, self.ip, self.user.username if self.user else None)
+        if result == THROTTLE:
+            await asyncio.sleep(seconds)
+        elif result == REJECT:
+            await self.send(proto.create_error_message(self.t('rate_limited', seconds=max(1, round(seconds))), code="rate_limited"))
+            return False
+        elif result == DISCONNECT:
+            await self.send(proto.create_error_message(self.t('rate_limit_disconnect'), code="rate_limited"))
+            # 由主循环按连接错误处理并在 finally 中关闭会话
+            raise RateLimitExceeded(f"{self.peername} 反复超出限速")
+        return True
+
+    def reset_webrtc_state(self):
+        """在加入/离开语音频道时清理信令状态"""
+        self._pending_ice_candidates.clear()
+        self._renegotiation_pending = False
+
+    async def _send_webrtc_signal(self, description: 'RTCSessionDescription'):
+        await self.send(proto.create_message(proto.MSG_TYPE_WEBRTC_SIGNAL, {
+            "data": {"sdp": description.sdp, "type": description.type}
+        }))
+
+    @staticmethod
+    def _parse_ice_candidate(signal_data: dict) -> Optional['RTCIceCandidate']:
+        """将浏览器 RTCIceCandidate.toJSON() 格式转换为 aiortc 对象，None 表示 end-of-candidates"""
+        from aiortc.sdp import candidate_from_sdp
+        candidate_str = signal_data.get("candidate")
+        if not candidate_str:
+            return None
+        if candidate_str.startswith("candidate:"):
+            candidate_str = candidate_str[len("candidate:"):]
+        candidate = candidate_from_sdp(candidate_str)
+        candidate.sdpMid = signal_data.get("sdpMid")
+        candidate.sdpMLineIndex = signal_data.get("sdpMLineIndex")
+        return candidate
+
+    async def _flush_pending_ice_candidates(self):
+        pc = self.rtc_peer_connection
+        pending, self._pending_ice_candidates = self._pending_ice_candidates, []
+        for candidate in pending:
+            await pc.addIceCandidate(candidate)
+
+    async def _handle_webrtc_signal(self, signal_data: Optional[dict]):
+        """
+        处理 WebRTC 信令: 客户端 offer/answer 以及 trickle ICE candidate。
+        服务器在协商冲突 (glare) 时作为 "impolite" 一方，客户端负责回滚。
+        """
+        pc = self.rtc_peer_connection
+        if not pc or not signal_data:
+            return
+        from aiortc import RTCSessionDescription
+        signal_type = signal_data.get("type")
+        try:
+            if signal_type == "offer":
+                async with self._webrtc_lock:
+                    if pc.signalingState != "stable":
+                        if config.get('logging.debug'): logging.debug(f"[SFU] 协商冲突，忽略来自 {self.peername} 的 offer")
+                        return
+                    await pc.setRemoteDescription(RTCSessionDescription(sdp=signal_data["sdp"], type="offer"))
+                    await self._flush_pending_ice_candidates()
+                    answer = await pc.createAnswer()
+                    await pc.setLocalDescription(answer)
+                    await self._send_webrtc_signal(pc.localDescription)
+                if self._renegotiation_pending:
+                    await self.renegotiate_webrtc()
+            elif signal_type == "answer":
+                async with self._webrtc_lock:
+                    if pc.signalingState != "have-local-offer":
+                        return
+                    await pc.setRemoteDescription(RTCSessionDescription(sdp=signal_data["sdp"], type="answer"))
+                    await self._flush_pending_ice_candidates()
+                if self._renegotiation_pending:
+                    await self.renegotiate_webrtc()
+            elif signal_type == "ice_candidate":
+                candidate = self._parse_ice_candidate(signal_data)
+                if pc.remoteDescription is None:
+                    self._pending_ice_candidates.append(candidate)
+                else:
+                    await pc.addIceCandidate(candidate)
+        except Exception as e:
+            logging.error(f"[SFU] 处理 {signal_type} 信令时出错: {e}", exc_info=True)
+            await self.send(proto.create_error_message(f"WebRTC Signal Error: {e}"))
+
+    async def renegotiate_webrtc(self):
+        """SFU 向该会话的 PeerConnection 新增了转发轨道时，由服务器发起重新协商"""
+        pc = self.rtc_peer_connection
+        if not pc or pc.connectionState == "closed":
+            return
+        try:
+            async with self._webrtc_lock:
+                # 初始协商尚未完成或正处于协商中，待本轮结束后再发起
+                if pc.signalingState != "stable" or pc.remoteDescription is None:
+                    self._renegotiation_pending = True
+                    return
+                self._renegotiation_pending = False
+                offer = await pc.createOffer()
+                await pc.setLocalDescription(offer)
+                await self._send_webrtc_signal(pc.localDescription)
+        except Exception as e:
+            logging.error(f"[SFU] 向 {self.peername} 发起重新协商时出错: {e}", exc_info=True)
+
     async def _handle_authentication(self, payload: dict) -> tuple[bool, str, Optional[User], Optional[str], bool]:
         action = payload.get("action")
         username = payload.get("username")
@@ -157,7 +480,7 @@ class BaseSession(ABC):
         elif action == "register":
             if not all([username, password, email]):
                 return False, "注册信息不完整", None, None, False
-            success, reason = await self.server.user_manager.register(username, password, email)
+            success, reason = await self.server.user_manager.register(username, password, email, self)
             return success, reason, None, None, False
         elif action == "login":
             if not all([username, password]):
@@ -176,18 +499,44 @@ class WebSocketClientSession(BaseSession):
     def __init__(self, server: 'Server', ws: 'web.WebSocketResponse', peername: str):
         super().__init__(server, peername, session_type='websocket')
         self.ws = ws
+        # ws.compress 为协商得到的 permessage-deflate 窗口位数，0 表示客户端不支持
+        self._compress_wbits = ws.compress or 0
+        self._compress_min_size = config.get('server.web_server.ws_compression_min_size', 1024)
+        if self._compress_wbits:
+            self._disable_default_compression(ws)
+        # 心跳由时间轮驱动 (WebSocketResponse 不启用 heartbeat/autoping，PING/PONG 在这里处理)
+        self.heartbeat_interval = float(config.get('server.web_server.heartbeat', 10))
+
+    def _disable_default_compression(self, ws: 'web.WebSocketResponse'):
+        """
+        协商了 permessage-deflate 后 aiohttp 默认压缩每一帧，且没有公开接口只对部分帧压缩
+        (compress=False 时握手不协商扩展、也不解压客户端的压缩帧)。
+        这里关闭 writer 的默认压缩，改为在 send 中按帧大小决定；依赖 aiohttp 内部属性，
+        requirements.txt 固定了 aiohttp 版本，升级后属性不存在时退回为压缩每一帧。
+        """
+        writer = getattr(ws, '_writer', None)
+        if isinstance(getattr(writer, 'compress', None), int):
+            writer.compress = 0
+        else:
+            global _per_frame_compression_warned
+            if not _per_frame_compression_warned:
+                _per_frame_compression_warned = True
+                logging.warning("当前 aiohttp 版本不支持按帧选择 WebSocket 压缩，将压缩所有帧")
+            self._compress_min_size = 0
 
     async def handle_session(self):
         self._main_loop_task = asyncio.current_task()
+        self._arm_liveness(self.last_activity)
         try:
             async for msg in self.ws:
+                self.last_activity = time.monotonic()
                 if msg.type == web_ws.WSMsgType.TEXT:
                     await self._handle_message_data(msg.data)
                 elif msg.type == web_ws.WSMsgType.PING:
-                    if config.get('logging.debug'): logging.debug(f"收到来自 {self.peername} 的 WebSocket PING")
-                    pass 
+                    if config.debug: logging.debug("收到来自 %s 的 WebSocket PING", self.peername)
+                    await self.ws.pong(msg.data)
                 elif msg.type == web_ws.WSMsgType.PONG:
-                    if config.get('logging.debug'): logging.debug(f"收到来自 {self.peername} 的 WebSocket PONG")
+                    if config.debug: logging.debug("收到来自 %s 的 WebSocket PONG", self.peername)
                 elif msg.type == web_ws.WSMsgType.ERROR:
                     logging.error(f"WebSocket 连接错误 {self.peername}: {self.ws.exception()}", exc_info=True)
                     break
@@ -202,11 +551,24 @@ class WebSocketClientSession(BaseSession):
         finally:
             await self.close()
 
-    async def send(self, message: str):
+    async def _send_ping(self):
         try:
             if not self.ws.closed:
-                if config.get('logging.debug'): logging.debug(f"发送消息到 {self.peername}: {message[:100]}...")
-                await self.ws.send_str(message)
+                await self.ws.ping()
+        except Exception as e:
+            logging.debug(f"向 {self.peername} 发送 WebSocket PING 失败: {e}")
+
+    async def _send_frame(self, message: str):
+        try:
+            if not self.ws.closed:
+                if config.debug: logging.debug("发送消息到 %s: %.100s...", self.peername, message)
+                compress = bool(self._compress_wbits) and len(message) >= self._compress_min_size
+                msg_type = proto.peek_message_type(message)
+                ws_compression_stats.record(msg_type, message, compress, self._compress_wbits)
+                if compress:
+                    await self.ws.send_str(message, compress=self._compress_wbits)
+                else:
+                    await self.ws.send_str(message)
         except ConnectionError:
             logging.warning(f"发送消息到 {self.peername} 失败: 连接已关闭")
         except Exception as e:
@@ -214,8 +576,11 @@ class WebSocketClientSession(BaseSession):
 
     async def close(self):
         if config.get('logging.debug'): logging.debug(f"ClientSession.close() 被调用 for {self.peername}")
+        self._cancel_liveness()
         self.server.remove_session(self) 
         if not self.ws.closed:
+            # 发出合并窗口中尚未发送的消息 (例如踢出通知)
+            await self.flush()
             if config.get('logging.debug'): logging.debug(f"正在关闭 WebSocket 连接 for {self.peername}")
             await self.ws.close()
         
@@ -237,34 +602,35 @@ class TcpClientSession(BaseSession):
         super().__init__(server, peername, session_type='tcp')
         self.reader = reader
         self.writer = writer
+        self.framing = framing.FRAMING_LINE
+        self.max_frame_size = config.get('server.tcp_server.max_frame_size', 1048576)
+        self._codec: Optional[framing.FrameCodec] = None
+        # 出站帧先进入缓冲区，由写任务批量写出并只 drain 一次
+        self._outbox: List[bytes] = []
+        self._outbox_bytes = 0
+        self.max_outbox_bytes = int(config.get('server.tcp_server.max_outbox_bytes', 4194304))
+        self._outbox_ready = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+        self.idle_timeout = float(config.get('server.tcp_server.idle_timeout', 305))
 
     async def handle_session(self):
         self._main_loop_task = asyncio.current_task()
+        self._writer_task = asyncio.create_task(self._write_loop())
+        # 认证期限和空闲超时由时间轮检查，读取本身不设超时
+        self._arm_liveness(self.last_activity)
         try:
-            auth_timeout_end = asyncio.get_running_loop().time() + 60 
-            
             while not self.reader.at_eof():
                 try:
-                    timeout = None
-                    if not self.user:
-                        timeout = auth_timeout_end - asyncio.get_running_loop().time()
-                        if timeout <= 0:
-                            logging.info(f"TCP 认证超时，关闭连接 {self.peername}")
-                            await self.send(proto.create_error_message("认证超时"))
-                            break
-                    else:
-                        timeout = 305
-
-                    message_bytes = await asyncio.wait_for(self.reader.readline(), timeout=timeout)
-                except asyncio.TimeoutError:
-                    if self.user:
-                        logging.info(f"TCP 用户 '{self.user.display_name if self.user.display_name else self.user.username}' 空闲超时，关闭连接")
-                    else:
-                        logging.info(f"TCP 认证超时，关闭连接 {self.peername}")
-                    break
+                    message_bytes = await self._read_message()
+                    self.last_activity = time.monotonic()
                 except ConnectionResetError:
                     logging.info(f"TCP 客户端 {self.peername} 连接重置，主动关闭会话")
                     break
+                except (framing.FrameError, ValueError) as e:
+                    # ValueError: line 模式下单行超过 StreamReader 的 limit
+                    logging.warning(f"TCP 客户端 {self.peername} 发送了非法帧，关闭连接: {e}")
+                    await self.send(proto.create_error_message("消息过大或格式错误"))
+                    break
 
                 if not message_bytes:
                     if self.user:
@@ -273,7 +639,13 @@ class TcpClientSession(BaseSession):
                         logging.info(f"未认证 TCP 客户端 {self.peername} 优雅断开连接")
                     break
 
-                await self._handle_message_data(message_bytes.decode())
+                if not self.user and self.framing == framing.FRAMING_LINE:
+                    json_msg = proto.parse_message(message_bytes)
+                    if json_msg and json_msg.get("type") == proto.MSG_TYPE_PROTOCOL_NEGOTIATE:
+                        await self._negotiate_protocol(json_msg.get("payload", {}))
+                        continue
+
+                await self._handle_message_data(message_bytes)
         except asyncio.CancelledError:
             logging.info(f"TCP 会话任务 {self.peername} 已取消")
         except ConnectionError as e:
@@ -283,24 +655,107 @@ class TcpClientSession(BaseSession):
         finally:
             await self.close()
 
-    async def send(self, message: str):
+    async def _read_message(self) -> bytes:
+        """读取一条完整消息，连接关闭时返回空字节串"""
+        if self.framing == framing.FRAMING_LINE:
+            return await self.reader.readline()
+        try:
+            header = await self.reader.readexactly(framing.FRAME_HEADER.size)
+            length, flags = self._codec.parse_header(header)
+            body = await self.reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return b''
+        return self._codec.decode_body(flags, body)
+
+    async def _negotiate_protocol(self, payload: dict):
+        """切换到长度前缀分帧，可选压缩；响应仍以 line 模式发出"""
+        requested_framing = payload.get("framing", framing.FRAMING_LINE)
+        requested_compression = payload.get("compression") or []
+        if isinstance(requested_compression, str):
+            requested_compression = [requested_compression]
+
+        if requested_framing != framing.FRAMING_LENGTH_PREFIXED:
+            await self.send(proto.create_message(proto.MSG_TYPE_PROTOCOL_NEGOTIATED, {"framing": framing.FRAMING_LINE, "compression": None}))
+            return
+
+        supported = framing.available_compressions()
+        compression = next((c for c in requested_compression if c in supported), None)
+        codec = framing.FrameCodec(
+            self.max_frame_size,
+            compression=compression,
+            compression_min_size=config.get('server.tcp_server.compression_min_size', 512)
+        )
+        await self.send(proto.create_message(proto.MSG_TYPE_PROTOCOL_NEGOTIATED, {
+            "framing": framing.FRAMING_LENGTH_PREFIXED,
+            "compression": compression,
+            "max_frame_size": self.max_frame_size
+        }))
+        # 缓冲区中的消息须按切换前的分帧编码
+        await self.flush()
+        self._codec = codec
+        self.framing = framing.FRAMING_LENGTH_PREFIXED
+        logging.info(f"TCP 客户端 {self.peername} 已切换到长度前缀分帧 (压缩: {compression or '无'})")
+
+    def _encode(self, message: str) -> bytes:
+        data = message.encode('utf-8')
+        if self.framing == framing.FRAMING_LINE:
+            return data if data.endswith(b'\n') else data + b'\n'
+        return self._codec.encode(data)
+
+    async def _write_loop(self):
+        """将缓冲区中的所有帧一次性写出，每批只等待一次 drain"""
+        try:
+            while True:
+                await self._outbox_ready.wait()
+                self._outbox_ready.clear()
+                if not self._outbox:
+                    continue
+                frames, self._outbox = self._outbox, []
+                self._outbox_bytes = 0
+                self.writer.writelines(frames)
+                await self.writer.drain()
+        except asyncio.CancelledError:
+            pass
+        except (ConnectionError, BrokenPipeError) as e:
+            logging.warning(f"发送消息到 TCP {self.peername} 失败: 连接已关闭 ({e})")
+        except Exception as e:
+            logging.error(f"TCP 写任务 {self.peername} 发生错误: {e}", exc_info=True)
+
+    async def _send_frame(self, message: str):
         try:
             if self.writer.is_closing():
                 return
-            if not message.endswith('\n'):
-                message += '\n'
-            if config.get('logging.debug'): logging.debug(f"发送消息到 TCP {self.peername}: {message[:100]}...")
-            await self.writer.write(message.encode('utf-8'))
-            if hasattr(self.writer, 'drain'):
-                await self.writer.drain()
-        except (ConnectionError, BrokenPipeError, asyncio.CancelledError):
-            logging.warning(f"发送消息到 TCP {self.peername} 失败: 连接已关闭")
+            if config.debug: logging.debug("发送消息到 TCP %s: %.100s...", self.peername, message)
+            frame = self._encode(message)
+            pending = self._outbox_bytes + len(frame) + self.writer.transport.get_write_buffer_size()
+            if self.max_outbox_bytes and pending > self.max_outbox_bytes:
+                # 客户端读得太慢: 丢弃积压的数据并断开，读循环随之结束并清理会话
+                logging.warning(f"TCP 客户端 {self.peername} 待发送数据超过 {self.max_outbox_bytes} 字节，断开连接")
+                _outbox_overflows.inc()
+                self._outbox.clear()
+                self._outbox_bytes = 0
+                self.writer.transport.abort()
+                return
+            self._outbox.append(frame)
+            self._outbox_bytes += len(frame)
+            self._outbox_ready.set()
+        except framing.FrameError as e:
+            logging.error(f"发送消息到 TCP {self.peername} 失败: {e}")
         except Exception as e:
             logging.error(f"发送消息到 TCP {self.peername} 时发生错误: {e}", exc_info=True)
 
     async def close(self):
         if config.get('logging.debug'): logging.debug(f"TcpClientSession.close() 被调用 for {self.peername}")
+        self._cancel_liveness()
         self.server.remove_session(self)
+        await self.flush()
+        if self._writer_task and not self._writer_task.done():
+            self._writer_task.cancel()
+        # 写出尚未发送的帧 (例如踢出通知)，transport 会在关闭前尽量刷新
+        if self._outbox and not self.writer.is_closing():
+            frames, self._outbox = self._outbox, []
+            self._outbox_bytes = 0
+            self.writer.writelines(frames)
         if hasattr(self.writer, 'close'):
             if config.get('logging.debug'): logging.debug(f"正在关闭 TCP 连接 for {self.peername}")
             self.writer.close()
@@ -1,10 +1,14 @@
 # server/core/sfu.py
 import asyncio
 import logging
-from typing import Dict, Set, Optional
+from typing import Dict, Set, Optional, Callable, Awaitable
 from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer
 from aiortc.contrib.media import MediaRelay
 
+from utils import protocol as proto
+from utils.config import config
+from .speakers import ActiveSpeakers
+
 # 移除: 不再使用全局 relay
 
 class VoiceRoom:
@@ -13,14 +17,36 @@ class VoiceRoom:
         self.room_id = room_id
         self.participants: Dict[int, RTCPeerConnection] = {} 
         self.relays: Dict[str, MediaRelay] = {} # 修改: 管理每个轨道的 relay
+        # 向参与者转发新轨道后需要由服务器发起重新协商
+        self.renegotiators: Dict[int, Callable[[], Awaitable[None]]] = {}
+        # 向参与者推送房间事件 (已序列化的消息)
+        self.notifiers: Dict[int, Callable[[str], Awaitable[None]]] = {}
+        # 启用时音频只转发活跃发言者，否则每条音频轨道都转发给所有其他参与者
+        self.speakers: Optional[ActiveSpeakers] = None
+        if config.get('server.voice.active_speakers.enabled', True):
+            self.speakers = ActiveSpeakers(room_id, self._notify_speakers)
 
-    async def add_participant(self, user_id: int, pc: RTCPeerConnection):
+    async def add_participant(self, user_id: int, pc: RTCPeerConnection, on_renegotiation_needed: Optional[Callable[[], Awaitable[None]]] = None, notify: Optional[Callable[[str], Awaitable[None]]] = None):
         """添加一个新的参与者到房间"""
         self.participants[user_id] = pc
+        if on_renegotiation_needed:
+            self.renegotiators[user_id] = on_renegotiation_needed
+        if notify:
+            self.notifiers[user_id] = notify
+
+        @pc.on("signalingstatechange")
+        async def on_signalingstatechange():
+            # 初始协商完成后再为已有的发言者添加转发槽位
+            if self.speakers and user_id in self.participants and pc.signalingState == "stable":
+                await self._renegotiate(self._ensure_slots({user_id: pc}))
 
         @pc.on("track")
         async def on_track(track):
             logging.info(f"[SFU Room {self.room_id}] 用户 {user_id} 的轨道 {track.kind} (id: {track.id}) 到达")
+            if track.kind == "audio" and self.speakers:
+                self.speakers.add_source(user_id, track)
+                await self._renegotiate(self._ensure_slots(self.participants))
+                return
             
             # 修改: 为这个新轨道创建一个专属的 MediaRelay
             relay = MediaRelay()
@@ -28,18 +54,48 @@ class VoiceRoom:
             self.relays[track.id] = relay # 存储它以便后续清理
             
             # 将这个轨道转发给房间内所有其他的参与者
-            for other_user_id, other_pc in self.participants.items():
+            forwarded_to = []
+            for other_user_id, other_pc in list(self.participants.items()):
                 if other_user_id != user_id:
                     try:
                         other_pc.addTrack(relayed_track)
+                        forwarded_to.append(other_user_id)
                         logging.info(f"[SFU Room {self.room_id}] 已将用户 {user_id} 的轨道 {track.id} 转发给用户 {other_user_id}")
                     except Exception as e:
                         logging.error(f"[SFU Room {self.room_id}] 转发轨道给 {other_user_id} 失败: {e}")
 
+            # 通话中新增轨道需要重新协商，接收方才能收到
+            await self._renegotiate(forwarded_to)
+
+    def _ensure_slots(self, pcs: Dict[int, RTCPeerConnection]):
+        # 处于协商中的 PeerConnection 此时不能添加轨道 (aiortc 生成 answer 时会出错)，等它回到 stable 时再补上
+        ready = {uid: pc for uid, pc in pcs.items() if pc.signalingState == "stable" and pc.remoteDescription is not None}
+        return self.speakers.ensure_slots(ready)
+
+    async def _renegotiate(self, user_ids):
+        for user_id in user_ids:
+            renegotiate = self.renegotiators.get(user_id)
+            if renegotiate:
+                await renegotiate()
+
+    @staticmethod
+    def _speakers_message(user_ids) -> str:
+        return proto.create_message(proto.MSG_TYPE_ACTIVE_SPEAKERS, {"user_ids": user_ids})
+
+    async def _notify_speakers(self, user_ids):
+        message = self._speakers_message(user_ids)
+        notifications = [notify(message) for notify in self.notifiers.values()]
+        if notifications:
+            await asyncio.gather(*notifications, return_exceptions=True)
+
     async def remove_participant(self, user_id: int):
         """从房间移除一个参与者"""
         if user_id in self.participants:
             pc = self.participants.pop(user_id)
+            self.renegotiators.pop(user_id, None)
+            self.notifiers.pop(user_id, None)
+            if self.speakers:
+                self.speakers.remove_participant(user_id)
             
             # 清理与该用户相关的所有 relay
             # 注意：这是一个简化的清理，更复杂的场景可能需要跟踪哪个用户产生了哪个track
@@ -67,16 +123,23 @@ class SFUServer:
             self.rooms[room_id] = VoiceRoom(room_id)
         return self.rooms[room_id]
 
-    async def join_room(self, room_id: int, user_id: int) -> RTCPeerConnection:
+    async def join_room(self, room_id: int, user_id: int, on_renegotiation_needed: Optional[Callable[[], Awaitable[None]]] = None, notify: Optional[Callable[[str], Awaitable[None]]] = None) -> RTCPeerConnection:
         """处理用户加入房间的逻辑，返回一个新的 PeerConnection"""
         room = self.get_or_create_room(room_id)
         
         pc = RTCPeerConnection(configuration=self.rtc_configuration)
         
-        await room.add_participant(user_id, pc)
+        await room.add_participant(user_id, pc, on_renegotiation_needed, notify)
         
         return pc
 
+    def active_speakers(self, room_id: int) -> list:
+        room = self.rooms.get(room_id)
+        return list(room.speakers.speaking) if room and room.speakers else []
+
+    def audio_slots(self) -> int:
+        return sum(room.speakers.slot_count() for room in self.rooms.values() if room.speakers)
+
     async def leave_room(self, room_id: int, user_id: int):
         """处理用户离开房间的逻辑"""
         if room_id in self.rooms:
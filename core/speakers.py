@@ -0,0 +1,229 @@
+# server/core/speakers.py
+"""
+语音房间的活跃发言者检测与音频转发
+
+每条上行音频轨道只由一个 AudioSource 读取: aiortc 在接收端已把 RTP 解码为 PCM 帧，
+这里对每帧计算电平 (RFC 6465 的 dBov，安装了 NumPy 时向量化计算) 并做指数平滑。
+房间每 update_interval 秒按平滑后的电平选出最多 max_speakers 个活跃发言者，带迟滞:
+候选者的电平要比当前最弱的发言者高出 hysteresis_db，且后者已保持至少 min_hold 秒，才会替换它。
+
+每个接收者最多有 max_speakers 个转发槽位 (SpeakerSlotTrack)，槽位在发言者之间切换而不需要重新协商，
+N 人房间转发的音频流由 N*(N-1) 条降为至多 N*max_speakers 条；没有分配发言者的槽位不产生帧，
+也就不会编码和发送。活跃发言者变化时向房间内的参与者推送 active_speakers 事件。
+"""
+import asyncio
+import fractions
+import logging
+import math
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import av
+from aiortc import MediaStreamTrack, RTCPeerConnection, rtp
+from aiortc.mediastreams import MediaStreamError
+
+from utils.config import config
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MIN_LEVEL = -127.0
+# 每帧 (20ms) 电平的平滑系数，约 0.2 秒的时间常数
+_SMOOTHING = 0.1
+# 槽位最多缓冲的帧数，接收端编码跟不上时丢弃最旧的帧
+_SLOT_QUEUE_FRAMES = 10
+
+
+def frame_level(frame: av.AudioFrame) -> float:
+    """一帧 s16 PCM 的电平 (dBov, -127 ~ 0)"""
+    if np is None:
+        return float(rtp.compute_audio_level_dbov(frame))
+    count = frame.samples * len(frame.layout.channels)
+    if not count:
+        return MIN_LEVEL
+    samples = np.frombuffer(frame.planes[0], dtype=np.int16, count=count).astype(np.float32)
+    rms = math.sqrt(float(np.dot(samples, samples)) / count) / 32767
+    return max(MIN_LEVEL, 20 * math.log10(rms)) if rms > 0 else MIN_LEVEL
+
+
+class SpeakerSlotTrack(MediaStreamTrack):
+    """转发给某个接收者的一个音频槽位，由房间决定当前转发哪个发言者"""
+    kind = "audio"
+
+    def __init__(self):
+        super().__init__()
+        self.source: Optional['AudioSource'] = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=_SLOT_QUEUE_FRAMES)
+        self._started: Optional[float] = None
+        self._pts = 0
+
+    def assign(self, source: Optional['AudioSource']):
+        if source is self.source:
+            return
+        if self.source is not None:
+            self.source.slots.discard(self)
+        self.source = source
+        # 丢弃上一个发言者尚未发出的帧
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        if source is not None:
+            source.slots.add(self)
+
+    def push(self, frame: av.AudioFrame):
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(frame)
+
+    async def recv(self) -> av.AudioFrame:
+        if self.readyState != "live":
+            raise MediaStreamError
+        frame = await self._queue.get()
+        # 同一帧会转发给多个接收者，复制后再按本槽位的时间线重写时间戳:
+        # 切换发言者或空闲期间时间戳按实际经过的时间前进
+        now = time.monotonic()
+        if self._started is None:
+            self._started = now
+        self._pts = max(self._pts, int((now - self._started) * frame.sample_rate))
+        copy = av.AudioFrame(format=frame.format.name, layout=frame.layout.name, samples=frame.samples)
+        for plane, source_plane in zip(copy.planes, frame.planes):
+            # 解码器分配的缓冲区可能大于实际的采样数据
+            plane.update(memoryview(source_plane)[:plane.buffer_size])
+        copy.sample_rate = frame.sample_rate
+        copy.time_base = fractions.Fraction(1, frame.sample_rate)
+        copy.pts = self._pts
+        self._pts += frame.samples
+        return copy
+
+
+class AudioSource:
+    """一个参与者的一条上行音频轨道: 计算电平并把帧分发给分配到它的槽位"""
+
+    def __init__(self, user_id: int, track: MediaStreamTrack, on_ended: Callable[['AudioSource'], None]):
+        self.user_id = user_id
+        self.track = track
+        self.level = MIN_LEVEL
+        self.active_since = 0.0
+        self.slots: Set[SpeakerSlotTrack] = set()
+        self._on_ended = on_ended
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            while True:
+                frame = await self.track.recv()
+                self.level += _SMOOTHING * (frame_level(frame) - self.level)
+                for slot in self.slots:
+                    slot.push(frame)
+        except MediaStreamError:
+            pass
+        except Exception as e:
+            logging.error(f"[SFU] 读取用户 {self.user_id} 的音频轨道时出错: {e}", exc_info=True)
+        self._on_ended(self)
+
+    def stop(self):
+        self._task.cancel()
+        for slot in list(self.slots):
+            slot.assign(None)
+
+
+class ActiveSpeakers:
+    """房间内的音频源、各接收者的转发槽位以及活跃发言者的选择"""
+
+    def __init__(self, room_id: int, notify: Callable[[List[int]], Awaitable[None]]):
+        self.room_id = room_id
+        self.max_speakers = max(1, int(config.get('server.voice.active_speakers.max_speakers', 3)))
+        self.update_interval = float(config.get('server.voice.active_speakers.update_interval', 0.3))
+        self.hysteresis_db = float(config.get('server.voice.active_speakers.hysteresis_db', 6.0))
+        self.min_hold = float(config.get('server.voice.active_speakers.min_hold', 1.0))
+        self.speaking_level = float(config.get('server.voice.active_speakers.speaking_level', -50.0))
+        self.sources: List[AudioSource] = []
+        self.slots: Dict[int, List[SpeakerSlotTrack]] = {}
+        self.active: List[AudioSource] = []
+        self.speaking: List[int] = []
+        self._notify = notify
+        self._task: Optional[asyncio.Task] = None
+
+    def add_source(self, user_id: int, track: MediaStreamTrack):
+        self.sources.append(AudioSource(user_id, track, self._source_ended))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def _source_ended(self, source: AudioSource):
+        if source in self.sources:
+            self.sources.remove(source)
+            source.stop()
+            self._select(time.monotonic())
+
+    def ensure_slots(self, pcs: Dict[int, RTCPeerConnection]) -> List[int]:
+        """
+        每个接收者的槽位数为 min(max_speakers, 其他人的音频源数)，只增不减；
+        返回新增了槽位、需要重新协商的接收者
+        """
+        added = []
+        for user_id, pc in pcs.items():
+            slots = self.slots.setdefault(user_id, [])
+            wanted = min(self.max_speakers, sum(1 for s in self.sources if s.user_id != user_id))
+            if len(slots) >= wanted:
+                continue
+            while len(slots) < wanted:
+                slot = SpeakerSlotTrack()
+                pc.addTrack(slot)
+                slots.append(slot)
+            added.append(user_id)
+        self._select(time.monotonic())
+        return added
+
+    def remove_participant(self, user_id: int):
+        for slot in self.slots.pop(user_id, []):
+            slot.assign(None)
+            slot.stop()
+        for source in [s for s in self.sources if s.user_id == user_id]:
+            self.sources.remove(source)
+            source.stop()
+        if not self.slots and self._task:
+            self._task.cancel()
+            self._task = None
+        else:
+            self._select(time.monotonic())
+
+    def slot_count(self) -> int:
+        return sum(len(slots) for slots in self.slots.values())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.update_interval)
+            try:
+                self._select(time.monotonic())
+                speaking = list(dict.fromkeys(s.user_id for s in self.active if s.level >= self.speaking_level))
+                if speaking != self.speaking:
+                    self.speaking = speaking
+                    await self._notify(speaking)
+            except Exception as e:
+                logging.error(f"[SFU Room {self.room_id}] 选择活跃发言者时出错: {e}", exc_info=True)
+
+    def _select(self, now: float):
+        ranked = sorted(self.sources, key=lambda s: s.level, reverse=True)
+        active = [s for s in self.active if s in self.sources]
+        for candidate in ranked:
+            if candidate in active:
+                continue
+            if len(active) < self.max_speakers:
+                candidate.active_since = now
+                active.append(candidate)
+                continue
+            weakest = min(active, key=lambda s: s.level)
+            if candidate.level < weakest.level + self.hysteresis_db or now - weakest.active_since < self.min_hold:
+                break
+            active[active.index(weakest)] = candidate
+            candidate.active_since = now
+        self.active = active
+        # 接收者优先收听活跃发言者 (不含自己)，剩余槽位按电平补足
+        order = active + [s for s in ranked if s not in active]
+        for user_id, slots in self.slots.items():
+            wanted = [s for s in order if s.user_id != user_id][:len(slots)]
+            unassigned = [s for s in wanted if not any(slot.source is s for slot in slots)]
+            for slot in slots:
+                if slot.source not in wanted:
+                    slot.assign(unassigned.pop(0) if unassigned else None)
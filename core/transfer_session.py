@@ -7,7 +7,7 @@ from typing import TYPE_CHECKING
 from datetime import datetime, timezone
 
 from utils.database import db_manager
-from utils import protocol as proto
+from utils import protocol as proto, metrics
 
 if TYPE_CHECKING:
     from .session import ClientSession
@@ -68,29 +68,29 @@ class TransferSession:
                 f.write(chunk)
                 bytes_written += len(chunk)
 
+        metrics.upload_bytes.labels('tcp_transfer').inc(bytes_written)
         if bytes_written != self.file_info['filesize']:
             os.remove(filepath)
             raise ValueError(f"文件大小不匹配: 预期 {self.file_info['filesize']}, 收到 {bytes_written}")
 
         upload_time = datetime.now(timezone.utc).isoformat()
         # 将文件信息和聊天消息一起存入数据库
-        await db_manager.execute(
+        file_id = await db_manager.insert(
             """INSERT INTO files (channel_id, uploader_id, original_filename, stored_filename, filesize, upload_time)
                VALUES (?, ?, ?, ?, ?, ?)""",
             (self.client_session.current_channel.id, self.client_session.user.id, self.file_info['filename'], stored_filename, bytes_written, upload_time)
         )
-        file_id = await db_manager.fetchval("SELECT last_insert_rowid()")
         
         # 广播文件消息
         file_message_content = f"上传了文件: {self.file_info['filename']} (ID: {file_id}, 大小: {bytes_written} bytes)"
-        await db_manager.add_message(
+        message_id = await db_manager.add_message(
             self.client_session.current_channel.id,
             self.client_session.user.id,
             self.client_session.user.username,
             f"[文件] {self.file_info['filename']}"
         )
         broadcast_json = proto.create_message(proto.MSG_TYPE_FILE_BROADCAST, {"message": file_message_content})
-        await self.file_manager.server.broadcast_to_channel(self.client_session.current_channel.id, broadcast_json)
+        await self.file_manager.server.broadcast_to_channel(self.client_session.current_channel.id, broadcast_json, message_id=message_id)
         logging.info(f"[{self.transfer_id[:8]}] 文件 '{self.file_info['filename']}' 上传成功")
 
     async def handle_download(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
@@ -106,4 +106,5 @@ class TransferSession:
                     break
                 writer.write(chunk)
                 await writer.drain()
+                metrics.download_bytes.labels('tcp_transfer').inc(len(chunk))
         logging.info(f"[{self.transfer_id[:8]}] 文件 '{self.file_info['original_filename']}' 下载发送完成")
\ No newline at end of file
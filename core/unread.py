@@ -0,0 +1,183 @@
+# server/core/unread.py
+"""
+多频道订阅的已读位置与未读计数
+
+会话可以订阅多个文本频道，其中当前频道 (current_channel) 为聚焦频道:
+  - 聚焦频道照常收到完整的广播，用户在该频道的已读位置随之前移；
+  - 其它已订阅频道只收到 unread_update {channel_id, unread, message_id} 增量通知。
+已读位置 (最后已读的消息 ID) 持久化在 channel_read_state 表中，计数只在内存中维护:
+变化的条目每 flush_interval 秒批量写回一次，用户在本节点的最后一个订阅会话断开时立即写回。
+未读数在首次订阅时从消息表推算，最多计到 max_count 条。
+多节点部署时每个节点只跟踪本节点上有订阅会话的用户。
+"""
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Set, Tuple
+
+from utils.config import config
+from utils.database import db_manager
+from utils import metrics
+
+if TYPE_CHECKING:
+    from server import Server
+
+_tracked_users = metrics.registry.gauge('unread_tracked_users', '内存中跟踪未读计数的用户数')
+_flushed = metrics.registry.counter('unread_read_state_flushed_total', '批量写回的已读位置条目数')
+
+_LOAD_QUERY = """
+    SELECT c.id AS channel_id,
+           COALESCE(r.last_read_message_id, 0) AS last_read_message_id,
+           (SELECT MAX(id) FROM messages WHERE channel_id = c.id) AS last_message_id,
+           (SELECT COUNT(*) FROM (
+               SELECT 1 FROM messages m WHERE m.channel_id = c.id AND m.id > COALESCE(r.last_read_message_id, 0) LIMIT ?
+           )) AS unread
+    FROM channels c
+    LEFT JOIN channel_read_state r ON r.channel_id = c.id AND r.user_id = ?
+    WHERE c.type = 'text'
+"""
+
+_UPSERT_QUERY = """
+    INSERT INTO channel_read_state (user_id, channel_id, last_read_message_id) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, channel_id) DO UPDATE SET
+        last_read_message_id = MAX(last_read_message_id, excluded.last_read_message_id)
+"""
+
+
+class ReadState:
+    __slots__ = ('last_read', 'unread')
+
+    def __init__(self, last_read: int, unread: int):
+        self.last_read = last_read
+        self.unread = unread
+
+
+class UnreadTracker:
+    def __init__(self, server: 'Server'):
+        self.server = server
+        self.max_count = int(config.get('server.unread.max_count', 100))
+        self.flush_interval = float(config.get('server.unread.flush_interval', 10))
+        # user_id -> channel_id -> ReadState
+        self._users: Dict[int, Dict[int, ReadState]] = {}
+        # user_id -> 本节点上订阅中的会话数
+        self._refs: Dict[int, int] = {}
+        self._dirty: Set[Tuple[int, int]] = set()
+        # channel_id -> 已知的最新消息 ID
+        self._last_message: Dict[int, int] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        _tracked_users.set_function(lambda: len(self._users))
+
+    async def _load(self, user_id: int):
+        """从数据库推算该用户在各文本频道的未读数，只补充内存中还没有的条目"""
+        rows = await db_manager.fetchall(_LOAD_QUERY, (self.max_count, user_id))
+        states = self._users.setdefault(user_id, {})
+        for row in rows:
+            channel_id = row['channel_id']
+            last_message = row['last_message_id'] or 0
+            if last_message > self._last_message.get(channel_id, 0):
+                self._last_message[channel_id] = last_message
+            if channel_id not in states:
+                states[channel_id] = ReadState(row['last_read_message_id'], row['unread'])
+
+    async def attach(self, user_id: int, channel_ids: Iterable[int]):
+        """会话开始订阅时调用 (每个会话一次)"""
+        self._refs[user_id] = self._refs.get(user_id, 0) + 1
+        await self.ensure_loaded(user_id, channel_ids)
+
+    async def ensure_loaded(self, user_id: int, channel_ids: Iterable[int]):
+        states = self._users.get(user_id)
+        if states is None or any(channel_id not in states for channel_id in channel_ids):
+            await self._load(user_id)
+
+    async def detach(self, user_id: int):
+        """订阅会话断开时调用，用户在本节点已没有订阅会话时写回并释放其状态"""
+        refs = self._refs.get(user_id, 0) - 1
+        if refs > 0:
+            self._refs[user_id] = refs
+            return
+        self._refs.pop(user_id, None)
+        entries = [key for key in self._dirty if key[0] == user_id]
+        states = self._users.pop(user_id, None)
+        if entries and states:
+            self._dirty.difference_update(entries)
+            await self._write([(user_id, channel_id, states[channel_id].last_read) for _, channel_id in entries if channel_id in states])
+
+    def is_tracked(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    def counts(self, user_id: int, channel_ids: Iterable[int]) -> Dict[int, int]:
+        states = self._users.get(user_id, {})
+        return {channel_id: states[channel_id].unread for channel_id in channel_ids if channel_id in states}
+
+    def mark_read(self, user_id: int, channel_id: int, message_id: Optional[int] = None):
+        """把已读位置前移到 message_id (默认为频道中已知的最新消息) 并清零未读数"""
+        state = self._users.get(user_id, {}).get(channel_id)
+        if state is None:
+            return
+        if message_id is None:
+            message_id = self._last_message.get(channel_id, 0)
+        state.unread = 0
+        if message_id > state.last_read:
+            state.last_read = message_id
+            self._dirty.add((user_id, channel_id))
+
+    def note_message(self, channel_id: int, message_id: int):
+        if message_id > self._last_message.get(channel_id, 0):
+            self._last_message[channel_id] = message_id
+
+    def increment(self, user_id: int, channel_id: int) -> Optional[int]:
+        """未聚焦的订阅频道收到新消息，返回新的未读数 (最多 max_count，用户未被跟踪时返回 None)"""
+        state = self._users.get(user_id, {}).get(channel_id)
+        if state is None:
+            return None
+        state.unread = min(state.unread + 1, self.max_count)
+        return state.unread
+
+    def drop_channel(self, channel_id: int):
+        self._last_message.pop(channel_id, None)
+        for states in self._users.values():
+            states.pop(channel_id, None)
+        self._dirty = {key for key in self._dirty if key[1] != channel_id}
+
+    async def _write(self, rows):
+        if not rows:
+            return
+        await db_manager.executemany(_UPSERT_QUERY, rows)
+        _flushed.inc(len(rows))
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        rows = []
+        for user_id, channel_id in dirty:
+            state = self._users.get(user_id, {}).get(channel_id)
+            if state is not None:
+                rows.append((user_id, channel_id, state.last_read))
+        try:
+            await self._write(rows)
+        except Exception:
+            self._dirty |= dirty
+            raise
+
+    def start(self):
+        if self._flush_task is None and self.flush_interval > 0:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"写回已读位置时出错: {e}", exc_info=True)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"写回已读位置时出错: {e}", exc_info=True)
@@ -2,8 +2,9 @@ import logging
 import asyncio
 import secrets
 import re
+import time
 from asyncio import Lock
-from typing import Dict, Optional, Tuple, List, Any, TYPE_CHECKING
+from typing import Dict, Optional, Tuple, List, Any, Set, TYPE_CHECKING
 from datetime import datetime, timezone, timedelta
 
 from utils import security, mailer
@@ -21,6 +22,7 @@ class User:
         self.username = username
         self.hashed_password = hashed_password
         self.roles = roles
+        self.permissions = permissions_for_roles(roles)
         self.email = email
         self.is_verified = bool(is_verified)
         self.login_otp_enabled = bool(login_otp_enabled)
@@ -28,10 +30,43 @@ class User:
         self.status = status
         self.display_name = display_name if display_name is not None else username
 
+    def has_permission(self, mask: int) -> bool:
+        return self.permissions & mask == mask
+
 class UserManager:
     def __init__(self):
         self.online_users: Dict[str, 'BaseSession'] = {} 
+        # 其它节点上在线的用户 (小写用户名 -> 原用户名)，按节点 ID 分组，由背板事件维护
+        self.remote_online_users: Dict[str, Dict[str, str]] = {}
         self._lock = Lock()
+        # 会话令牌: 有效期 ttl 秒，使用时滑动续期 (距上次续期超过 refresh_interval 才写库)
+        self.session_ttl = config.get('security.sessions.ttl', 7 * 24 * 3600)
+        self.session_refresh_interval = config.get('security.sessions.refresh_interval', 3600)
+        self.max_sessions_per_user = config.get('security.sessions.max_per_user', 10)
+        self._prune_task: Optional[asyncio.Task] = None
+
+    def is_online(self, username: str) -> bool:
+        username_lower = username.lower()
+        if username_lower in self.online_users:
+            return True
+        return any(username_lower in users for users in self.remote_online_users.values())
+
+    def set_remote_presence(self, node_id: str, username: str, online: bool):
+        users = self.remote_online_users.setdefault(node_id, {})
+        if online:
+            users[username.lower()] = username
+        else:
+            users.pop(username.lower(), None)
+
+    def replace_remote_presence(self, node_id: str, usernames: List[str]) -> Set[str]:
+        """替换该节点的在线用户，返回上线或下线的用户名"""
+        old = self.remote_online_users.get(node_id, {})
+        new = self.remote_online_users[node_id] = {name.lower(): name for name in usernames}
+        return {name for key, name in new.items() if key not in old} | {name for key, name in old.items() if key not in new}
+
+    def drop_remote_node(self, node_id: str) -> Set[str]:
+        """移除下线节点，返回其上的在线用户名"""
+        return set(self.remote_online_users.pop(node_id, {}).values())
 
     async def initialize_roles_and_admins(self):
         defined_roles = [ROLE_SUPERUSER, ROLE_OWNER, ROLE_OPERATOR, ROLE_MODERATOR, ROLE_MEMBER]
@@ -49,7 +84,6 @@ class UserManager:
         admin_users = config.get('security.builtin_admins.users', [])
         passwords = config.builtin_admin_passwords
         superuser_role_id = await db_manager.fetchval("SELECT id FROM roles WHERE name = ?", (ROLE_SUPERUSER,))
-        loop = asyncio.get_running_loop()
 
         for i, username in enumerate(admin_users):
             password = passwords[i] if i < len(passwords) else None
@@ -62,7 +96,7 @@ class UserManager:
             elif user_data and not password: 
                 logging.info(f"内置管理员 '{username}' 密码未提供，保留现有密码")
             else:
-                hashed_pass = await loop.run_in_executor(None, security.hash_password, password)
+                hashed_pass = await security.hash_password_async(password)
                 if not hashed_pass: continue
                 if user_data:
                     await db_manager.execute("UPDATE users SET hashed_password = ?, display_name = COALESCE(display_name, ?) WHERE id = ?", (hashed_pass, username, user_data['id']))
@@ -77,9 +111,10 @@ class UserManager:
         
         config.clear_initial_passwords('security.builtin_admins.passwords')
 
-    async def register(self, username: str, password: str, email: str) -> Tuple[bool, str]:
+    async def register(self, username: str, password: str, email: str, session: Optional['BaseSession'] = None) -> Tuple[bool, str]:
+        t = session.t if session else translator.t
         if not (3 <= len(username) <= 16 and re.fullmatch(r'^[a-zA-Z0-9_\u4e00-\u9fff]+$', username)):
-            return False, translator.t('register_failed_invalid')
+            return False, t('register_failed_invalid')
         if not email: return False, "邮箱不能为空"
 
         domain_filter = config.get('security.email_verification.domain_filter')
@@ -98,7 +133,7 @@ class UserManager:
                 token = secrets.token_urlsafe(32)
                 expiry_minutes = config.get('security.email_verification.token_expiry_minutes', 5)
                 await db_manager.execute("UPDATE users SET verification_token = ?, created_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') WHERE id = ?", (token, existing_user['id']))
-                asyncio.create_task(mailer.send_email(existing_user['email'], "重新发送验证邮件", f"您的新验证令牌是: {token}，有效期 {expiry_minutes} 分钟。"))
+                await mailer.enqueue_email(existing_user['email'], "重新发送验证邮件", f"您的新验证令牌是: {token}，有效期 {expiry_minutes} 分钟。")
                 return True, "该用户名已注册但未验证，新的验证邮件已发送，请查收。"
 
         max_accounts = config.get('security.email_verification.max_accounts_per_email')
@@ -108,9 +143,8 @@ class UserManager:
                 return False, f"该邮箱已达到最大注册数量 ({max_accounts})"
         
         try:
-            loop = asyncio.get_running_loop()
-            hashed_password = await loop.run_in_executor(None, security.hash_password, password)
-            if not hashed_password: return False, translator.t('internal_error')
+            hashed_password = await security.hash_password_async(password)
+            if not hashed_password: return False, t('internal_error')
             
             await db_manager.execute("INSERT INTO users (username, display_name, hashed_password, email) VALUES (?, ?, ?, ?)", (username, username, hashed_password, email))
             user_id = await db_manager.fetchval("SELECT id FROM users WHERE username = ?", (username,))
@@ -125,11 +159,11 @@ class UserManager:
             token = secrets.token_urlsafe(32)
             expiry_minutes = config.get('security.email_verification.token_expiry_minutes', 5)
             await db_manager.execute("UPDATE users SET verification_token = ?, created_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') WHERE id = ?", (token, user_id))
-            await mailer.send_email(email, "欢迎注册 - 请验证您的邮箱", f"这是一个模拟验证邮件。您的验证令牌是: {token}，有效期 {expiry_minutes} 分钟。")
+            await mailer.enqueue_email(email, "欢迎注册 - 请验证您的邮箱", f"这是一个模拟验证邮件。您的验证令牌是: {token}，有效期 {expiry_minutes} 分钟。")
             return True, "注册成功！一封验证邮件已发送至您的邮箱，请查收后重新登录。"
         else:
             await db_manager.execute("UPDATE users SET is_verified = 1 WHERE id = ?", (user_id,))
-            return True, translator.t('register_success', username=username)
+            return True, t('register_success', username=username)
 
     async def _handle_session_takeover(self, username: str):
         username_lower = username.lower()
@@ -141,6 +175,11 @@ class UserManager:
             else:
                  logging.warning(f"尝试顶替用户'{username}'，但在 online_users 中未找到有效的会话对象")
 
+    async def evict_remote_takeover(self, username: str):
+        """用户在其它节点登录: 顶替本节点上该用户的旧会话"""
+        async with self._lock:
+            await self._handle_session_takeover(username)
+
     def _create_user_from_data(self, user_data: dict, roles: List[str], status: str = 'offline') -> User:
         return User(
             id=user_data['id'],
@@ -157,7 +196,7 @@ class UserManager:
 
     async def login(self, username: str, password: str, session: 'BaseSession') -> Tuple[bool, str, Optional[User], Optional[str]]:
         user_data = await db_manager.fetchone("SELECT id, username, hashed_password, email, is_verified, login_otp_enabled, avatar_filename, display_name FROM users WHERE username = ?", (username,))
-        if not user_data: return False, translator.t('login_failed_not_found', username=username), None, None
+        if not user_data: return False, session.t('login_failed_not_found', username=username), None, None
         
         roles = await self.get_user_roles(user_data['id'])
         is_superuser = ROLE_SUPERUSER in roles
@@ -167,23 +206,22 @@ class UserManager:
         async with self._lock:
             await self._handle_session_takeover(username)
         
-        if user_data['hashed_password'] == "!" or not await asyncio.get_running_loop().run_in_executor(None, security.check_password, password, user_data['hashed_password']):
-            return False, translator.t('login_failed_password'), None, None
+        if user_data['hashed_password'] == "!" or not await security.check_password_async(password, user_data['hashed_password']):
+            return False, session.t('login_failed_password'), None, None
         
         user = self._create_user_from_data(user_data, roles, status='online')
         
-        session_token = secrets.token_urlsafe(32)
-        await db_manager.execute("INSERT INTO sessions (token, user_id) VALUES (?, ?)", (session_token, user.id))
+        session_token = await self.create_session_token(user.id)
         
         async with self._lock: self.online_users[username.lower()] = session
-        return True, translator.t('login_success'), user, session_token
+        return True, session.t('login_success'), user, session_token
 
     async def resume_session(self, token: str, session: 'BaseSession') -> Tuple[bool, str, Optional[User], Optional[str]]:
-        session_data = await db_manager.fetchone("SELECT user_id FROM sessions WHERE token = ?", (token,))
-        if not session_data:
+        user_id = await self.validate_session_token(token)
+        if user_id is None:
             return False, "无效的会话令牌", None, None
             
-        user_data = await db_manager.fetchone("SELECT id, username, hashed_password, email, is_verified, login_otp_enabled, avatar_filename, display_name FROM users WHERE id = ?", (session_data['user_id'],))
+        user_data = await db_manager.fetchone("SELECT id, username, hashed_password, email, is_verified, login_otp_enabled, avatar_filename, display_name FROM users WHERE id = ?", (user_id,))
         if not user_data:
             return False, "与令牌关联的用户不存在", None, None
             
@@ -201,42 +239,77 @@ class UserManager:
         async with self._lock:
             self.online_users.pop(username.lower(), None)
 
-    async def get_all_registered_users(self) -> List[Dict[str, Any]]:
-        query = """
-            SELECT u.id, u.username, u.display_name, u.avatar_filename, r.name as role_name
-            FROM users u
-            JOIN user_roles ur ON u.id = ur.user_id
-            JOIN roles r ON ur.role_id = r.id
-            ORDER BY u.username
-        """
-        registered_users_data = await db_manager.fetchall(query)
-        
-        unique_users: Dict[int, Dict[str, Any]] = {}
-
-        for user_data in registered_users_data:
-            user_id = user_data['id']
-            username = user_data['username']
-            display_name = user_data['display_name']
-            avatar_filename = user_data['avatar_filename']
-            role_name = user_data['role_name']
-
-            if user_id not in unique_users:
-                unique_users[user_id] = {
-                    "id": user_id, 
-                    "username": username,
-                    "display_name": display_name if display_name else username,
-                    "roles": [],
-                    "avatar_url": f"/uploads/avatars/{avatar_filename}" if avatar_filename else None
-                }
-            unique_users[user_id]["roles"].append(role_name)
-        
-        users_list = []
-        for user_id, info in unique_users.items():
-            is_online = info["username"].lower() in self.online_users
-            info["status"] = 'online' if is_online else 'offline'
-            users_list.append(info)
+    async def create_session_token(self, user_id: int) -> str:
+        """签发新令牌，并删除该用户超出 max_per_user 的最久未使用的令牌"""
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        await db_manager.execute(
+            "INSERT INTO sessions (token, user_id, expires_at, last_used_at) VALUES (?, ?, ?, ?)",
+            (token, user_id, now + self.session_ttl, now)
+        )
+        if self.max_sessions_per_user > 0:
+            await db_manager.execute(
+                "DELETE FROM sessions WHERE user_id = ? AND token NOT IN "
+                "(SELECT token FROM sessions WHERE user_id = ? ORDER BY last_used_at DESC LIMIT ?)",
+                (user_id, user_id, self.max_sessions_per_user)
+            )
+        return token
+
+    async def validate_session_token(self, token: str) -> Optional[int]:
+        """返回令牌对应的用户 ID，令牌不存在或已过期时返回 None"""
+        if not token:
+            return None
+        row = await db_manager.fetchone("SELECT user_id, expires_at FROM sessions WHERE token = ?", (token,))
+        if not row:
+            return None
+        now = time.time()
+        if row['expires_at'] <= now:
+            await self.revoke_session_token(token)
+            return None
+        if row['expires_at'] - now < self.session_ttl - self.session_refresh_interval:
+            await db_manager.execute(
+                "UPDATE sessions SET expires_at = ?, last_used_at = ? WHERE token = ?",
+                (now + self.session_ttl, now, token)
+            )
+        return row['user_id']
+
+    async def revoke_session_token(self, token: str):
+        await db_manager.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+    async def prune_expired_sessions(self, batch_size: int = 5000) -> int:
+        """分批删除过期令牌，避免长时间占用数据库写锁，返回删除的总数"""
+        total = 0
+        while True:
+            deleted = await db_manager.execute(
+                "DELETE FROM sessions WHERE rowid IN (SELECT rowid FROM sessions WHERE expires_at <= ? LIMIT ?)",
+                (time.time(), batch_size)
+            )
+            total += deleted
+            if deleted < batch_size:
+                return total
+            await asyncio.sleep(0)
+
+    def start_session_pruning(self, interval: float):
+        """定期清理过期令牌 (interval <= 0 时不启用)"""
+        if interval <= 0 or self._prune_task:
+            return
+        self._prune_task = asyncio.create_task(self._session_prune_loop(interval))
+
+    def stop_session_pruning(self):
+        if self._prune_task:
+            self._prune_task.cancel()
+            self._prune_task = None
 
-        return users_list
+    async def _session_prune_loop(self, interval: float):
+        batch_size = config.get('security.sessions.prune_batch_size', 5000)
+        while True:
+            try:
+                deleted = await self.prune_expired_sessions(batch_size)
+                if deleted:
+                    logging.info(f"已清理 {deleted} 个过期的会话令牌")
+            except Exception as e:
+                logging.error(f"清理过期会话令牌时出错: {e}", exc_info=True)
+            await asyncio.sleep(interval)
 
     async def get_user_roles(self, user_id: int) -> List[str]:
         query = "SELECT r.name FROM roles r JOIN user_roles ur ON r.id = ur.role_id WHERE ur.user_id = ?"
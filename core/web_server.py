@@ -1,4 +1,6 @@
 import asyncio
+import hmac
+import ipaddress
 import logging
 import os
 import base64
@@ -12,6 +14,10 @@ from utils.database import db_manager
 from core.user import User
 from core.session import WebSocketClientSession
 from utils.config import config
+from utils import metrics
+from utils.admission import admission
+from utils.search import message_search, SearchError, ORDER_RANK
+from utils.assets import static_assets, Asset, ENCODING_IDENTITY
 
 if TYPE_CHECKING:
     from server import Server
@@ -19,6 +25,14 @@ if TYPE_CHECKING:
 DEFAULT_AVATAR_BASE64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
 DEFAULT_AVATAR_DATA = base64.b64decode(DEFAULT_AVATAR_BASE64 )
 
+# 带内容哈希的构建产物可以永久缓存；页面包含这些 URL，每次都需向服务器确认；
+# 需要登录的 API 响应只允许客户端自己缓存，凭 ETag 确认
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "no-cache"
+CACHE_PRIVATE_REVALIDATE = "private, no-cache"
+
+_not_modified = metrics.registry.counter('http_not_modified_total', '凭 ETag 返回 304 的响应数')
+
 async def default_avatar_handler(request: web.Request):
     try:
         avatar_path = 'web/static/assets/default_avatar.png'
@@ -33,10 +47,8 @@ async def default_avatar_handler(request: web.Request):
          return web.Response(body=DEFAULT_AVATAR_DATA, content_type="image/png")
 
 
-async def get_user_from_request(request: web.Request) -> Optional[User]:
-    """
-    从请求的 Authorization 头、Cookie 或查询参数中获取 session token 并验证用户。
-    """
+def _get_request_token(request: web.Request) -> Optional[str]:
+    """依次从 Authorization 头、Cookie 和查询参数中取 session token"""
     token = None
     auth_header = request.headers.get("Authorization")
     if auth_header and auth_header.startswith("Bearer "):
@@ -47,15 +59,22 @@ async def get_user_from_request(request: web.Request) -> Optional[User]:
 
     if not token:
         token = request.query.get("token")
+    return token
 
+
+async def get_user_from_request(request: web.Request) -> Optional[User]:
+    """
+    从请求的 Authorization 头、Cookie 或查询参数中获取 session token 并验证用户。
+    """
+    token = _get_request_token(request)
     if not token:
         return None
 
-    session_data = await db_manager.fetchone("SELECT user_id FROM sessions WHERE token = ?", (token,))
-    if not session_data:
+    user_id = await request.app['server'].user_manager.validate_session_token(token)
+    if user_id is None:
         return None
         
-    user_data = await db_manager.fetchone("SELECT id, username, hashed_password, email, is_verified, login_otp_enabled, avatar_filename, display_name FROM users WHERE id = ?", (session_data['user_id'],))
+    user_data = await db_manager.fetchone("SELECT id, username, hashed_password, email, is_verified, login_otp_enabled, avatar_filename, display_name FROM users WHERE id = ?", (user_id,))
     if not user_data:
         return None
     
@@ -63,6 +82,44 @@ async def get_user_from_request(request: web.Request) -> Optional[User]:
     return request.app['server'].user_manager._create_user_from_data(user_data, roles)
 
 
+async def logout_handler(request: web.Request):
+    """吊销当前令牌并清除 Cookie"""
+    token = _get_request_token(request)
+    if token:
+        await request.app['server'].user_manager.revoke_session_token(token)
+    response = web.json_response({"success": True})
+    response.del_cookie("session_token", path="/")
+    return response
+
+
+async def search_messages_handler(request: web.Request):
+    """GET /api/channels/{id}/search?q=...&limit=&cursor=&order=rank|recent"""
+    server: Server = request.app['server']
+    user = await get_user_from_request(request)
+    if not user:
+        return web.json_response({"error": "Unauthorized"}, status=401)
+
+    try:
+        channel_id = int(request.match_info['channel_id'])
+    except ValueError:
+        return web.json_response({"error": "无效的频道ID格式。"}, status=400)
+    if not server.channel_manager.get_channel_by_id(channel_id):
+        return web.json_response({"error": "目标频道不存在。"}, status=404)
+
+    query = request.query.get('q', '')
+    try:
+        result = await message_search.search(
+            channel_id, query, request.query.get('limit'), request.query.get('cursor'), request.query.get('order', ORDER_RANK)
+        )
+    except SearchError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    except Exception as e:
+        logging.error(f"搜索频道 {channel_id} 的消息时出错: {e}", exc_info=True)
+        return web.json_response({"error": "内部服务器错误"}, status=500)
+    result.update({"channel_id": channel_id, "query": query})
+    return web.json_response(result)
+
+
 async def upload_avatar_handler(request: web.Request):
     server: Server = request.app['server']
     user = await get_user_from_request(request)
@@ -89,15 +146,17 @@ async def upload_avatar_handler(request: web.Request):
         stored_filename = f"{user.id}_{uuid.uuid4().hex}{ext}"
         filepath = os.path.join('uploads', 'avatars', stored_filename)
         
+        avatar_data = avatar_file.file.read()
         with open(filepath, 'wb') as f:
-            f.write(avatar_file.file.read())
+            f.write(avatar_data)
+        metrics.upload_bytes.labels('avatar').inc(len(avatar_data))
         
         await db_manager.execute("UPDATE users SET avatar_filename = ? WHERE id = ?", (stored_filename, user.id))
         
         session = await server.get_session_by_username(user.username)
         if session and session.user:
             session.user.avatar_filename = stored_filename
-            await server.broadcast_all_registered_users_status() 
+            await server.channel_members.note_changed(user.username)
 
         avatar_url = f"/uploads/avatars/{stored_filename}"
         logging.info(f"用户 '{user.display_name or user.username}' 成功上传了新头像: {stored_filename}")
@@ -162,10 +221,22 @@ async def websocket_handler(request: web.Request):
     server: Server = request.app['server']
     
     peername = request.remote 
-    ws = web.WebSocketResponse(heartbeat=10)
-    await ws.prepare(request)
+    # 在协议升级之前做准入检查，被拒绝的连接只收到一个 503 响应
+    reason = admission.admit(peername)
+    if reason:
+        logging.warning(f"拒绝 WebSocket 连接 {peername}: {reason}")
+        return web.json_response({"error": "服务器繁忙，请稍后重试", "reason": reason}, status=503, headers={"Retry-After": "5"})
+    # 心跳和 PING/PONG 由会话通过全局时间轮处理，不为每个连接单独设置定时器
+    ws = web.WebSocketResponse(autoping=False, compress=config.get('server.web_server.ws_compression', True))
+    try:
+        await ws.prepare(request)
+    except Exception:
+        admission.release(peername, authenticated=False)
+        raise
     
     session = WebSocketClientSession(server, ws, peername) 
+    session.admitted = True
+    session.set_language(request.headers.get('Accept-Language'))
     server.add_session(session)
     
     await session.handle_session()
@@ -180,23 +251,81 @@ async def index_handler(request: web.Request):
     else:
         return web.HTTPFound('/login')
 
-@aiohttp_jinja2.template('login.html')
+def _page_context() -> dict:
+    # 修改: 不再传递 host 和 port
+    return {"ws_protocol": "wss" if config.get('server.web_server.tls.enabled') else "ws"}
+
+def _asset_response(request: web.Request, asset: Asset, cache_control: str) -> web.Response:
+    headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding", "ETag": asset.etag}
+    if asset.matches(request.headers.get('If-None-Match', '')):
+        _not_modified.inc()
+        return web.Response(status=304, headers=headers)
+    encoding, body = asset.select(request.headers.get('Accept-Encoding', ''))
+    headers["Content-Type"] = asset.content_type
+    if encoding != ENCODING_IDENTITY:
+        headers["Content-Encoding"] = encoding
+    return web.Response(body=body, headers=headers)
+
+def _render_page(request: web.Request, template: str) -> web.Response:
+    """页面内容只取决于配置，启用资源构建时在启动时渲染一次并缓存 (连同压缩版本)"""
+    page = request.app['pages'].get(template)
+    if page is None:
+        return aiohttp_jinja2.render_template(template, request, _page_context())
+    return _asset_response(request, page, CACHE_REVALIDATE)
+
 async def login_page_handler(request: web.Request):
     user = await get_user_from_request(request)
     if user:
         return web.HTTPFound('/app')
-    ws_protocol = "wss" if config.get('server.web_server.tls.enabled') else "ws"
-    # 修改: 不再传递 host 和 port
-    return {"ws_protocol": ws_protocol}
+    return _render_page(request, 'login.html')
 
-@aiohttp_jinja2.template('app.html')
 async def app_page_handler(request: web.Request):
     user = await get_user_from_request(request)
     if not user:
         return web.HTTPFound('/login')
-    ws_protocol = "wss" if config.get('server.web_server.tls.enabled') else "ws"
-    # 修改: 不再传递 host 和 port
-    return {"ws_protocol": ws_protocol}
+    return _render_page(request, 'app.html')
+
+async def dist_asset_handler(request: web.Request):
+    asset = static_assets.get(request.match_info['path'])
+    if asset is None:
+        raise web.HTTPNotFound()
+    return _asset_response(request, asset, CACHE_IMMUTABLE)
+
+
+async def channels_handler(request: web.Request):
+    """GET /api/channels，频道列表未变化时凭 If-None-Match 返回 304"""
+    user = await get_user_from_request(request)
+    if not user:
+        return web.json_response({"error": "Unauthorized"}, status=401)
+    channel_manager = request.app['server'].channel_manager
+    cached = request.app['channel_list']
+    if cached.get('version') != channel_manager.version:
+        cached['asset'] = Asset('application/json; charset=utf-8', channel_manager.channel_list_json())
+        cached['version'] = channel_manager.version
+    return _asset_response(request, cached['asset'], CACHE_PRIVATE_REVALIDATE)
+
+
+def _metrics_allowed(request: web.Request) -> bool:
+    token = config.get('server.web_server.metrics_token', '')
+    if token:
+        return hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode())
+    try:
+        return ipaddress.ip_address(request.remote or '').is_loopback
+    except ValueError:
+        return False
+
+async def metrics_handler(request: web.Request):
+    if not _metrics_allowed(request):
+        raise web.HTTPForbidden()
+    return web.Response(
+        body=metrics.registry.render().encode('utf-8'),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+async def count_download_bytes(request: web.Request, response: web.StreamResponse):
+    """on_response_prepare 钩子: 统计通过静态路由下载的文件字节数"""
+    if request.path.startswith('/uploads/') and response.content_length:
+        metrics.download_bytes.labels('http').inc(response.content_length)
 
 
 def setup_web_server(server: 'Server') -> web.Application:
@@ -208,17 +337,36 @@ def setup_web_server(server: 'Server') -> web.Application:
     os.makedirs(os.path.join(static_dir, 'css'), exist_ok=True)
     os.makedirs(os.path.join(static_dir, 'js'), exist_ok=True)
     
-    aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader(web_dir ))
+    env = aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader(web_dir ))
+    env.globals.update(asset=static_assets.url, module_preloads=static_assets.module_preloads)
+    app['pages'] = {}
+    # 按频道列表版本缓存的 /api/channels 响应
+    app['channel_list'] = {}
+    if static_assets.enabled:
+        static_assets.load()
+        for template in ('login.html', 'app.html'):
+            if not os.path.exists(os.path.join(web_dir, template)):
+                continue
+            html = env.get_template(template).render(_page_context()).encode('utf-8')
+            app['pages'][template] = Asset('text/html; charset=utf-8', html)
     
     app.router.add_get('/', index_handler)
     app.router.add_get('/login', login_page_handler)
     app.router.add_get('/app', app_page_handler)
     app.router.add_get('/ws', websocket_handler)
 
+    app.router.add_post('/api/logout', logout_handler)
     app.router.add_post('/api/user/avatar', upload_avatar_handler)
     app.router.add_post('/api/files/upload', upload_file_handler)
+    app.router.add_get('/api/channels', channels_handler)
+    app.router.add_get('/api/channels/{channel_id}/search', search_messages_handler)
+
+    if config.get('server.web_server.metrics_enabled', False):
+        app.router.add_get('/metrics', metrics_handler)
+        app.on_response_prepare.append(count_download_bytes)
     
     app.router.add_get('/static/assets/default_avatar.png', default_avatar_handler)
+    app.router.add_get('/static/dist/{path:.+}', dist_asset_handler)
     app.router.add_static('/static/', path=static_dir, name='static')
     app.router.add_static('/uploads/', path='uploads', name='uploads')
     
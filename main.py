@@ -2,34 +2,87 @@
 import asyncio
 import logging
 import os
+import signal
 import ssl
+import sys
+import time
+
+# 启动耗时从导入依赖之前开始计算
+_process_started = time.perf_counter()
 
 from server import Server
-from utils.logger import setup_logger
+from utils.logger import setup_logger, stop_logger
 from utils.config import config
 from utils.migration import run_migrations
 from utils.database import db_manager
 from core.web_server import setup_web_server
 from aiohttp import web
-from utils import security
+from utils import security, supervisor, metrics
+from core.user import UserManager
+from core.channel import ChannelManager
 
 # 添加: 导入 BaseSession 和 WebSocketClientSession
 from core.session import BaseSession, WebSocketClientSession, TcpClientSession
 
+_imports_finished = time.perf_counter()
+
+
+class StartupTimer:
+    """记录启动各阶段耗时，就绪后输出一行汇总并写入 startup_phase_seconds 指标"""
+    def __init__(self, started: float):
+        self.started = self.last = started
+        self.phases = []
+
+    def mark(self, phase: str, now: float = None):
+        now = time.perf_counter() if now is None else now
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        total = self.last - self.started
+        for phase, seconds in self.phases:
+            metrics.startup_phase_seconds.labels(phase).set(seconds)
+        metrics.startup_phase_seconds.labels('total').set(total)
+        breakdown = ', '.join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self.phases)
+        voice = "已加载" if 'aiortc' in sys.modules else "未加载"
+        logging.info(f"启动完成，共耗时 {total * 1000:.0f} ms ({breakdown}; 语音子系统{voice})")
+
+async def bootstrap():
+    """迁移数据库并初始化共享数据，多进程模式下只在主管进程中执行一次"""
+    await run_migrations(db_manager)
+    await UserManager().initialize_roles_and_admins()
+    await ChannelManager().initialize_channels()
+
+
 async def main():
+    current_worker = supervisor.worker_id()
+    timer = StartupTimer(_process_started)
+    timer.mark('imports', _imports_finished)
     setup_logger(
         log_dir=config.get('logging.dir'),
         level=config.get('logging.level'),
-        debug=config.get('logging.debug')
+        debug=config.get('logging.debug'),
+        log_format=config.get('logging.format', 'text'),
+        queue_size=config.get('logging.queue_size', 10000),
+        file_name=f"server-worker{current_worker}.log" if current_worker is not None else 'server.log'
     )
     
-    await run_migrations(db_manager)
+    timer.mark('logger')
+    if current_worker is None:
+        await run_migrations(db_manager)
+    timer.mark('migrations')
 
     server = Server()
-    await server.initialize()
+    await server.initialize(bootstrap=current_worker is None)
+    timer.mark('initialize')
 
-    tasks = []
     web_runner = None
+    web_site = None
+    # 多进程模式下各工作进程以 SO_REUSEPORT 绑定同一端口
+    reuse_port = current_worker is not None
+    # 监听套接字由这里创建 (或从上一个进程继承)，以便重启时交给接替进程
+    listen_sockets = {}
+    listen_backlog = config.get('server.admission.listen_backlog', 128)
     
     main_tasks = []
 
@@ -40,8 +93,9 @@ async def main():
         web_host = config.get('server.web_server.host')
         web_port = config.get('server.web_server.port')
         web_ssl_context = security.create_ssl_context_from_path('server.web_server.tls')
-        web_site = web.TCPSite(web_runner, web_host, web_port, ssl_context=web_ssl_context)
-        main_tasks.append(web_site.start())
+        listen_sockets['web'] = supervisor.create_listen_socket('web', web_host, web_port, reuse_port, listen_backlog)
+        web_site = web.SockSite(web_runner, listen_sockets['web'], ssl_context=web_ssl_context)
+        await web_site.start()
         
         web_protocol = "https" if web_ssl_context else "http"
         display_host = 'localhost' if web_host == '0.0.0.0' else web_host
@@ -49,27 +103,64 @@ async def main():
 
     if config.get('server.tcp_server.enabled'):
         # 修正: TCP 服务器的启动逻辑，现在它将启动并处理 TCP 连接
-        main_tasks.append(server.start_tcp_server())
-        logging.info("TCP 服务器已启用。")
+        tcp_host, tcp_port = config.get('server.tcp_server.host'), config.get('server.tcp_server.port')
+        if tcp_host and tcp_port:
+            listen_sockets['tcp'] = supervisor.create_listen_socket('tcp', tcp_host, tcp_port, reuse_port, listen_backlog)
+        if await server.bind_tcp_server(sock=listen_sockets.get('tcp')):
+            main_tasks.append(server.start_tcp_server())
+            logging.info("TCP 服务器已启用。")
+    timer.mark('listeners')
 
 
-    if not main_tasks:
+    if not main_tasks and not web_runner:
         logging.error("所有服务器均未在 config.yml 中启用，程序退出。")
         return
 
+    main_task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+
+    async def hand_over_listeners():
+        # SIGUSR2: 启动接替进程并交出监听套接字，接替进程就绪后本进程排空退出
+        if await loop.run_in_executor(None, supervisor.spawn_successor, listen_sockets):
+            main_task.cancel()
+
+    # 主管进程通过 SIGTERM 通知工作进程退出 (滚动重启或停止)
+    for sig, handler in (('SIGTERM', main_task.cancel), ('SIGUSR2', lambda: asyncio.ensure_future(hand_over_listeners()))):
+        if hasattr(signal, sig) and (sig != 'SIGUSR2' or current_worker is None):
+            try:
+                loop.add_signal_handler(getattr(signal, sig), handler)
+            except NotImplementedError:
+                pass
+    supervisor.notify_ready()
+    timer.report()
+
     try:
-        await asyncio.gather(*main_tasks)
+        await asyncio.gather(*main_tasks, asyncio.Event().wait())
     except (KeyboardInterrupt, asyncio.CancelledError):
         pass
     finally:
         logging.info("开始关闭所有服务...")
+        # 先停止接受新连接并排空现有会话，再关闭
+        if web_site:
+            await web_site.stop()
+        await server.drain()
+        await server.shutdown()
         if web_runner:
             await web_runner.cleanup()
-        await server.shutdown()
 
 if __name__ == "__main__":
+    workers = config.get('server.workers', 1)
+    if workers > 1 and not supervisor.is_worker():
+        if supervisor.reuse_port_supported():
+            setup_logger(log_dir=config.get('logging.dir'), level=config.get('logging.level'), debug=config.get('logging.debug'),
+                         log_format=config.get('logging.format', 'text'), file_name='supervisor.log')
+            supervisor.Supervisor(workers).run(bootstrap)
+            stop_logger()
+            sys.exit(0)
+        logging.warning("当前平台不支持 SO_REUSEPORT，以单进程模式运行")
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         pass
-    logging.info("程序已退出")
\ No newline at end of file
+    logging.info("程序已退出")
+    stop_logger()
\ No newline at end of file
@@ -0,0 +1,28 @@
+# server/migrations/versions/0010_add_mail_outbox.py
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.database import DatabaseManager
+
+async def upgrade(db: 'DatabaseManager'):
+    """
+    创建 mail_outbox 表，待发送的邮件先持久化，由后台发送任务投递 (版本 10)
+    status: pending 待发送 / sent 已发送 / dead 重试耗尽或永久失败 (死信)
+    """
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS mail_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            content TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+            sent_at TEXT
+        );
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_mail_outbox_due ON mail_outbox (status, next_attempt_at);
+    """)
@@ -0,0 +1,30 @@
+# server/migrations/versions/0011_add_session_expiry.py
+from typing import TYPE_CHECKING
+import logging
+import time
+
+if TYPE_CHECKING:
+    from utils.database import DatabaseManager
+
+# 旧令牌没有过期时间，统一从迁移时起按默认有效期 (7 天) 计算，仍在使用的令牌会被滑动续期
+LEGACY_TOKEN_TTL = 7 * 24 * 3600
+
+async def upgrade(db: 'DatabaseManager'):
+    """
+    为 sessions 表添加过期时间和最后使用时间，并为按用户和按过期时间的查询建立索引 (版本 11)
+    """
+    try:
+        columns = {col['name'] for col in await db.fetchall("PRAGMA table_info(sessions);")}
+        now = time.time()
+        if 'expires_at' not in columns:
+            await db.execute("ALTER TABLE sessions ADD COLUMN expires_at REAL NOT NULL DEFAULT 0;")
+            await db.execute("UPDATE sessions SET expires_at = ?", (now + LEGACY_TOKEN_TTL,))
+            logging.info("列 'expires_at' 已添加到 'sessions' 表，现有令牌已设置过期时间。")
+        if 'last_used_at' not in columns:
+            await db.execute("ALTER TABLE sessions ADD COLUMN last_used_at REAL NOT NULL DEFAULT 0;")
+            await db.execute("UPDATE sessions SET last_used_at = ?", (now,))
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions (user_id, last_used_at);")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at);")
+    except Exception as e:
+        logging.critical(f"应用迁移版本 11 (0011_add_session_expiry.py) 失败: {e}", exc_info=True)
+        raise
@@ -0,0 +1,56 @@
+# server/migrations/versions/0012_add_message_search.py
+from typing import TYPE_CHECKING
+import logging
+
+if TYPE_CHECKING:
+    from utils.database import DatabaseManager
+
+# 被索引的文本: 文件消息 (FileManager.handle_http_upload 写入的 JSON) 取文件名，其它消息取原文
+INDEXED_TEXT = """
+    CASE WHEN json_valid({row}.content) AND json_extract({row}.content, '$.type') = 'file'
+         THEN json_extract({row}.content, '$.name')
+         ELSE {row}.content END
+"""
+
+async def _create_fts_table(db: 'DatabaseManager'):
+    # trigram 分词器 (SQLite 3.34+) 支持中文等没有空格分词的文本按子串检索，旧版本退回 unicode61
+    try:
+        await db.execute("CREATE VIRTUAL TABLE messages_fts USING fts5(body, channel_id UNINDEXED, tokenize = 'trigram');")
+    except Exception as e:
+        logging.warning(f"SQLite 不支持 trigram 分词器 ({e})，消息搜索改用 unicode61 分词")
+        await db.execute("CREATE VIRTUAL TABLE messages_fts USING fts5(body, channel_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2');")
+
+async def upgrade(db: 'DatabaseManager'):
+    """
+    创建 FTS5 全文索引 messages_fts (rowid 与 messages.id 相同)，由触发器随 messages 表的增删改同步，
+    并为已有消息建立索引 (版本 12)
+    """
+    try:
+        exists = await db.fetchval("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts';")
+        if not exists:
+            await _create_fts_table(db)
+            await db.execute(f"""
+                INSERT INTO messages_fts (rowid, body, channel_id)
+                SELECT m.id, {INDEXED_TEXT.format(row='m')}, m.channel_id FROM messages m;
+            """)
+            logging.info("已创建消息全文索引 'messages_fts' 并索引现有消息。")
+
+        await db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, body, channel_id) VALUES (new.id, {INDEXED_TEXT.format(row='new')}, new.channel_id);
+            END;
+        """)
+        await db.execute("""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                DELETE FROM messages_fts WHERE rowid = old.id;
+            END;
+        """)
+        await db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content, channel_id ON messages BEGIN
+                DELETE FROM messages_fts WHERE rowid = old.id;
+                INSERT INTO messages_fts (rowid, body, channel_id) VALUES (new.id, {INDEXED_TEXT.format(row='new')}, new.channel_id);
+            END;
+        """)
+    except Exception as e:
+        logging.critical(f"应用迁移版本 12 (0012_add_message_search.py) 失败: {e}", exc_info=True)
+        raise
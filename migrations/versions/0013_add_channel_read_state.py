@@ -0,0 +1,20 @@
+# server/migrations/versions/0013_add_channel_read_state.py
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.database import DatabaseManager
+
+async def upgrade(db: 'DatabaseManager'):
+    """
+    创建 channel_read_state 表记录每个用户在各频道最后已读的消息 ID，未读数由此推算 (版本 13)；
+    并为按频道取消息 (历史记录、未读计数) 建立 (channel_id, id) 索引，切换频道时不再扫描整张消息表
+    """
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS channel_read_state (
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            last_read_message_id INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, channel_id)
+        ) WITHOUT ROWID;
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_messages_channel_id ON messages (channel_id, id);")
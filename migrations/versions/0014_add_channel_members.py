@@ -0,0 +1,30 @@
+# server/migrations/versions/0014_add_channel_members.py
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.database import DatabaseManager
+
+async def upgrade(db: 'DatabaseManager'):
+    """
+    创建 channel_members 表记录频道成员，成员列表和在线状态按频道下发 (版本 14)；
+    已有数据: 所有用户都进入过默认频道 (第一个频道)，在其它频道发过言的用户成为该频道的成员
+    """
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS channel_members (
+            channel_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            joined_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+            PRIMARY KEY (channel_id, user_id)
+        ) WITHOUT ROWID;
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_channel_members_user_id ON channel_members (user_id, channel_id);")
+    await db.execute("""
+        INSERT OR IGNORE INTO channel_members (channel_id, user_id)
+        SELECT (SELECT MIN(id) FROM channels), id FROM users WHERE EXISTS (SELECT 1 FROM channels);
+    """)
+    await db.execute("""
+        INSERT OR IGNORE INTO channel_members (channel_id, user_id)
+        SELECT DISTINCT m.channel_id, m.user_id FROM messages m
+        JOIN channels c ON c.id = m.channel_id
+        JOIN users u ON u.id = m.user_id;
+    """)
@@ -0,0 +1,14 @@
+# server/migrations/versions/0015_add_mail_outbox_lease.py
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.database import DatabaseManager
+
+async def upgrade(db: 'DatabaseManager'):
+    """
+    为 mail_outbox 添加 lease_until 字段 (版本 15): 发送任务先把邮件原子地标记为 sending 并租用到 lease_until，
+    重启或监听交接期间新旧两个发送任务不会发送同一封邮件；租约过期的 sending 邮件 (进程在发送中退出) 会被重新领取
+    """
+    columns = await db.fetchall("PRAGMA table_info(mail_outbox);")
+    if not any(col['name'] == 'lease_until' for col in columns):
+        await db.execute("ALTER TABLE mail_outbox ADD COLUMN lease_until REAL;")
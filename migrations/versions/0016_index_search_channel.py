@@ -0,0 +1,59 @@
+# server/migrations/versions/0016_index_search_channel.py
+from typing import TYPE_CHECKING
+import logging
+
+if TYPE_CHECKING:
+    from utils.database import DatabaseManager
+
+# 与 0012 相同: 文件消息取文件名，其它消息取原文
+INDEXED_TEXT = """
+    CASE WHEN json_valid({row}.content) AND json_extract({row}.content, '$.type') = 'file'
+         THEN json_extract({row}.content, '$.name')
+         ELSE {row}.content END
+"""
+# 频道列的值为 '#<id>#'，两侧的分隔符使 trigram 分词下 '#10#' 不会命中 '#110#'
+CHANNEL_TOKEN = "'#' || {row}.channel_id || '#'"
+
+async def _create_fts_table(db: 'DatabaseManager'):
+    try:
+        await db.execute("CREATE VIRTUAL TABLE messages_fts USING fts5(body, channel, tokenize = 'trigram');")
+    except Exception as e:
+        logging.warning(f"SQLite 不支持 trigram 分词器 ({e})，消息搜索改用 unicode61 分词")
+        await db.execute("CREATE VIRTUAL TABLE messages_fts USING fts5(body, channel, tokenize = 'unicode61 remove_diacritics 2');")
+
+async def upgrade(db: 'DatabaseManager'):
+    """
+    重建 messages_fts (版本 16): 频道从 UNINDEXED 列改为被索引的 channel 列，
+    搜索时把频道条件写进 MATCH 表达式，只在目标频道的命中中取结果，而不是先匹配所有频道再过滤
+    """
+    try:
+        for trigger in ('messages_fts_insert', 'messages_fts_delete', 'messages_fts_update'):
+            await db.execute(f"DROP TRIGGER IF EXISTS {trigger};")
+        await db.execute("DROP TABLE IF EXISTS messages_fts;")
+        await _create_fts_table(db)
+        await db.execute(f"""
+            INSERT INTO messages_fts (rowid, body, channel)
+            SELECT m.id, {INDEXED_TEXT.format(row='m')}, {CHANNEL_TOKEN.format(row='m')} FROM messages m;
+        """)
+        await db.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize');")
+        logging.info("已重建消息全文索引 'messages_fts' (频道列改为被索引)。")
+
+        await db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, body, channel) VALUES (new.id, {INDEXED_TEXT.format(row='new')}, {CHANNEL_TOKEN.format(row='new')});
+            END;
+        """)
+        await db.execute("""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                DELETE FROM messages_fts WHERE rowid = old.id;
+            END;
+        """)
+        await db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content, channel_id ON messages BEGIN
+                DELETE FROM messages_fts WHERE rowid = old.id;
+                INSERT INTO messages_fts (rowid, body, channel) VALUES (new.id, {INDEXED_TEXT.format(row='new')}, {CHANNEL_TOKEN.format(row='new')});
+            END;
+        """)
+    except Exception as e:
+        logging.critical(f"应用迁移版本 16 (0016_index_search_channel.py) 失败: {e}", exc_info=True)
+        raise
@@ -1,88 +1,232 @@
 import asyncio
+import importlib
 import logging
 import os
+import random
 import socket
+import ssl
+import time
 from typing import Set, Optional, Dict, List, Any
 
 from utils.config import config
-from utils import protocol as proto, database as db, security
+from utils import protocol as proto, database as db, security, metrics
 from core.session import BaseSession, WebSocketClientSession, TcpClientSession
 from core.user import UserManager, User
 from core.channel import ChannelManager, Channel
 from core.commands import CommandHandler
 from core.actions import ActionHandler
 from core.file import FileManager
-from core.sfu import SFUServer
+from core.unread import UnreadTracker
+from core.members import ChannelMembers
+from utils.compression import ws_compression_stats
+from utils.i18n import translator
+from utils import backplane as bp, supervisor
+from utils.admission import admission
+from utils.ratelimit import peer_ip
+from utils.mailer import mail_sender
+from utils.replay import replay_log
+from utils.timerwheel import timer_wheel
+
+_channel_fanout = metrics.broadcast_fanout.labels('channel')
+_channel_duration = metrics.broadcast_duration.labels('channel')
+_all_fanout = metrics.broadcast_fanout.labels('all')
+_all_duration = metrics.broadcast_duration.labels('all')
+
+def _excluded_username(session: Optional[BaseSession]) -> Optional[str]:
+    return session.user.username.lower() if session is not None and session.user else None
 
 class Server:
     def __init__(self):
         self.sessions: Set[BaseSession] = set()
+        # 以该频道为当前 (聚焦) 频道的会话，接收完整的频道广播
         self.channel_sessions: Dict[int, Set[BaseSession]] = {}
+        # 订阅了该频道的会话 (包括聚焦的)，未聚焦的只接收未读数增量
+        self.channel_subscribers: Dict[int, Set[BaseSession]] = {}
         self.user_manager = UserManager()
         self.channel_manager = ChannelManager()
         self.action_handler = ActionHandler(self)
         self.command_handler = CommandHandler(self)
         self.file_manager = FileManager(self)
+        self.unread_tracker = UnreadTracker(self)
+        self.channel_members = ChannelMembers(self)
         
-        # 修改: 以最简单的方式初始化 SFUServer
-        self.sfu_server = SFUServer()
+        # 语音 (SFU) 依赖的 aiortc 导入较慢，首次有用户加入语音频道时才加载；禁用时永不加载
+        self.voice_enabled = config.get('server.voice.enabled', True)
+        self._sfu_server = None
+        self._sfu_lock = asyncio.Lock()
+        metrics.sfu_rooms.set_function(lambda: len(self._sfu_server.rooms) if self._sfu_server else 0)
+        metrics.sfu_participants.set_function(lambda: sum(len(room.participants) for room in self._sfu_server.rooms.values()) if self._sfu_server else 0)
+        metrics.sfu_audio_slots.set_function(lambda: self._sfu_server.audio_slots() if self._sfu_server else 0)
         
         self._tcp_server: Optional[asyncio.Server] = None
+        # 支持时 TLS 握手推迟到准入检查之后 (StreamWriter.start_tls)，被拒绝的连接不消耗握手开销
+        self._tcp_deferred_tls: Optional[ssl.SSLContext] = None
+        self.draining = False
+        # 断线清理等后台任务，排空时等待其完成
+        self._background_tasks: Set[asyncio.Task] = set()
+        # 多节点部署时用于在节点之间复制广播和在线状态
+        self.backplane = bp.create_backplane(multi_worker=supervisor.is_worker())
+        self.backplane.set_handler(self._handle_backplane_event)
         os.makedirs("uploads", exist_ok=True)
         os.makedirs("uploads/avatars", exist_ok=True)
 
-    async def initialize(self):
-        await self.user_manager.initialize_roles_and_admins()
+    async def initialize(self, bootstrap: bool = True):
+        # 多进程模式下角色和内置管理员由主管进程初始化，工作进程只加载频道
+        if bootstrap:
+            await self.user_manager.initialize_roles_and_admins()
         await self.channel_manager.initialize_channels()
+        translator.start_auto_reload(config.get('server.i18n_reload_interval', 5))
         
         for channel in self.channel_manager.channels_by_name.values():
             self.channel_sessions[channel.id] = set()
+            self.channel_subscribers[channel.id] = set()
+        self.unread_tracker.start()
+        timer_wheel.start()
+        if self.voice_enabled and config.get('server.voice.preload', False):
+            self.spawn(self._preload_sfu())
+
+        await self.backplane.start()
+        await self.backplane.publish(bp.EVENT_HELLO, {})
+        # 多进程模式下只由 0 号工作进程投递发件箱中的邮件
+        if supervisor.worker_id() in (None, 0):
+            mail_sender.start()
+            self.user_manager.start_session_pruning(config.get('security.sessions.prune_interval', 3600))
             
         logging.info("核心服务已初始化")
 
-    async def start_tcp_server(self):
+    async def bind_tcp_server(self, reuse_port: Optional[bool] = None, sock: Optional[socket.socket] = None) -> bool:
+        """绑定并开始监听 TCP 端口 (或使用已监听的 sock)，返回是否成功"""
         host, port = config.get('server.tcp_server.host'), config.get('server.tcp_server.port')
         ssl_context = security.create_ssl_context_from_path('server.tcp_server.tls')
-        if not host or not port:
-            logging.error("TCP 服务器的 host 或 port 未在 config.yml 中正确配置"); return
-        self._tcp_server = await asyncio.start_server(self.handle_tcp_connection, host, port, ssl=ssl_context)
-        addr, tls_status = self._tcp_server.sockets[0].getsockname(), "已启用" if ssl_context else "已禁用"
+        tls_enabled = ssl_context is not None
+        if ssl_context is not None and hasattr(asyncio.StreamWriter, 'start_tls'):
+            self._tcp_deferred_tls, ssl_context = ssl_context, None
+        # limit 同时约束 line 模式下单行的最大长度
+        limit = config.get('server.tcp_server.max_frame_size', 1048576)
+        if sock is not None:
+            self._tcp_server = await asyncio.start_server(self.handle_tcp_connection, sock=sock, ssl=ssl_context, limit=limit)
+        else:
+            if not host or not port:
+                logging.error("TCP 服务器的 host 或 port 未在 config.yml 中正确配置"); return False
+            self._tcp_server = await asyncio.start_server(
+                self.handle_tcp_connection, host, port, ssl=ssl_context,
+                limit=limit, reuse_port=reuse_port,
+                backlog=config.get('server.admission.listen_backlog', 128)
+            )
+        addr, tls_status = self._tcp_server.sockets[0].getsockname(), "已启用" if tls_enabled else "已禁用"
         logging.info(f"TCP 服务器已启动，监听于 {addr[0]}:{addr[1]} (TLS: {tls_status})")
+        return True
+
+    async def start_tcp_server(self):
+        if not self._tcp_server and not await self.bind_tcp_server():
+            return
         await self._tcp_server.serve_forever()
 
     async def handle_tcp_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         peername = writer.get_extra_info('peername')
+        ip = peer_ip(peername)
+        reason = admission.admit(ip)
+        if reason:
+            logging.warning(f"拒绝 TCP 连接 {peername}: {reason}")
+            writer.transport.abort()
+            return
+        if self._tcp_deferred_tls is not None:
+            try:
+                await writer.start_tls(self._tcp_deferred_tls, ssl_handshake_timeout=admission.auth_timeout)
+            except (ssl.SSLError, ConnectionError, OSError, asyncio.TimeoutError) as e:
+                logging.info(f"TCP 客户端 {peername} TLS 握手失败: {e}")
+                admission.release(ip, authenticated=False)
+                writer.transport.abort()
+                return
         logging.info(f"收到新的 TCP 连接来自 {peername}")
         session = TcpClientSession(self, reader, writer, peername)
+        session.admitted = True
         self.add_session(session)
         await session.handle_session()
 
     def add_session(self, session: BaseSession):
         self.sessions.add(session)
+        metrics.sessions_active.labels(session.session_type).inc()
         logging.info(f"新连接: {session.peername}, 当前总连接数: {len(self.sessions)}")
 
     def remove_session(self, session: BaseSession):
         if session in self.sessions:
             self.sessions.remove(session)
+            metrics.sessions_active.labels(session.session_type).dec()
+            if session.admitted:
+                admission.release(session.ip, session.admission_authenticated)
             logging.info(f"连接已关闭: {session.peername}, 当前总连接数: {len(self.sessions)}")
-            asyncio.create_task(self.handle_disconnection(session))
+            self.spawn(self.handle_disconnection(session))
     
     async def handle_disconnection(self, session: BaseSession):
         if session.user:
-            logging.info(f"用户 '{session.user.username}' 断开连接，正在更新用户列表...")
+            logging.info(f"用户 '{session.user.username}' 断开连接，正在更新频道成员状态...")
             
             if session.current_channel and session.current_channel.id in self.channel_sessions:
                 self.channel_sessions[session.current_channel.id].discard(session)
+            if session.subscriptions is not None:
+                self._set_subscriptions(session, set())
+                await self.unread_tracker.detach(session.user.id)
 
             if session.current_voice_channel: 
                 await self.leave_voice_channel(session, session.current_voice_channel, is_disconnecting=True) 
 
             await self.user_manager.logout(session.user.username)
+            self.channel_members.forget_user(session.user.id)
+            if self.draining:
+                # 排空期间其它节点通过 node_down 得知下线，也不再逐个推送成员状态
+                return
+            await self.backplane.publish(bp.EVENT_USER_OFFLINE, {"username": session.user.username})
             
-            await self.broadcast_all_registered_users_status()
+            await self.channel_members.note_changed(session.user.username)
         else:
             logging.info(f"未认证或未登录用户 {session.peername} 断开连接，无需特殊清理。")
     
+    def spawn(self, coro) -> asyncio.Task:
+        """创建受跟踪的后台任务，排空时会等待其完成"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_task_done)
+        return task
+
+    def _background_task_done(self, task: asyncio.Task):
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"后台任务出错: {task.exception()}", exc_info=task.exception())
+
+    async def drain(self):
+        """
+        优雅排空: 停止接受新的 TCP 连接 (Web 监听由调用方先行停止)，通知客户端在随机延迟后重连，
+        并等待后台任务和数据库写入完成。
+        """
+        if self.draining:
+            return
+        self.draining = True
+        logging.info(f"开始排空，当前连接数: {len(self.sessions)}")
+        if self._tcp_server:
+            self._tcp_server.close()
+
+        delay_min = config.get('server.drain.reconnect_delay_min', 1.0)
+        delay_max = config.get('server.drain.reconnect_delay_max', 15.0)
+        notices = []
+        for session in list(self.sessions):
+            # 每个客户端的重连时间随机分散，避免重启后所有客户端同时重连
+            delay_ms = int(random.uniform(delay_min, max(delay_min, delay_max)) * 1000)
+            notices.append(session.send(proto.create_message(proto.MSG_TYPE_SERVER_RESTARTING, {
+                "message": session.t('server_restarting'),
+                "reconnect_delay_ms": delay_ms,
+            })))
+        if notices:
+            await asyncio.gather(*notices, return_exceptions=True)
+
+        # 等待进行中的断线清理等任务和数据库写入，之后由 shutdown() 关闭剩余连接
+        grace = config.get('server.drain.grace_seconds', 5.0)
+        deadline = time.monotonic() + grace
+        if self._background_tasks:
+            await asyncio.wait(list(self._background_tasks), timeout=grace)
+        await db.db_manager.flush(max(0.1, deadline - time.monotonic()))
+        logging.info(f"排空完成，剩余连接数: {len(self.sessions)}")
+
     async def shutdown(self):
         logging.info("正在关闭核心服务...")
         if self._tcp_server:
@@ -91,6 +235,15 @@ class Server:
             sessions_copy = list(self.sessions)
             tasks = [s.close() for s in sessions_copy]
             await asyncio.gather(*tasks, return_exceptions=True)
+        translator.stop_auto_reload()
+        await timer_wheel.stop()
+        await self.unread_tracker.stop()
+        await mail_sender.stop()
+        self.user_manager.stop_session_pruning()
+        self.channel_members.stop()
+        await self.backplane.publish(bp.EVENT_NODE_DOWN, {})
+        await self.backplane.close()
+        ws_compression_stats.log_summary()
         logging.info("核心服务已关闭")
 
     def _format_user_info(self, user: User) -> Dict[str, Any]:
@@ -108,11 +261,17 @@ class Server:
     def add_channel_to_session_manager(self, channel: Channel):
         if channel.id not in self.channel_sessions:
             self.channel_sessions[channel.id] = set()
+            self.channel_subscribers[channel.id] = set()
             
     async def remove_channel_from_session_manager(self, channel: Channel):
         if channel.id in self.channel_sessions:
             sessions_to_move = list(self.channel_sessions[channel.id])
             del self.channel_sessions[channel.id]
+            for session in self.channel_subscribers.pop(channel.id, set()):
+                session.subscriptions.discard(channel.id)
+            replay_log.drop(channel.id)
+            self.unread_tracker.drop_channel(channel.id)
+            self.channel_members.drop_channel(channel.id)
             
             for session in sessions_to_move:
                 await session.send(proto.create_message(proto.MSG_TYPE_SYSTEM_MESSAGE, {"message": f"你所在的频道 #{channel.name} 已被删除，你已被移回默认频道。", "level": "warning"}))
@@ -123,26 +282,134 @@ class Server:
         if default_channel:
             await self.join_channel(session, default_channel)
 
-    async def join_channel(self, session: BaseSession, channel: Channel):
+    async def join_initial_channel(self, session: BaseSession, replay: Optional[Dict[str, Any]] = None):
+        """登录后进入频道；恢复会话时若客户端带有 replay 信息且仍可补发，则回到原频道并只补发缺失的事件"""
+        if isinstance(replay, dict):
+            try:
+                channel_id, seq = int(replay.get("channel_id")), int(replay.get("seq"))
+            except (TypeError, ValueError):
+                channel_id, seq = None, None
+            channel = self.channel_manager.get_channel_by_id(channel_id) if channel_id is not None else None
+            if channel and channel.id in self.channel_sessions:
+                if replay_log.can_resume(replay.get("epoch"), channel.id, seq):
+                    await self.join_channel(session, channel, resume_seq=seq)
+                    return
+        await self.join_default_channel(session)
+
+    def _set_subscriptions(self, session: BaseSession, channel_ids: Set[int]):
+        old = session.subscriptions or set()
+        for channel_id in old - channel_ids:
+            self.channel_subscribers.get(channel_id, set()).discard(session)
+        for channel_id in channel_ids - old:
+            self.channel_subscribers[channel_id].add(session)
+        session.subscriptions = channel_ids
+
+    async def subscribe_channels(self, session: BaseSession, channel_ids: List[Any]):
+        """
+        把会话的订阅集合设置为给定的文本频道 (当前频道总是包含在内)，并回复各频道的未读数。
+        首次订阅时从数据库加载该用户的已读位置，之后的计数都在内存中维护。
+        """
+        if not session.user:
+            return
+        wanted: Set[int] = set()
+        for channel_id in channel_ids:
+            try:
+                channel = self.channel_manager.get_channel_by_id(int(channel_id))
+            except (TypeError, ValueError):
+                continue
+            if channel and channel.type == 'text' and channel.id in self.channel_subscribers:
+                wanted.add(channel.id)
+        if session.current_channel and session.current_channel.id in self.channel_subscribers:
+            wanted.add(session.current_channel.id)
+
+        if session.subscriptions is None:
+            session.subscriptions = set()
+            await self.unread_tracker.attach(session.user.id, wanted)
+        else:
+            await self.unread_tracker.ensure_loaded(session.user.id, wanted)
+        self._set_subscriptions(session, wanted)
+        if session.current_channel:
+            self.unread_tracker.mark_read(session.user.id, session.current_channel.id)
+        counts = self.unread_tracker.counts(session.user.id, wanted)
+        await session.send(proto.create_message(proto.MSG_TYPE_UNREAD_COUNTS, {
+            "unread": {str(channel_id): count for channel_id, count in counts.items()},
+            "max_count": self.unread_tracker.max_count
+        }))
+
+    async def _resume_channel(self, session: BaseSession, channel: Channel, seq: int) -> bool:
+        """
+        补发 seq 之后的频道事件后再把会话加入频道成员，返回 False 表示缺口已超出日志范围 (此时尚未发送任何消息)。
+        最后一次检查没有新事件与加入成员之间没有 await，期间不会漏掉或乱序任何广播。
+        """
+        events = replay_log.since(channel.id, seq)
+        if events is None:
+            return False
+        # 此后不能再回退为快照: 客户端已收到部分补发，再发快照会与之重叠
+        await session.send(proto.create_message(proto.MSG_TYPE_JOIN_SUCCESS, {
+            "channel_id": channel.id,
+            "channel_name": channel.name,
+            "channel_topic": channel.topic,
+            "epoch": replay_log.epoch,
+            "seq": seq,
+            "replayed": True
+        }))
+        count = 0
+        while True:
+            for event in events:
+                message = event.render(session)
+                if message is not None:
+                    await session.send(message)
+                    count += 1
+                seq = event.seq
+            # 发送期间可能有新的广播进入日志
+            events = replay_log.since(channel.id, seq)
+            if events is None:
+                # 补发期间到达的事件多到被挤出日志: 断开连接，客户端以最后收到的序号重新恢复
+                logging.warning(f"补发频道 #{channel.name} 期间新事件超出重放日志范围，断开 {session.peername}")
+                replay_log.record_replayed(count)
+                await session.close()
+                return True
+            if not events:
+                break
+        self.channel_sessions[channel.id].add(session)
+        replay_log.record_replayed(count)
+        # 断线期间错过的成员状态变化不在重放日志中，重新下发成员列表的第一页
+        members = await self.channel_members.page_payload(session, channel.id)
+        await session.send(proto.create_message(proto.MSG_TYPE_CHANNEL_MEMBERS, {"channel_id": channel.id, **members}))
+        logging.info(f"用户 {session.user.display_name or session.user.username} 恢复了频道 #{channel.name}，补发 {count} 条事件")
+        return True
+
+    async def join_channel(self, session: BaseSession, channel: Channel, resume_seq: Optional[int] = None):
+        # 已在某个频道中时只是切换聚焦频道: 在线状态不变，只下发新频道的成员列表
+        switching = session.current_channel is not None
         if session.current_channel:
             await self.leave_channel(session, session.current_channel)
             
         session.current_channel = channel
+        joined = session.user is not None and await self.channel_members.ensure_member(channel.id, session.user)
+        if session.user and session.subscriptions is not None and channel.id in self.channel_subscribers:
+            self._set_subscriptions(session, session.subscriptions | {channel.id})
+            await self.unread_tracker.ensure_loaded(session.user.id, (channel.id,))
+            self.unread_tracker.mark_read(session.user.id, channel.id)
+        if session.user and resume_seq is not None and await self._resume_channel(session, channel, resume_seq):
+            await self._announce_member(session, channel, joined, switching)
+            return
         self.channel_sessions[channel.id].add(session)
         
         if session.user:
             history_limit = config.get('server.message_history_on_join', 20)
             history = await db.db_manager.get_latest_messages(channel.id, history_limit)
-            
-            all_registered_users_status = await self.user_manager.get_all_registered_users()
 
             payload = {
                 "channel_id": channel.id,
                 "channel_name": channel.name,
                 "channel_topic": channel.topic,
                 "history": history,
-                "users": all_registered_users_status
+                # 快照对应的事件序号，之后收到的广播序号从 seq + 1 开始
+                "epoch": replay_log.epoch,
+                "seq": replay_log.current_seq(channel.id)
             }
+            payload.update(await self.channel_members.page_payload(session, channel.id))
             await session.send(proto.create_message(proto.MSG_TYPE_JOIN_SUCCESS, payload))
             
             if not session.is_resumed_session:
@@ -153,35 +420,70 @@ class Server:
                     exclude_session=session
                 )
             
-            await self.broadcast_all_registered_users_status()
+            await self._announce_member(session, channel, joined, switching)
 
         logging.info(f"用户 {session.user.display_name if session.user else ''} 加入了频道 #{channel.name}")
         
+    async def _announce_member(self, session: BaseSession, channel: Channel, joined: bool, switching: bool):
+        """登录后首次进入频道时用户在其所有频道上线；切换到尚未加入的频道时成为该频道的新成员"""
+        if not switching:
+            await self.channel_members.note_changed(session.user.username)
+        elif joined:
+            await self.channel_members.note_changed(session.user.username, channel.id)
+        if joined and self.backplane.is_distributed:
+            await self.backplane.publish(bp.EVENT_CHANNEL_MEMBER_JOINED, {"channel_id": channel.id, "username": session.user.username})
+
     async def leave_channel(self, session: BaseSession, channel: Channel):
         if session in self.channel_sessions.get(channel.id, set()):
             self.channel_sessions[channel.id].discard(session) 
-            if session.user:
-                await self.broadcast_all_registered_users_status()
             logging.info(f"用户 {session.user.display_name if session.user else ''} 离开了频道 #{channel.name}")
     
+    async def _ensure_sfu(self):
+        """按需加载语音子系统: 在线程中导入 core.sfu (连带 aiortc)，避免阻塞事件循环"""
+        if self._sfu_server is not None:
+            return self._sfu_server
+        async with self._sfu_lock:
+            if self._sfu_server is None:
+                started = time.perf_counter()
+                sfu = await asyncio.to_thread(importlib.import_module, 'core.sfu')
+                self._sfu_server = sfu.SFUServer()
+                logging.info(f"语音子系统已加载，耗时 {(time.perf_counter() - started) * 1000:.0f} ms")
+        return self._sfu_server
+
+    async def _preload_sfu(self):
+        try:
+            await self._ensure_sfu()
+        except ImportError as e:
+            logging.error(f"预加载语音子系统失败: {e}")
+
     async def join_voice_channel(self, session: BaseSession, channel: Channel):
         if not session.user: return
         if channel.type != 'voice':
             await session.send(proto.create_error_message(f"频道 #{channel.name} 不是一个语音频道。"))
             return
+        if not self.voice_enabled:
+            await session.send(proto.create_error_message("语音功能未在此服务器上启用。", code="voice_disabled"))
+            return
+        try:
+            sfu_server = await self._ensure_sfu()
+        except ImportError as e:
+            logging.error(f"加载语音子系统失败: {e}")
+            await session.send(proto.create_error_message("语音功能暂不可用。", code="voice_unavailable"))
+            return
 
         if session.current_voice_channel:
             if session.current_voice_channel.id == channel.id: return
             await self.leave_voice_channel(session, session.current_voice_channel)
 
         session.current_voice_channel = channel
+        session.reset_webrtc_state()
         
-        pc = await self.sfu_server.join_room(channel.id, session.user.id)
+        pc = await sfu_server.join_room(channel.id, session.user.id, on_renegotiation_needed=session.renegotiate_webrtc, notify=session.send)
         session.rtc_peer_connection = pc
 
         await session.send(proto.create_message(
             proto.MSG_TYPE_JOIN_VOICE_SUCCESS,
-            {"channel_id": channel.id}
+            {"channel_id": channel.id, "active_speakers": sfu_server.active_speakers(channel.id)}
         ))
         
         logging.info(f"用户 {session.user.display_name or session.user.username} 加入了语音频道 #{channel.name} (SFU)")
@@ -189,9 +491,11 @@ class Server:
     async def leave_voice_channel(self, session: BaseSession, channel: Channel, is_disconnecting: bool = False):
         if not session.user: return
         
-        await self.sfu_server.leave_room(channel.id, session.user.id)
+        if self._sfu_server:
+            await self._sfu_server.leave_room(channel.id, session.user.id)
         session.current_voice_channel = None
         session.rtc_peer_connection = None
+        session.reset_webrtc_state()
         
         if not is_disconnecting:
             logging.info(f"用户 {session.user.display_name or session.user.username} 离开了语音频道 #{channel.name} (SFU)")
@@ -211,18 +515,98 @@ class Server:
                 await old_session.ws.close()
             logging.info(f"为用户 '{old_session.user.display_name or old_session.user.username}' 的会话顶替完成了清理")
 
-    async def broadcast_to_channel(self, channel_id: int, message: str, exclude_session: Optional[BaseSession] = None):
+    async def broadcast_to_channel(self, channel_id: int, message: str, exclude_session: Optional[BaseSession] = None, message_id: Optional[int] = None):
+        """
+        投递给本节点的频道成员，并通过背板发布一次给其它节点。
+        message_id 为已存入 messages 表的聊天/文件消息的 ID，带有它的广播计入未订阅频道的未读数。
+        """
+        await self._deliver_to_channel(channel_id, message, exclude_session, message_id)
+        if self.backplane.is_distributed:
+            await self.backplane.publish(bp.EVENT_CHANNEL_MESSAGE, {"channel_id": channel_id, "message": message, "message_id": message_id})
+
+    async def _deliver_to_channel(self, channel_id: int, message: str, exclude_session: Optional[BaseSession] = None, message_id: Optional[int] = None):
         if channel_id in self.channel_sessions:
+            start = time.perf_counter()
+            message = replay_log.append(channel_id, message, _excluded_username(exclude_session))
+            focused = self.channel_sessions[channel_id]
             tasks = [
                 s.send(message) 
-                for s in self.channel_sessions[channel_id] 
+                for s in focused 
                 if s != exclude_session and s.user and isinstance(s, WebSocketClientSession) and not s.ws.closed
             ]
+            if message_id is not None:
+                tasks.extend(self._unread_notifications(channel_id, message_id, focused))
             if tasks:
                 await asyncio.gather(*tasks, return_exceptions=True)
+            _channel_fanout.observe(len(tasks))
+            _channel_duration.observe(time.perf_counter() - start)
 
     
+    def _unread_notifications(self, channel_id: int, message_id: int, focused: Set[BaseSession]) -> list:
+        """
+        聚焦该频道的用户已读位置前移；其余订阅用户的未读数加一 (每个用户只加一次，与其会话数无关)，
+        同一用户未聚焦的会话收到相同的 unread_update，返回发送该通知的协程
+        """
+        tracker = self.unread_tracker
+        tracker.note_message(channel_id, message_id)
+        read_users: Set[int] = set()
+        for s in focused:
+            if s.user and s.subscriptions is not None:
+                tracker.mark_read(s.user.id, channel_id, message_id)
+                read_users.add(s.user.id)
+        # user_id -> 该用户未聚焦此频道的订阅会话
+        by_user: Dict[int, List[BaseSession]] = {}
+        for s in self.channel_subscribers.get(channel_id, ()):
+            if s not in focused and s.user:
+                by_user.setdefault(s.user.id, []).append(s)
+        notifications = []
+        for user_id, sessions in by_user.items():
+            if user_id in read_users:
+                # 用户已在另一个会话中读到这条消息，其它会话同步为已清零的计数
+                unread = tracker.counts(user_id, (channel_id,)).get(channel_id)
+            else:
+                unread = tracker.increment(user_id, channel_id)
+            if unread is None:
+                continue
+            message = proto.create_message(proto.MSG_TYPE_UNREAD_UPDATE, {
+                "channel_id": channel_id, "unread": unread, "message_id": message_id
+            })
+            notifications.extend(s.send(message) for s in sessions)
+        return notifications
+
+    async def broadcast_localized_to_channel(self, channel_id: int, key: str, level: str = "info", exclude_session: Optional[BaseSession] = None, **kwargs):
+        """按每个接收者的语言渲染系统消息后广播，同一语言只渲染和序列化一次"""
+        await self._deliver_localized_to_channel(channel_id, key, level, exclude_session, kwargs)
+        if self.backplane.is_distributed:
+            await self.backplane.publish(bp.EVENT_CHANNEL_LOCALIZED, {"channel_id": channel_id, "key": key, "level": level, "kwargs": kwargs})
+
+    async def _deliver_localized_to_channel(self, channel_id: int, key: str, level: str, exclude_session: Optional[BaseSession], kwargs: Dict[str, Any]):
+        if channel_id in self.channel_sessions:
+            start = time.perf_counter()
+            seq = replay_log.append_localized(channel_id, key, level, kwargs, _excluded_username(exclude_session))
+            rendered: Dict[str, str] = {}
+            tasks = []
+            for s in self.channel_sessions[channel_id]:
+                if s != exclude_session and s.user and isinstance(s, WebSocketClientSession) and not s.ws.closed:
+                    message = rendered.get(s.lang)
+                    if message is None:
+                        message = proto.create_system_message(s.t(key, **kwargs), level=level)
+                        if seq is not None:
+                            message = proto.with_sequence(message, seq)
+                        rendered[s.lang] = message
+                    tasks.append(s.send(message))
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            _channel_fanout.observe(len(tasks))
+            _channel_duration.observe(time.perf_counter() - start)
+
     async def broadcast_to_all(self, message: str, exclude_session: Optional[BaseSession] = None):
+        await self._deliver_to_all(message, exclude_session)
+        if self.backplane.is_distributed:
+            await self.backplane.publish(bp.EVENT_ALL_MESSAGE, {"message": message})
+
+    async def _deliver_to_all(self, message: str, exclude_session: Optional[BaseSession] = None):
+        start = time.perf_counter()
         tasks = [
             s.send(message) 
             for s in self.sessions 
@@ -230,12 +614,9 @@ class Server:
         ]
         if tasks:
             await asyncio.gather(*tasks, return_exceptions=True)
+        _all_fanout.observe(len(tasks))
+        _all_duration.observe(time.perf_counter() - start)
 
-    async def broadcast_all_registered_users_status(self, exclude_session: Optional[BaseSession] = None):
-        all_users_with_status = await self.user_manager.get_all_registered_users()
-        msg = proto.create_message(proto.MSG_TYPE_USER_LIST_UPDATE, {"users": all_users_with_status})
-        await self.broadcast_to_all(msg, exclude_session=exclude_session)
-        
     async def get_session_by_username(self, username: str) -> Optional[BaseSession]:
         for session in self.sessions:
             if session.user and session.user.username.lower() == username.lower():
@@ -246,4 +627,50 @@ class Server:
         for session in self.sessions:
             if session.user and session.user.id == user_id:
                 return session
-        return None
\ No newline at end of file
+        return None
+
+    async def announce_user_online(self, session: BaseSession):
+        """用户在本节点登录或恢复会话后通知其它节点: 更新在线状态并顶替该用户在其它节点上的旧会话"""
+        if session.user:
+            await self.backplane.publish(bp.EVENT_USER_ONLINE, {"username": session.user.username})
+
+    async def _handle_backplane_event(self, event: str, data: Dict[str, Any], node: str):
+        """处理其它节点发布的事件，只投递给本节点的会话，不再转发"""
+        if event == bp.EVENT_CHANNEL_MESSAGE:
+            await self._deliver_to_channel(data["channel_id"], data["message"], message_id=data.get("message_id"))
+        elif event == bp.EVENT_CHANNEL_LOCALIZED:
+            await self._deliver_localized_to_channel(data["channel_id"], data["key"], data.get("level", "info"), None, data.get("kwargs") or {})
+        elif event == bp.EVENT_ALL_MESSAGE:
+            await self._deliver_to_all(data["message"])
+        elif event == bp.EVENT_USER_ONLINE:
+            username = data["username"]
+            await self.user_manager.evict_remote_takeover(username)
+            self.user_manager.set_remote_presence(node, username, True)
+            await self.channel_members.note_changed(username)
+        elif event == bp.EVENT_USER_OFFLINE:
+            self.user_manager.set_remote_presence(node, data["username"], False)
+            await self.channel_members.note_changed(data["username"])
+        elif event == bp.EVENT_HELLO:
+            await self.backplane.publish(bp.EVENT_PRESENCE_SYNC, {"usernames": [s.user.username for s in self.user_manager.online_users.values() if s.user]})
+        elif event == bp.EVENT_PRESENCE_SYNC:
+            for username in self.user_manager.replace_remote_presence(node, data.get("usernames") or []):
+                await self.channel_members.note_changed(username)
+        elif event == bp.EVENT_NODE_DOWN:
+            if node in self.user_manager.remote_online_users:
+                logging.info(f"[背板] 节点 {node} 已下线")
+            for username in self.user_manager.drop_remote_node(node):
+                await self.channel_members.note_changed(username)
+        elif event == bp.EVENT_KICK:
+            target_session = await self.get_session_by_username(data["username"])
+            if target_session and target_session.user:
+                await self.action_handler.kick_local_session(target_session, data.get("admin", ""))
+        elif event == bp.EVENT_CHANNEL_CREATED:
+            channel = await self.channel_manager.load_channel(data["channel_id"])
+            if channel:
+                self.add_channel_to_session_manager(channel)
+        elif event == bp.EVENT_CHANNEL_MEMBER_JOINED:
+            await self.channel_members.note_changed(data["username"], data["channel_id"])
+        elif event == bp.EVENT_CHANNEL_DELETED:
+            channel = self.channel_manager.forget_channel(data["channel_id"])
+            if channel:
+                await self.remove_channel_from_session_manager(channel)
\ No newline at end of file
@@ -0,0 +1,87 @@
+# server/utils/admission.py
+"""
+连接准入控制
+
+新连接 (TCP 在 TLS 握手前，WebSocket 在协议升级前) 依次检查:
+  1. 接受速率: 全局令牌桶，每秒 accept_rate 个，最多积累 accept_burst 个；
+  2. server.max_connections: 总连接数上限；
+  3. max_per_ip: 单个来源 IP 的连接数上限 (exempt_ips 除外)；
+  4. max_unauthenticated: 尚未登录的连接数上限，应小于总上限，
+     保证认证洪泛不会挤掉已登录用户的名额。
+未登录的连接在 auth_timeout 秒后被断开。
+多进程模式下每个工作进程各自计数，上限按进程生效。
+"""
+import time
+from typing import Dict, Optional
+
+from .config import config
+from .ratelimit import TokenBucket
+from . import metrics
+
+REJECT_ACCEPT_RATE = 'accept_rate'
+REJECT_MAX_CONNECTIONS = 'max_connections'
+REJECT_PER_IP = 'per_ip'
+REJECT_UNAUTHENTICATED = 'unauthenticated'
+
+_rejected = metrics.registry.counter('connections_rejected_total', '被准入控制拒绝的连接数', ('reason',))
+_unauthenticated = metrics.registry.gauge('sessions_unauthenticated', '尚未登录的连接数')
+
+
+class AdmissionController:
+    def __init__(self):
+        self.max_connections = int(config.get('server.max_connections', 20))
+        self.max_per_ip = int(config.get('server.admission.max_per_ip', 10))
+        self.max_unauthenticated = int(config.get('server.admission.max_unauthenticated', 10))
+        self.auth_timeout = float(config.get('server.admission.auth_timeout', 20))
+        self.exempt_ips = frozenset(config.get('server.admission.exempt_ips', []) or [])
+        accept_rate = float(config.get('server.admission.accept_rate', 20))
+        accept_burst = float(config.get('server.admission.accept_burst', 40))
+        self._accept_bucket = TokenBucket(accept_rate, accept_burst, time.monotonic()) if accept_rate > 0 else None
+        self.total = 0
+        self.unauthenticated = 0
+        self._per_ip: Dict[str, int] = {}
+        _unauthenticated.set_function(lambda: self.unauthenticated)
+
+    def admit(self, ip: Optional[str]) -> Optional[str]:
+        """尝试为新连接占用名额，成功返回 None，否则返回拒绝原因"""
+        reason = self._check(ip)
+        if reason:
+            _rejected.labels(reason).inc()
+            return reason
+        self.total += 1
+        self.unauthenticated += 1
+        if ip:
+            self._per_ip[ip] = self._per_ip.get(ip, 0) + 1
+        return None
+
+    def _check(self, ip: Optional[str]) -> Optional[str]:
+        if self._accept_bucket is not None:
+            self._accept_bucket.refill(time.monotonic())
+            if self._accept_bucket.tokens < 1:
+                return REJECT_ACCEPT_RATE
+            self._accept_bucket.tokens -= 1
+        if self.max_connections > 0 and self.total >= self.max_connections:
+            return REJECT_MAX_CONNECTIONS
+        if self.max_unauthenticated > 0 and self.unauthenticated >= self.max_unauthenticated:
+            return REJECT_UNAUTHENTICATED
+        if ip and self.max_per_ip > 0 and ip not in self.exempt_ips and self._per_ip.get(ip, 0) >= self.max_per_ip:
+            return REJECT_PER_IP
+        return None
+
+    def authenticated(self):
+        """连接完成登录，释放未登录名额"""
+        self.unauthenticated -= 1
+
+    def release(self, ip: Optional[str], authenticated: bool):
+        self.total -= 1
+        if not authenticated:
+            self.unauthenticated -= 1
+        if ip:
+            count = self._per_ip.get(ip, 0) - 1
+            if count > 0:
+                self._per_ip[ip] = count
+            else:
+                self._per_ip.pop(ip, None)
+
+
+admission = AdmissionController()
@@ -0,0 +1,505 @@
+# server/utils/assets.py
+"""
+Web 客户端静态资源的构建与预压缩
+
+构建步骤 (启动时源文件有变化则自动执行，也可在部署时运行 python -m utils.assets):
+  - CSS: 以 css/ 下不以 "_" 开头的文件为入口，把 @import 的局部文件内联为一个文件并压缩；
+  - JS:  浏览器原生 ES 模块，每个模块单独压缩 (去掉注释和缩进)，模块间的相对导入改写为带哈希的文件名。
+         模块不合并为一个文件: 入口页面为整个依赖图输出 <link rel="modulepreload">，浏览器并行获取，
+         不再逐层发现依赖；
+  - 输出文件名带内容哈希 (JS 的哈希同时覆盖其依赖的模块)，写入 web/static/dist/，
+    并生成 .gz 和 .br (需安装 brotli) 副本。
+服务端在启动时把当前构建载入内存，按 Accept-Encoding 选择预压缩的版本，
+带哈希的文件以 Cache-Control: immutable 长期缓存。上一次构建的文件保留在磁盘上，
+供仍持有旧页面的客户端 (滚动重启期间) 使用。
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import sys
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from .config import config
+from . import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODING_BROTLI = 'br'
+ENCODING_GZIP = 'gzip'
+ENCODING_IDENTITY = 'identity'
+# 协商时的优先顺序
+_ENCODINGS = (ENCODING_BROTLI, ENCODING_GZIP)
+_SUFFIXES = {ENCODING_BROTLI: '.br', ENCODING_GZIP: '.gz'}
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+_HASH_LENGTH = 10
+
+_asset_responses = metrics.registry.counter('static_asset_responses_total', '预压缩静态资源的响应数', ('encoding',))
+
+
+# --- 压缩 ---
+
+_CSS_TOKEN = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?\*/)', re.DOTALL)
+_CSS_PLACEHOLDER = re.compile('\x00(\\d+)\x00')
+
+
+def minify_css(source: str) -> str:
+    """去掉注释和多余空白，字符串原样保留"""
+    strings: List[str] = []
+
+    def protect(match: re.Match) -> str:
+        token = match.group(0)
+        if token.startswith('/*'):
+            return ' '
+        strings.append(token)
+        return f'\x00{len(strings) - 1}\x00'
+
+    code = _CSS_TOKEN.sub(protect, source)
+    code = re.sub(r'\s+', ' ', code)
+    # 括号两侧的空白不能去掉 (例如 "@media screen and (...)")
+    code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+    code = re.sub(r':\s+', ':', code)
+    code = code.replace(';}', '}').strip()
+    return _CSS_PLACEHOLDER.sub(lambda m: strings[int(m.group(1))], code)
+
+
+# 这些字符或关键字之后的 "/" 是正则字面量而不是除号
+_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'void', 'yield', 'await', 'instanceof', 'new', 'delete', 'throw'}
+_TRAILING_WORD = re.compile(r'([A-Za-z_$][\w$]*)\s*$')
+
+
+def _skip_string(source: str, i: int) -> int:
+    quote, i = source[i], i + 1
+    while i < len(source):
+        if source[i] == '\\':
+            i += 2
+            continue
+        if source[i] == quote or source[i] == '\n':
+            return i + 1
+        i += 1
+    return i
+
+
+def _skip_template(source: str, i: int) -> Tuple[int, bool]:
+    """从模板字面量的文本部分开始扫描，返回 (结束位置, 是否停在 "${" 之后)"""
+    while i < len(source):
+        if source[i] == '\\':
+            i += 2
+        elif source[i] == '`':
+            return i + 1, False
+        elif source.startswith('${', i):
+            return i + 2, True
+        else:
+            i += 1
+    return i, False
+
+
+def _skip_regex(source: str, i: int) -> int:
+    in_class = False
+    i += 1
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '\n':
+            break
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            return i + 1
+        i += 1
+    return i
+
+
+def minify_js(source: str) -> str:
+    """
+    保守的 JS 压缩: 去掉注释、缩进、行尾空白和空行，连续空白合并为一个空格。
+    换行保留 (不依赖自动分号插入的规则)，字符串、模板字面量和正则字面量原样保留。
+    """
+    out: List[str] = []
+    # 每个未闭合的模板插值 "${" 内的花括号深度
+    templates: List[int] = []
+
+    def previous_significant() -> Optional[str]:
+        for chunk in reversed(out):
+            stripped = chunk.rstrip()
+            if stripped:
+                return stripped[-1]
+        return None
+
+    def newline():
+        if out and out[-1] == ' ':
+            out.pop()
+        if out and out[-1] != '\n':
+            out.append('\n')
+
+    i, length = 0, len(source)
+    while i < length:
+        char = source[i]
+        if char in ' \t\r':
+            while i < length and source[i] in ' \t\r':
+                i += 1
+            if out and out[-1] not in (' ', '\n') and i < length and source[i] != '\n':
+                out.append(' ')
+            continue
+        if char == '\n':
+            newline()
+            i += 1
+            continue
+        if char in '\'"':
+            end = _skip_string(source, i)
+            out.append(source[i:end])
+            i = end
+            continue
+        if char == '`':
+            end, in_expression = _skip_template(source, i + 1)
+            out.append(source[i:end])
+            if in_expression:
+                templates.append(0)
+            i = end
+            continue
+        if char == '{' and templates:
+            templates[-1] += 1
+        elif char == '}' and templates:
+            if templates[-1] == 0:
+                # 插值结束，回到模板文本
+                templates.pop()
+                end, in_expression = _skip_template(source, i + 1)
+                out.append(source[i:end])
+                if in_expression:
+                    templates.append(0)
+                i = end
+                continue
+            templates[-1] -= 1
+        elif char == '/':
+            following = source[i + 1:i + 2]
+            if following == '/':
+                while i < length and source[i] != '\n':
+                    i += 1
+                continue
+            if following == '*':
+                end = source.find('*/', i + 2)
+                end = length if end < 0 else end + 2
+                if '\n' in source[i:end]:
+                    newline()
+                elif out and out[-1] not in (' ', '\n'):
+                    out.append(' ')
+                i = end
+                continue
+            previous = previous_significant()
+            word = _TRAILING_WORD.search(''.join(out[-16:]))
+            if previous is None or previous in _REGEX_PRECEDERS or (word and word.group(1) in _REGEX_KEYWORDS):
+                end = _skip_regex(source, i)
+                out.append(source[i:end])
+                i = end
+                continue
+        out.append(char)
+        i += 1
+    return ''.join(out).strip() + '\n'
+
+
+# --- 构建 ---
+
+_CSS_IMPORT = re.compile(r'@import\s+(?:url\(\s*)?([\'"])([^\'"]+)\1\s*\)?\s*([^;]*);')
+_CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+# 静态导入 (import ... from '...' / import '...' / export ... from '...') 和动态导入 import('...')
+_JS_IMPORT = re.compile(r'(\bfrom\s*|\bimport\s*\(?\s*)([\'"])(\.{1,2}/[^\'"]+\.js)\2')
+
+
+def _is_local(url: str) -> bool:
+    return not re.match(r'^([a-z][a-z0-9+.-]*:|/|#)', url, re.IGNORECASE)
+
+
+def _content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:_HASH_LENGTH]
+
+
+def _hashed_name(name: str, digest: str) -> str:
+    base, ext = posixpath.splitext(name)
+    return f'{base}.{digest}{ext}'
+
+
+def _read(static_dir: str, name: str) -> str:
+    with open(os.path.join(static_dir, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def _bundle_css(static_dir: str, name: str, seen: Set[str]) -> str:
+    """内联本地 @import，并把相对 url() 改写为绝对路径 (输出文件位于 dist/ 下)"""
+    seen.add(name)
+    directory = posixpath.dirname(name)
+
+    def rewrite_url(match: re.Match) -> str:
+        quote, url = match.group(1), match.group(2)
+        if not _is_local(url):
+            return match.group(0)
+        return f'url({quote}/static/{posixpath.normpath(posixpath.join(directory, url))}{quote})'
+
+    def inline(match: re.Match) -> str:
+        url, media = match.group(2), match.group(3).strip()
+        if not _is_local(url):
+            return match.group(0)
+        target = posixpath.normpath(posixpath.join(directory, url))
+        if target in seen:
+            return ''
+        body = _bundle_css(static_dir, target, seen)
+        return f'@media {media}{{{body}}}' if media else body
+
+    source = _CSS_URL.sub(rewrite_url, _read(static_dir, name))
+    return _CSS_IMPORT.sub(inline, source)
+
+
+def _source_files(static_dir: str) -> List[str]:
+    names = []
+    for folder, ext in (('css', '.css'), ('js', '.js')):
+        path = os.path.join(static_dir, folder)
+        if os.path.isdir(path):
+            names.extend(f'{folder}/{entry}' for entry in sorted(os.listdir(path)) if entry.endswith(ext))
+    return names
+
+
+def source_hash(static_dir: str) -> str:
+    """所有源文件的整体哈希，用于判断构建是否过期"""
+    digest = hashlib.sha256()
+    for name in _source_files(static_dir):
+        digest.update(name.encode())
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def _compress(data: bytes) -> Dict[str, bytes]:
+    """返回比原文件小的预压缩版本 (gzip 固定 mtime，保证同样的输入得到同样的输出)"""
+    variants = {}
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(compressed) < len(data):
+        variants[ENCODING_GZIP] = compressed
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        if len(compressed) < len(data):
+            variants[ENCODING_BROTLI] = compressed
+    return variants
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f'{path}.{os.getpid()}.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+
+def build(static_dir: str) -> dict:
+    """构建 static_dir 下的 CSS/JS 到 static_dir/dist，返回新的清单"""
+    started = time.perf_counter()
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    outputs: Dict[str, bytes] = {}
+    assets: Dict[str, str] = {}
+    names = _source_files(static_dir)
+
+    for name in names:
+        if name.startswith('css/') and not posixpath.basename(name).startswith('_'):
+            data = minify_css(_bundle_css(static_dir, name, set())).encode('utf-8')
+            assets[name] = _hashed_name(name, _content_hash(data))
+            outputs[assets[name]] = data
+
+    modules = {name: minify_js(_read(static_dir, name)) for name in names if name.startswith('js/')}
+    imports: Dict[str, List[str]] = {}
+    for name, code in modules.items():
+        targets = (posixpath.normpath(posixpath.join(posixpath.dirname(name), m.group(3))) for m in _JS_IMPORT.finditer(code))
+        imports[name] = sorted({target for target in targets if target in modules and target != name})
+    # 模块的哈希覆盖它可达的所有模块 (允许循环依赖)，任一依赖变化都会得到新的文件名
+    own = {name: _content_hash(code.encode('utf-8')) for name, code in modules.items()}
+    for name in modules:
+        reachable = sorted(_reachable(imports, name) | {name})
+        assets[name] = _hashed_name(name, _content_hash(''.join(f'{m}:{own[m]};' for m in reachable).encode()))
+    for name, code in modules.items():
+        directory = posixpath.dirname(name)
+
+        def rewrite(match: re.Match) -> str:
+            target = posixpath.normpath(posixpath.join(directory, match.group(3)))
+            if target not in assets:
+                return match.group(0)
+            relative = posixpath.relpath(assets[target], directory)
+            if not relative.startswith('.'):
+                relative = './' + relative
+            return f'{match.group(1)}{match.group(2)}{relative}{match.group(2)}'
+
+        outputs[assets[name]] = _JS_IMPORT.sub(rewrite, code).encode('utf-8')
+
+    for name, data in outputs.items():
+        path = os.path.join(dist_dir, *name.split('/'))
+        if not os.path.exists(path):
+            _write_atomic(path, data)
+            for encoding, compressed in _compress(data).items():
+                _write_atomic(path + _SUFFIXES[encoding], compressed)
+
+    manifest = {"version": MANIFEST_VERSION, "source_hash": source_hash(static_dir), "assets": assets, "imports": imports}
+    manifest_path = os.path.join(dist_dir, MANIFEST_NAME)
+    previous = _read_manifest(manifest_path)
+    _write_atomic(manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    _prune(dist_dir, set(assets.values()) | set(previous.get('assets', {}).values() if previous else ()))
+
+    source_size = sum(os.path.getsize(os.path.join(static_dir, name)) for name in names)
+    logging.info(f"静态资源构建完成: {len(names)} 个源文件 ({source_size} 字节) -> {len(outputs)} 个文件 "
+                 f"({sum(len(data) for data in outputs.values())} 字节)，耗时 {(time.perf_counter() - started) * 1000:.0f} ms")
+    return manifest
+
+
+def _reachable(imports: Dict[str, List[str]], name: str) -> Set[str]:
+    seen: Set[str] = set()
+    pending = list(imports.get(name, ()))
+    while pending:
+        module = pending.pop()
+        if module not in seen:
+            seen.add(module)
+            pending.extend(imports.get(module, ()))
+    return seen
+
+
+def _read_manifest(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+
+def _prune(dist_dir: str, keep: Set[str]):
+    """删除既不属于本次也不属于上一次构建的输出文件"""
+    for folder, _, files in os.walk(dist_dir):
+        for file_name in files:
+            path = os.path.join(folder, file_name)
+            name = os.path.relpath(path, dist_dir).replace(os.sep, '/')
+            if name == MANIFEST_NAME:
+                continue
+            for suffix in _SUFFIXES.values():
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+            if name not in keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+# --- 运行时 ---
+
+class Asset:
+    """内存中的一个资源及其预压缩版本"""
+    __slots__ = ('content_type', 'variants', 'etag')
+
+    def __init__(self, content_type: str, data: bytes, variants: Optional[Dict[str, bytes]] = None):
+        self.content_type = content_type
+        self.variants = {ENCODING_IDENTITY: data}
+        self.variants.update(_compress(data) if variants is None else variants)
+        # 弱 ETag 只取决于原始内容，各压缩版本共用
+        self.etag = 'W/"%s"' % hashlib.sha256(data).hexdigest()[:20]
+
+    def matches(self, if_none_match: str) -> bool:
+        """If-None-Match 中是否包含本资源的 ETag (弱比较)"""
+        if not if_none_match:
+            return False
+        tags = {tag.strip() for tag in if_none_match.split(',')}
+        return '*' in tags or self.etag in tags or self.etag[2:] in tags
+
+    def select(self, accept_encoding: str) -> Tuple[str, bytes]:
+        """按 Accept-Encoding 选择编码，返回 (编码, 内容)"""
+        accepted = set()
+        for item in accept_encoding.lower().split(','):
+            coding, _, params = item.strip().partition(';')
+            if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                continue
+            accepted.add(coding.strip())
+        for encoding in _ENCODINGS:
+            if encoding in self.variants and (encoding in accepted or '*' in accepted):
+                _asset_responses.labels(encoding).inc()
+                return encoding, self.variants[encoding]
+        _asset_responses.labels(ENCODING_IDENTITY).inc()
+        return ENCODING_IDENTITY, self.variants[ENCODING_IDENTITY]
+
+
+def content_type_for(name: str) -> str:
+    if name.endswith('.js'):
+        return 'text/javascript; charset=utf-8'
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    return f'{content_type}; charset=utf-8' if content_type.startswith('text/') else content_type
+
+
+class StaticAssets:
+    def __init__(self, static_dir: str = os.path.join('web', 'static')):
+        self.static_dir = static_dir
+        self.dist_dir = os.path.join(static_dir, DIST_DIR)
+        self.enabled = config.get('server.web_server.assets.bundle', True)
+        self._urls: Dict[str, str] = {}
+        self._imports: Dict[str, List[str]] = {}
+        self._files: Dict[str, Asset] = {}
+
+    def load(self):
+        """源文件有变化 (或还没有构建) 时重新构建，然后把当前构建载入内存"""
+        if not self.enabled:
+            return
+        manifest = _read_manifest(os.path.join(self.dist_dir, MANIFEST_NAME))
+        if manifest is None or manifest.get('source_hash') != source_hash(self.static_dir) or \
+                not all(os.path.exists(os.path.join(self.dist_dir, *name.split('/'))) for name in manifest['assets'].values()):
+            manifest = build(self.static_dir)
+        self._urls = {name: f'/static/{DIST_DIR}/{hashed}' for name, hashed in manifest['assets'].items()}
+        self._imports = manifest.get('imports', {})
+        self._files = {}
+        for hashed in manifest['assets'].values():
+            self._load_file(hashed)
+
+    def _load_file(self, name: str) -> Optional[Asset]:
+        path = os.path.join(self.dist_dir, *name.split('/'))
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+        variants = {}
+        for encoding, suffix in _SUFFIXES.items():
+            if os.path.isfile(path + suffix):
+                with open(path + suffix, 'rb') as f:
+                    variants[encoding] = f.read()
+        asset = self._files[name] = Asset(content_type_for(name), data, variants)
+        return asset
+
+    def get(self, name: str) -> Optional[Asset]:
+        """按 dist/ 下的相对路径取资源；不在内存中的 (例如上一次构建的) 从磁盘加载"""
+        asset = self._files.get(name)
+        if asset is None and self.enabled and '..' not in name.split('/') and '\\' not in name:
+            asset = self._load_file(name)
+        return asset
+
+    def url(self, name: str) -> str:
+        """模板中使用: 源文件路径 (相对 static/) -> 实际提供的 URL"""
+        return self._urls.get(name, f'/static/{name}')
+
+    def module_preloads(self, entry: str) -> List[str]:
+        """入口模块依赖的所有模块的 URL，用于 <link rel="modulepreload">"""
+        return [self._urls[name] for name in sorted(_reachable(self._imports, entry)) if name in self._urls]
+
+
+static_assets = StaticAssets()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    result = build(sys.argv[1] if len(sys.argv) > 1 else static_assets.static_dir)
+    for source, output in sorted(result['assets'].items()):
+        print(f'{source} -> {DIST_DIR}/{output}')
@@ -0,0 +1,423 @@
+# server/utils/backplane.py
+"""
+多节点之间的发布/订阅背板 (backplane)
+
+每个 Server 进程是一个节点，本地会话仍由本节点直接投递；需要让其它节点
+知道的事件 (频道广播、在线状态变化、踢人、会话顶替等) 通过 publish() 发布一次，
+由背板送达所有其它节点的 handler(event, data, node_id)。
+
+实现:
+  - local: 单节点，publish 为空操作 (默认)
+  - unix:  同一台机器上的多个进程，每个节点在 socket_dir 下监听 <node_id>.sock，
+           发布时向目录中的其它 socket 各写一帧 (4 字节大端长度 + JSON)
+  - redis: 可选扩展，使用 Redis PUBLISH/SUBSCRIBE (需要安装 redis 包)
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .config import config
+from . import metrics
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+BackplaneHandler = Callable[[str, Dict[str, Any], str], Awaitable[None]]
+
+_FRAME_HEADER = struct.Struct('!I')
+_DISCARD_CHUNK = 65536
+
+_peer_overflows = metrics.registry.counter('backplane_peer_overflow_total', '发送队列溢出而断开的背板对端连接数')
+_oversized = metrics.registry.counter('backplane_oversized_messages_total', '超过大小上限而丢弃的背板消息数')
+
+# 事件类型
+EVENT_HELLO = "hello"                      # 节点启动，请求其它节点同步在线用户
+EVENT_PRESENCE_SYNC = "presence_sync"      # {"usernames": [...]} 发送方节点的全部在线用户
+EVENT_USER_ONLINE = "user_online"          # {"username"} 用户在发送方节点上线，其它节点需顶替旧会话
+EVENT_USER_OFFLINE = "user_offline"        # {"username"}
+EVENT_CHANNEL_MESSAGE = "channel_message"  # {"channel_id", "message"} 已序列化的消息
+EVENT_CHANNEL_LOCALIZED = "channel_localized"  # {"channel_id", "key", "level", "kwargs"}
+EVENT_ALL_MESSAGE = "all_message"          # {"message"}
+EVENT_KICK = "kick"                        # {"username", "admin"}
+EVENT_CHANNEL_CREATED = "channel_created"  # {"channel_id"}
+EVENT_CHANNEL_DELETED = "channel_deleted"  # {"channel_id"}
+EVENT_CHANNEL_MEMBER_JOINED = "channel_member_joined"  # {"channel_id", "username"} 用户成为频道的新成员
+# 节点下线: 节点关闭时主动发布，unix 背板在对端连接断开时也会自行产生，data 为空
+EVENT_NODE_DOWN = "node_down"
+
+
+def generate_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class Backplane(ABC):
+    def __init__(self, node_id: Optional[str] = None):
+        self.node_id = node_id or generate_node_id()
+        self._handler: Optional[BackplaneHandler] = None
+
+    def set_handler(self, handler: BackplaneHandler):
+        self._handler = handler
+
+    @abstractmethod
+    async def start(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, event: str, data: Dict[str, Any]):
+        """把事件发送给所有其它节点 (不会回送给自己)"""
+        pass
+
+    @abstractmethod
+    async def close(self):
+        pass
+
+    @property
+    def is_distributed(self) -> bool:
+        return True
+
+    def _encode(self, event: str, data: Dict[str, Any]) -> bytes:
+        return json.dumps({"node": self.node_id, "event": event, "data": data}, ensure_ascii=False).encode('utf-8')
+
+    async def _dispatch(self, raw: bytes) -> Optional[str]:
+        """解析并分发一条背板消息，返回发送方节点 ID"""
+        try:
+            envelope = json.loads(raw)
+            node, event, data = envelope["node"], envelope["event"], envelope.get("data") or {}
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"[背板] 丢弃无法解析的消息: {e}")
+            return None
+        if node == self.node_id:
+            return node
+        await self._deliver(event, data, node)
+        return node
+
+    async def _deliver(self, event: str, data: Dict[str, Any], node: str):
+        if not self._handler:
+            return
+        try:
+            await self._handler(event, data, node)
+        except Exception as e:
+            logging.error(f"[背板] 处理来自 {node} 的事件 '{event}' 时出错: {e}", exc_info=True)
+
+
+class LocalBackplane(Backplane):
+    """单节点部署: 没有其它节点，发布为空操作"""
+    async def start(self):
+        pass
+
+    async def publish(self, event: str, data: Dict[str, Any]):
+        pass
+
+    async def close(self):
+        pass
+
+    @property
+    def is_distributed(self) -> bool:
+        return False
+
+
+class _PeerLink:
+    """到一个对端节点的出站连接: 发布只把帧放进有界队列，由独立的写任务连接并发送"""
+    def __init__(self, backplane: 'UnixSocketBackplane', path: str, max_queue: int, resync: bool = False):
+        self.backplane = backplane
+        self.path = path
+        self.resync = resync
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            self.writer = await self.backplane._connect(self.path)
+            if self.writer is None:
+                return
+            if self.resync:
+                # 对端在断开时已把本节点标记为下线，借用 hello 事件让本节点重新发布在线用户
+                await self.backplane._deliver(EVENT_HELLO, {}, os.path.basename(self.path)[:-len('.sock')])
+            while True:
+                frame = await self.queue.get()
+                self.writer.write(frame)
+                await self.writer.drain()
+                self.queue.task_done()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if self.writer:
+                self.writer.close()
+            self.backplane._forget_link(self)
+
+    async def flush(self, timeout: float):
+        """等待队列中的帧全部写出 (或连接已结束)，最多 timeout 秒"""
+        joined = asyncio.create_task(self.queue.join())
+        await asyncio.wait([joined, self.task], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        joined.cancel()
+
+    def close(self):
+        self.task.cancel()
+
+    def abort(self):
+        """丢弃队列并立即断开，不等待对端读完"""
+        if self.writer and self.writer.transport:
+            self.writer.transport.abort()
+        self.task.cancel()
+
+
+class UnixSocketBackplane(Backplane):
+    """
+    基于 Unix 域套接字的背板，适用于同一台机器上的多个进程。
+    节点通过扫描 socket_dir 发现彼此 (结果缓存 rescan_interval 秒)，
+    到每个对端保持一条长连接，每条消息一个长度前缀帧。
+    每个对端有自己的发送队列 (最多 peer_queue_size 帧) 和写任务，慢的对端不会拖住本节点的广播；
+    队列溢出时断开该对端，reconnect_delay 秒后再重连，重连后重新同步本节点的在线用户。
+    """
+    def __init__(self, socket_dir: str, node_id: Optional[str] = None, rescan_interval: float = 1.0,
+                 max_message_size: int = 16 * 1024 * 1024, peer_queue_size: int = 10000, reconnect_delay: float = 5.0):
+        super().__init__(node_id)
+        self.socket_dir = socket_dir
+        self.rescan_interval = rescan_interval
+        self.max_message_size = max_message_size
+        self.peer_queue_size = peer_queue_size
+        self.reconnect_delay = reconnect_delay
+        self.path = os.path.join(socket_dir, f"{self.node_id}.sock")
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._links: Dict[str, _PeerLink] = {}
+        # 因队列溢出被断开的对端: path -> 允许重连的时间
+        self._dropped: Dict[str, float] = {}
+        self._peer_paths: list = []
+        self._last_scan = 0.0
+        self._incoming: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self._closing = False
+
+    async def start(self):
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self._server = await asyncio.start_unix_server(self._handle_peer, path=self.path)
+        logging.info(f"[背板] 节点 {self.node_id} 已在 {self.path} 上监听")
+
+    async def _read_frame(self, reader: asyncio.StreamReader) -> Optional[bytes]:
+        """读取一帧，超过 max_message_size 的帧被跳过并返回 None，连接保持可用"""
+        (length,) = _FRAME_HEADER.unpack(await reader.readexactly(_FRAME_HEADER.size))
+        if length <= self.max_message_size:
+            return await reader.readexactly(length)
+        logging.warning(f"[背板] 丢弃超过上限 ({self.max_message_size} 字节) 的消息: {length} 字节")
+        _oversized.inc()
+        while length > 0:
+            length -= len(await reader.readexactly(min(length, _DISCARD_CHUNK)))
+        return None
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._incoming[writer] = asyncio.current_task()
+        peer_node = None
+        try:
+            while True:
+                payload = await self._read_frame(reader)
+                if payload is None:
+                    continue
+                node = await self._dispatch(payload)
+                if node and peer_node is None:
+                    # 新节点第一次连入，下次发布前重新扫描目录以便回复它
+                    peer_node = node
+                    self._last_scan = 0.0
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._incoming.pop(writer, None)
+            writer.close()
+            if peer_node and not self._closing:
+                await self._deliver(EVENT_NODE_DOWN, {}, peer_node)
+
+    def _scan_peers(self) -> list:
+        now = time.monotonic()
+        if now - self._last_scan >= self.rescan_interval:
+            self._last_scan = now
+            try:
+                self._peer_paths = [
+                    os.path.join(self.socket_dir, name) for name in os.listdir(self.socket_dir)
+                    if name.endswith('.sock') and os.path.join(self.socket_dir, name) != self.path
+                ]
+            except OSError:
+                self._peer_paths = []
+        return self._peer_paths
+
+    async def _connect(self, path: str) -> Optional[asyncio.StreamWriter]:
+        try:
+            _, writer = await asyncio.open_unix_connection(path)
+        except ConnectionRefusedError:
+            # 节点异常退出后留下的 socket 文件
+            logging.info(f"[背板] 清理失效的节点 socket: {path}")
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+        except OSError:
+            return None
+        return writer
+
+    def _forget_link(self, link: _PeerLink):
+        if self._links.get(link.path) is link:
+            del self._links[link.path]
+
+    def _enqueue(self, path: str, frame: bytes):
+        link = self._links.get(path)
+        if link is None:
+            retry_at = self._dropped.get(path)
+            if retry_at is not None and time.monotonic() < retry_at:
+                return
+            resync = self._dropped.pop(path, None) is not None
+            link = self._links[path] = _PeerLink(self, path, self.peer_queue_size, resync)
+        try:
+            link.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            logging.warning(f"[背板] 对端 {path} 的发送队列已满 ({self.peer_queue_size} 帧)，断开连接，{self.reconnect_delay:g} 秒后重连")
+            _peer_overflows.inc()
+            self._forget_link(link)
+            self._dropped[path] = time.monotonic() + self.reconnect_delay
+            link.abort()
+
+    async def publish(self, event: str, data: Dict[str, Any]):
+        peers = self._scan_peers()
+        if not peers:
+            return
+        payload = self._encode(event, data)
+        if len(payload) > self.max_message_size:
+            logging.warning(f"[背板] 事件 '{event}' 大小 {len(payload)} 字节超过上限 {self.max_message_size}，未发布")
+            _oversized.inc()
+            return
+        frame = _FRAME_HEADER.pack(len(payload)) + payload
+        for path in peers:
+            self._enqueue(path, frame)
+
+    async def close(self):
+        self._closing = True
+        links = list(self._links.values())
+        # 先尽量送出已排队的消息 (包括 node_down)，再断开
+        if links:
+            await asyncio.gather(*(link.flush(1.0) for link in links))
+        for link in links:
+            link.close()
+        if links:
+            await asyncio.gather(*(link.task for link in links), return_exceptions=True)
+        for writer in list(self._incoming):
+            writer.close()
+        self._links.clear()
+        # 等待对端连接的读取任务看到 EOF 后自行结束
+        if self._incoming:
+            await asyncio.wait(list(self._incoming.values()), timeout=1.0)
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class RedisBackplane(Backplane):
+    """基于 Redis PUBLISH/SUBSCRIBE 的背板，适用于多台主机 (可选依赖 redis)"""
+    RETRY_MIN_DELAY = 1.0
+    RETRY_MAX_DELAY = 30.0
+
+    def __init__(self, url: str, channel: str, node_id: Optional[str] = None):
+        super().__init__(node_id)
+        if aioredis is None:
+            raise RuntimeError("Redis 背板不可用: 未安装 redis 包")
+        self.url = url
+        self.channel = channel
+        self._redis = None
+        self._pubsub = None
+        self._listen_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._redis = aioredis.from_url(self.url)
+        await self._subscribe()
+        self._listen_task = asyncio.create_task(self._listen())
+        logging.info(f"[背板] 节点 {self.node_id} 已订阅 Redis 频道 '{self.channel}'")
+
+    async def _subscribe(self):
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel)
+
+    async def _resubscribe(self):
+        old, self._pubsub = self._pubsub, None
+        if old is not None:
+            try:
+                await old.close()
+            except Exception:
+                pass
+        await self._subscribe()
+
+    async def _listen(self):
+        """接收其它节点的事件；订阅连接出错时记录日志、退避后重新订阅，断开期间的事件会丢失"""
+        delay = self.RETRY_MIN_DELAY
+        while True:
+            try:
+                if self._pubsub is None:
+                    await self._resubscribe()
+                    logging.info(f"[背板] 已重新订阅 Redis 频道 '{self.channel}'")
+                async for message in self._pubsub.listen():
+                    delay = self.RETRY_MIN_DELAY
+                    if message.get("type") == "message":
+                        await self._dispatch(message["data"])
+                logging.warning("[背板] Redis 订阅意外结束")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"[背板] Redis 订阅连接出错: {e}，{delay:.0f} 秒后重新订阅")
+            self._pubsub = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.RETRY_MAX_DELAY)
+
+    async def publish(self, event: str, data: Dict[str, Any]):
+        try:
+            await self._redis.publish(self.channel, self._encode(event, data))
+        except Exception as e:
+            logging.error(f"[背板] 发布事件 '{event}' 到 Redis 失败: {e}")
+
+    async def close(self):
+        if self._listen_task:
+            self._listen_task.cancel()
+        if self._pubsub:
+            try:
+                await self._pubsub.unsubscribe(self.channel)
+                await self._pubsub.close()
+            except Exception as e:
+                logging.warning(f"[背板] 关闭 Redis 订阅时出错: {e}")
+        if self._redis:
+            await self._redis.close()
+
+
+def create_backplane(node_id: Optional[str] = None, multi_worker: bool = False) -> Backplane:
+    """
+    根据 server.backplane 配置创建背板。
+    多进程 (SO_REUSEPORT) 模式下的工作进程至少需要 unix 背板来共享在线状态和广播。
+    """
+    backplane_type = config.get('server.backplane.type', 'local')
+    if multi_worker and backplane_type == 'local':
+        backplane_type = 'unix'
+    if backplane_type == 'unix':
+        return UnixSocketBackplane(
+            config.get('server.backplane.socket_dir', 'data/backplane'),
+            node_id,
+            max_message_size=int(config.get('server.backplane.max_message_size', 16777216)),
+            peer_queue_size=int(config.get('server.backplane.peer_queue_size', 10000)),
+            reconnect_delay=float(config.get('server.backplane.reconnect_delay', 5.0))
+        )
+    if backplane_type == 'redis':
+        return RedisBackplane(
+            config.get('server.backplane.redis_url', 'redis://localhost:6379/0'),
+            config.get('server.backplane.channel', 'chatroom'),
+            node_id
+        )
+    if backplane_type != 'local':
+        logging.warning(f"未知的背板类型 '{backplane_type}'，使用单节点模式")
+    return LocalBackplane(node_id)
@@ -0,0 +1,80 @@
+# server/utils/compression.py
+import time
+import zlib
+import logging
+from typing import Dict, Any
+
+from .config import config
+
+
+class _FrameTypeStats:
+    __slots__ = ('frames', 'compressed_frames', 'raw_bytes', 'sampled_raw_bytes', 'sampled_compressed_bytes', 'sampled_seconds')
+
+    def __init__(self):
+        self.frames = 0
+        self.compressed_frames = 0
+        self.raw_bytes = 0
+        self.sampled_raw_bytes = 0
+        self.sampled_compressed_bytes = 0
+        self.sampled_seconds = 0.0
+
+
+class CompressionStats:
+    """
+    按帧类型统计 WebSocket 出站帧的压缩情况。
+    实际压缩由 aiohttp 完成，拿不到压缩后的大小，因此每 sample_rate 个压缩帧
+    用相同参数 (Z_BEST_SPEED, raw deflate) 重新压缩一次，估算压缩率和 CPU 开销。
+    """
+    def __init__(self, sample_rate: int = 16):
+        self.sample_rate = max(1, sample_rate)
+        self._stats: Dict[str, _FrameTypeStats] = {}
+        self._counter = 0
+
+    def _get(self, frame_type: str) -> _FrameTypeStats:
+        stats = self._stats.get(frame_type)
+        if stats is None:
+            stats = self._stats[frame_type] = _FrameTypeStats()
+        return stats
+
+    def record(self, frame_type: str, message: str, compressed: bool, wbits: int = 15):
+        stats = self._get(frame_type)
+        stats.frames += 1
+        stats.raw_bytes += len(message)
+        if not compressed:
+            return
+        stats.compressed_frames += 1
+        self._counter += 1
+        if self._counter % self.sample_rate:
+            return
+        data = message.encode('utf-8')
+        start = time.perf_counter()
+        compressor = zlib.compressobj(zlib.Z_BEST_SPEED, zlib.DEFLATED, -wbits)
+        size = len(compressor.compress(data)) + len(compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+        stats.sampled_seconds += time.perf_counter() - start
+        stats.sampled_raw_bytes += len(data)
+        stats.sampled_compressed_bytes += size
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for frame_type, stats in self._stats.items():
+            ratio = stats.sampled_compressed_bytes / stats.sampled_raw_bytes if stats.sampled_raw_bytes else None
+            cpu_us_per_kb = (stats.sampled_seconds * 1e6) / (stats.sampled_raw_bytes / 1024) if stats.sampled_raw_bytes else None
+            result[frame_type] = {
+                "frames": stats.frames,
+                "compressed_frames": stats.compressed_frames,
+                "raw_bytes": stats.raw_bytes,
+                "compression_ratio": ratio,
+                "cpu_us_per_kb": cpu_us_per_kb,
+            }
+        return result
+
+    def log_summary(self):
+        for frame_type, s in sorted(self.snapshot().items()):
+            if not s["compressed_frames"]:
+                continue
+            ratio = f"{s['compression_ratio']:.2f}" if s['compression_ratio'] is not None else "N/A"
+            cpu = f"{s['cpu_us_per_kb']:.1f}us/KB" if s['cpu_us_per_kb'] is not None else "N/A"
+            logging.info(f"[WS 压缩] {frame_type}: 帧数 {s['frames']} (压缩 {s['compressed_frames']}), 原始 {s['raw_bytes']} 字节, 压缩率 {ratio}, CPU {cpu}")
+
+
+ws_compression_stats = CompressionStats(config.get('server.web_server.ws_compression_sample_rate', 16))
@@ -14,7 +14,15 @@ DEFAULT_CONFIG = {
                 'enabled': True,
                 'cert_path': 'cert.pem',
                 'key_path': 'key.pem',
-            }
+            },
+            # 单条消息 (line 模式下为一行) 的最大字节数
+            'max_frame_size': 1048576,
+            # 长度前缀模式下，小于该字节数的帧不压缩
+            'compression_min_size': 512,
+            # 已登录的 TCP 连接多久没有收到任何消息后断开 (秒)，0 为不限
+            'idle_timeout': 305,
+            # 单个连接待发送的字节数 (出站缓冲区 + transport 写缓冲区) 超过此值时断开，防止读得慢的客户端占满内存
+            'max_outbox_bytes': 4194304
         },
         'web_server': {
             'enabled': True,
@@ -24,6 +32,22 @@ DEFAULT_CONFIG = {
                 'enabled': True,
                 'cert_path': 'cert.pem',
                 'key_path': 'key.pem',
+            },
+            # WebSocket permessage-deflate，仅压缩不小于 min_size 字节的帧
+            'ws_compression': True,
+            'ws_compression_min_size': 1024,
+            # 每 N 个压缩帧采样一次压缩率与 CPU 开销
+            'ws_compression_sample_rate': 16,
+            # 在 /metrics 导出 Prometheus 格式指标 (含 SQL 语句文本等内部信息，默认关闭)；
+            # 设置了 metrics_token 时需带 Authorization: Bearer <token>，否则只允许本机访问
+            'metrics_enabled': False,
+            'metrics_token': '',
+            # 多久没有收到消息时发送 WebSocket PING (秒)，之后一半时间内无响应则断开，0 为不发送
+            'heartbeat': 10,
+            # 静态资源构建: 合并压缩 CSS/JS，输出带内容哈希的文件名及 .gz/.br 预压缩副本到 web/static/dist，
+            # 页面在启动时渲染并缓存。false 时直接提供源文件并逐次渲染页面，便于开发调试
+            'assets': {
+                'bundle': True
             }
         },
         # 添加: WebRTC 网络配置
@@ -32,8 +56,82 @@ DEFAULT_CONFIG = {
             'ip_family': 'any'
         },
         'language': 'en_US',
-        'max_connections': 20,
+        'i18n_reload_interval': 5, # 检查 locales/*.json 变化的间隔 (秒)，0 为不自动重载
+        # 多节点部署: local 为单节点；unix 用于同一主机上的多个进程；redis 用于多台主机 (需安装 redis)
+        'backplane': {
+            'type': 'local',
+            'socket_dir': 'data/backplane',
+            # unix 背板: 单条消息的大小上限、每个对端的发送队列长度 (帧) 和队列溢出断开后的重连等待秒数
+            'max_message_size': 16777216,
+            'peer_queue_size': 10000,
+            'reconnect_delay': 5.0,
+            'redis_url': 'redis://localhost:6379/0',
+            'channel': 'chatroom'
+        },
+        'max_connections': 20, # 总连接数上限，0 为不限
+        # 连接准入控制: 单 IP 连接数、未登录连接数 (应小于 max_connections) 和每秒接受的新连接数，0 为不限
+        'admission': {
+            'max_per_ip': 10,
+            'max_unauthenticated': 10,
+            'auth_timeout': 20, # 未登录连接的最长保持时间 (秒)
+            'accept_rate': 20,
+            'accept_burst': 40,
+            'listen_backlog': 128,
+            'exempt_ips': [] # 不受单 IP 上限约束的地址，如反向代理
+        },
+        # 会话超时检查所用时间轮的 tick (秒)，超时在到期后的第一个 tick 触发
+        'timer_wheel_tick': 1.0,
+        'workers': 1, # 大于 1 时以 SO_REUSEPORT 多进程模式运行，各工作进程共享端口 (仅 Linux/BSD)
+        # 关闭/重启时的排空: 通知客户端在随机延迟 (秒) 后重连，并最多等待 grace_seconds 让进行中的写入完成
+        'drain': {
+            'reconnect_delay_min': 1.0,
+            'reconnect_delay_max': 15.0,
+            'grace_seconds': 5.0
+        },
+        # 频道成员列表: 进入频道时下发第一页 (page_size 个)，客户端每次最多取 max_page_size 个；
+        # 成员状态变化合并 update_delay_ms 内的多次变化后推送，0 为立即推送
+        'members': {
+            'page_size': 100,
+            'max_page_size': 500,
+            'update_delay_ms': 100
+        },
         'message_history_on_join': 20,
+        # 多频道订阅的未读计数: 已读位置每 flush_interval 秒批量写回，未读数最多计到 max_count
+        'unread': {
+            'max_count': 100,
+            'flush_interval': 10
+        },
+        # 频道事件重放: 每个频道保留最近 max_events 条 (且不超过 max_age 秒) 已编号的广播，
+        # 断线重连的客户端只补发缺失的事件，缺口超出范围时回退为完整的历史快照
+        'replay': {
+            'enabled': True,
+            'max_events': 256,
+            'max_age': 300
+        },
+        # 出站消息合并: 声明了 batch 能力的客户端，window_ms 内的消息合并为一个 batch 帧发出，
+        # 单帧最多 max_messages 条 / max_bytes 字节，达到上限时立即发出
+        'batching': {
+            'enabled': True,
+            'window_ms': 5,
+            'max_messages': 64,
+            'max_bytes': 65536
+        },
+        # 语音 (SFU/WebRTC): 默认在首次有用户加入语音频道时才加载 aiortc；
+        # preload 为 true 时在启动后于后台线程预加载，enabled 为 false 时永不加载
+        'voice': {
+            'enabled': True,
+            'preload': False,
+            # 活跃发言者: 每个接收者只转发电平最高的 max_speakers 路音频，每 update_interval 秒重新选择；
+            # 替换发言者需高出 hysteresis_db 且被替换者已保持 min_hold 秒，电平高于 speaking_level (dBov) 视为在说话
+            'active_speakers': {
+                'enabled': True,
+                'max_speakers': 3,
+                'update_interval': 0.3,
+                'hysteresis_db': 6.0,
+                'min_hold': 1.0,
+                'speaking_level': -50.0
+            }
+        },
         'message_history_retention': '7d'
     },
     'security': {
@@ -58,9 +156,58 @@ DEFAULT_CONFIG = {
                 'mode': "",
                 'domains': "qq.com,gmail.com"
             }
+        },
+        # 登录令牌: 有效期 (秒)，使用时滑动续期；每个用户最多保留 max_per_user 个令牌，过期令牌按 prune_interval 分批清理
+        'sessions': {
+            'ttl': 604800,
+            'refresh_interval': 3600,
+            'max_per_user': 10,
+            'prune_interval': 3600,
+            'prune_batch_size': 5000
+        },
+        # 客户端消息令牌桶限速: 每秒补充 rate 个令牌，最多积累 burst 个；costs 为各消息类型消耗的令牌数
+        'rate_limit': {
+            'enabled': True,
+            'session': {'rate': 10, 'burst': 20},
+            'user': {'rate': 15, 'burst': 30},
+            'ip': {'rate': 30, 'burst': 60},
+            'exempt_ips': [], # 不做 IP 维度限速的地址，如反向代理
+            'costs': {
+                'auth_request': 10, 'chat_message': 1, 'command': 2, 'download_request': 2, 'search_request': 3,
+                'subscribe_channels': 5, 'channel_members_request': 2, 'join_voice': 5, 'leave_voice': 1, 'webrtc_signal': 0.2, 'default': 1
+            },
+            'throttle_max_delay': 0.5, # 令牌缺口在此秒数内可补齐时延迟处理，否则丢弃消息
+            'max_violations': 30, # violation_window 秒内被延迟或丢弃的消息达到此数时断开连接
+            'violation_window': 10
         }
     },
-    'logging': { 'level': 'INFO', 'dir': 'logs', 'debug': False, 'show_user_commands': True, 'show_user_chats': True }
+    # 邮件发件箱: 后台批量发送，失败按指数退避重试，超过 max_attempts 次后转为死信
+    'mail': {
+        'batch_size': 20,
+        'poll_interval': 5.0, # 检查其它进程写入的待发邮件的间隔 (秒)
+        'max_attempts': 6,
+        'retry_base_delay': 30.0,
+        'retry_max_delay': 3600.0,
+        'idle_timeout': 30.0, # SMTP 连接空闲多久后断开 (秒)
+        'send_timeout': 30.0,
+        'sent_retention_days': 7 # 已发送记录的保留天数，0 为永久保留
+    },
+    'search': {
+        'default_limit': 20,
+        'max_limit': 50,
+        'max_terms': 8,
+        'max_query_length': 200,
+        'snippet_tokens': 16, # 摘要包含的词元数 (trigram 分词时约为字符数)
+        'rank_candidates': 200, # rank 排序时参与相关度打分的最近命中数
+        'short_term_window': 5000 # 只有短词 (trigram 下不足 3 个字符) 时每页最多扫描的消息数
+    },
+    'logging': {
+        'level': 'INFO', 'dir': 'logs', 'debug': False, 'show_user_commands': True, 'show_user_chats': True,
+        'format': 'text', # text 或 json (每行一个 JSON 对象)
+        'queue_size': 10000, # 后台写日志队列长度，队列满时丢弃日志而不阻塞事件循环
+        'user_log_sample_rate': 1, # 聊天/命令日志每 N 条记录 1 条
+        'user_log_rate_limit': 50 # 聊天/命令日志每秒最多记录条数，0 为不限
+    }
 }
 CONFIG_FILE_PATH = 'config.yml'
 
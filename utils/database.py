@@ -1,11 +1,24 @@
 import aiosqlite
+import asyncio
 import logging
 import os
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timezone, timedelta
 
+from . import metrics
+
 DB_PATH = 'data/chat.db'
 
+# SQL 文本 -> 耗时直方图子指标; 参数均为绑定变量，语句数量有限
+_statement_metrics: Dict[str, Any] = {}
+
+def _statement_metric(query: str):
+    child = _statement_metrics.get(query)
+    if child is None:
+        label = ' '.join(query.split())[:80]
+        child = _statement_metrics[query] = metrics.db_query_duration.labels(label)
+    return child
+
 class DatabaseManager:
     """
     负责所有与 SQLite 数据库的异步交互
@@ -13,39 +26,100 @@ class DatabaseManager:
     def __init__(self, db_path: str = DB_PATH):
         self.db_path = db_path
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # 正在进行的写操作数，关闭/排空时等待其归零
+        self._pending_writes = 0
+        self._writes_idle = asyncio.Event()
+        self._writes_idle.set()
+
+    async def _write(self, query: str, params, many: bool = False):
+        """执行写语句并提交，返回游标"""
+        self._pending_writes += 1
+        self._writes_idle.clear()
+        try:
+            with _statement_metric(query).time():
+                async with aiosqlite.connect(self.db_path) as db:
+                    if many:
+                        cursor = await db.executemany(query, params)
+                    else:
+                        cursor = await db.execute(query, params)
+                    await db.commit()
+                    return cursor
+        finally:
+            self._pending_writes -= 1
+            if not self._pending_writes:
+                self._writes_idle.set()
+
+    async def execute(self, query: str, params: tuple = ()) -> int:
+        """执行写语句并提交，返回受影响的行数"""
+        return (await self._write(query, params)).rowcount
+
+    async def insert(self, query: str, params: tuple = ()) -> int:
+        """执行 INSERT 并返回新行的 rowid (每次调用使用新连接，不能再单独查询 last_insert_rowid())"""
+        return (await self._write(query, params)).lastrowid
+
+    async def executemany(self, query: str, params_seq: List[tuple]) -> int:
+        """在同一事务中批量执行写语句，返回受影响的行数"""
+        if not params_seq:
+            return 0
+        return (await self._write(query, params_seq, many=True)).rowcount
+
+    async def execute_returning(self, query: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        """执行带 RETURNING 的写语句，在提交前取出返回的行"""
+        self._pending_writes += 1
+        self._writes_idle.clear()
+        try:
+            with _statement_metric(query).time():
+                async with aiosqlite.connect(self.db_path) as db:
+                    db.row_factory = aiosqlite.Row
+                    cursor = await db.execute(query, params)
+                    rows = [dict(row) for row in await cursor.fetchall()]
+                    await db.commit()
+                    return rows
+        finally:
+            self._pending_writes -= 1
+            if not self._pending_writes:
+                self._writes_idle.set()
 
-    async def execute(self, query: str, params: tuple = ()):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(query, params)
-            await db.commit()
+    async def flush(self, timeout: float = 10.0) -> bool:
+        """等待所有进行中的写操作提交，返回是否在超时前完成"""
+        if not self._pending_writes:
+            return True
+        try:
+            await asyncio.wait_for(self._writes_idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logging.warning(f"等待数据库写入完成超时，仍有 {self._pending_writes} 个写操作未完成")
+            return False
 
     async def fetchone(self, query: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(query, params)
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+        with _statement_metric(query).time():
+            async with aiosqlite.connect(self.db_path) as db:
+                db.row_factory = aiosqlite.Row
+                cursor = await db.execute(query, params)
+                row = await cursor.fetchone()
+                return dict(row) if row else None
 
     async def fetchall(self, query: str, params: tuple = ()) -> List[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(query, params)
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        with _statement_metric(query).time():
+            async with aiosqlite.connect(self.db_path) as db:
+                db.row_factory = aiosqlite.Row
+                cursor = await db.execute(query, params)
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
     
     async def fetchval(self, query: str, params: tuple = ()):
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(query, params)
-            row = await cursor.fetchone()
-            return row[0] if row else None
+        with _statement_metric(query).time():
+            async with aiosqlite.connect(self.db_path) as db:
+                cursor = await db.execute(query, params)
+                row = await cursor.fetchone()
+                return row[0] if row else None
 
     async def add_message(self, channel_id: int, user_id: int, username: str, content: str):
         """将一条新消息插入数据库"""
         timestamp = datetime.now(timezone.utc).isoformat()
         query = "INSERT INTO messages (channel_id, user_id, username, content, timestamp) VALUES (?, ?, ?, ?, ?)"
-        await self.execute(query, (channel_id, user_id, username, content, timestamp))
         # 添加: 返回新插入消息的 ID
-        return await self.fetchval("SELECT last_insert_rowid()")
+        return await self.insert(query, (channel_id, user_id, username, content, timestamp))
 
 
     # 修改: get_latest_messages 现在返回更丰富的用户信息
@@ -62,7 +136,7 @@ class DatabaseManager:
             FROM messages m
             JOIN users u ON m.user_id = u.id
             WHERE m.channel_id = ?
-            ORDER BY m.timestamp DESC
+            ORDER BY m.id DESC
             LIMIT ?
         """
         rows = await self.fetchall(query, (channel_id, limit))
@@ -71,6 +145,7 @@ class DatabaseManager:
         formatted_rows = []
         for row in rows:
             formatted_rows.append({
+                "id": row['id'],
                 "sender_username": row['sender_username'],
                 "sender_display_name": row['sender_display_name'] or row['sender_username'],
                 "message": row['content'],
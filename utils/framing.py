@@ -0,0 +1,110 @@
+# server/utils/framing.py
+"""
+TCP 连接的分帧与压缩
+
+默认的 line 模式下每条 JSON 消息以 '\\n' 结尾。客户端可以在认证前发送
+protocol_negotiate 消息切换到长度前缀模式，此后每帧的格式为:
+
+    +----------------+-----------+-----------------+
+    | length (4B BE) | flags (1B)| payload (length) |
+    +----------------+-----------+-----------------+
+
+flags 的 bit0 表示 payload 已使用连接协商的算法 (zlib / zstd) 压缩，
+length 为压缩后的字节数，且解压前后都不得超过 max_frame_size。
+"""
+import struct
+import zlib
+from typing import List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FRAMING_LINE = "line"
+FRAMING_LENGTH_PREFIXED = "length_prefixed"
+
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_ZSTD = "zstd"
+
+FRAME_HEADER = struct.Struct('!IB')
+FLAG_COMPRESSED = 0x01
+
+
+class FrameError(Exception):
+    """帧格式错误、超长或无法解压"""
+    pass
+
+
+def available_compressions() -> List[str]:
+    """返回当前环境支持的压缩算法，按优先级排序"""
+    algorithms = []
+    if zstandard is not None:
+        algorithms.append(COMPRESSION_ZSTD)
+    algorithms.append(COMPRESSION_ZLIB)
+    return algorithms
+
+
+class FrameCodec:
+    """单个连接的长度前缀帧编解码器，压缩器实例在连接生命周期内复用"""
+    def __init__(self, max_frame_size: int, compression: Optional[str] = None, compression_min_size: int = 512):
+        self.max_frame_size = max_frame_size
+        self.compression = compression
+        self.compression_min_size = compression_min_size
+        self._zstd_compressor = None
+        self._zstd_decompressor = None
+        if compression == COMPRESSION_ZSTD:
+            if zstandard is None:
+                raise ValueError("zstd 压缩不可用: 未安装 zstandard")
+            self._zstd_compressor = zstandard.ZstdCompressor()
+            self._zstd_decompressor = zstandard.ZstdDecompressor()
+        elif compression not in (None, COMPRESSION_ZLIB):
+            raise ValueError(f"不支持的压缩算法: {compression}")
+
+    def encode(self, data: bytes) -> bytes:
+        flags = 0
+        if self.compression and len(data) >= self.compression_min_size:
+            compressed = self._compress(data)
+            if len(compressed) < len(data):
+                data, flags = compressed, FLAG_COMPRESSED
+        if len(data) > self.max_frame_size:
+            raise FrameError(f"帧大小 {len(data)} 超过上限 {self.max_frame_size}")
+        return FRAME_HEADER.pack(len(data), flags) + data
+
+    def parse_header(self, header: bytes) -> tuple[int, int]:
+        length, flags = FRAME_HEADER.unpack(header)
+        if length > self.max_frame_size:
+            raise FrameError(f"帧大小 {length} 超过上限 {self.max_frame_size}")
+        return length, flags
+
+    def decode_body(self, flags: int, body: bytes) -> bytes:
+        if not flags & FLAG_COMPRESSED:
+            return body
+        if not self.compression:
+            raise FrameError("收到压缩帧，但连接未协商压缩")
+        try:
+            return self._decompress(body)
+        except FrameError:
+            raise
+        except Exception as e:
+            raise FrameError(f"解压失败: {e}") from e
+
+    def _compress(self, data: bytes) -> bytes:
+        if self._zstd_compressor:
+            return self._zstd_compressor.compress(data)
+        return zlib.compress(data, 6)
+
+    def _decompress(self, body: bytes) -> bytes:
+        # 限制解压后的大小，防止压缩炸弹
+        if self._zstd_decompressor:
+            if zstandard.frame_content_size(body) > self.max_frame_size:
+                raise FrameError("解压后的帧超过上限")
+            data = self._zstd_decompressor.decompress(body, max_output_size=self.max_frame_size)
+            if len(data) > self.max_frame_size:
+                raise FrameError("解压后的帧超过上限")
+            return data
+        decompressor = zlib.decompressobj()
+        data = decompressor.decompress(body, self.max_frame_size)
+        if decompressor.unconsumed_tail:
+            raise FrameError("解压后的帧超过上限")
+        return data
@@ -1,9 +1,69 @@
 # server/utils/i18n.py
 import os
 import json
-from typing import Dict
+import asyncio
+import logging
+from string import Formatter
+from typing import Dict, Optional, Tuple, Union
+
+from .config import config
 
 # 添加: i18n 模块
+# 修改: 语言文件在加载时编译为 Catalog，每个会话绑定自己语言的 Catalog (session.t)
+
+
+class _Template:
+    """预解析的模板: 记录占位符名称，渲染时只做一次 str.format"""
+    __slots__ = ('text', 'fields', '_format')
+
+    def __init__(self, text: str):
+        self.text = text
+        self.fields = frozenset(field for _, field, _, _ in Formatter().parse(text) if field is not None)
+        self._format = text.format
+
+    def render(self, kwargs: dict) -> str:
+        try:
+            return self._format(**kwargs)
+        except (KeyError, IndexError, ValueError):
+            # 如果格式化参数不匹配，返回原始模板以帮助调试
+            return self.text
+
+
+class Catalog:
+    """
+    单个语言的已编译翻译表，缺失的键已在编译时用默认语言补齐。
+    无占位符的条目直接保存为字符串，查找即结果，不做任何格式化。
+    热重载时原地替换 _entries，已绑定此 Catalog 的会话无需更新。
+    """
+    __slots__ = ('lang', '_entries')
+
+    def __init__(self, lang: str, entries: Dict[str, Union[str, _Template]]):
+        self.lang = lang
+        self._entries = entries
+
+    def t(self, key: str, **kwargs) -> str:
+        entry = self._entries.get(key, key)
+        if entry.__class__ is str:
+            return entry
+        if not kwargs:
+            return entry.text
+        return entry.render(kwargs)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+
+def _compile(messages: Dict[str, str]) -> Dict[str, Union[str, _Template]]:
+    entries: Dict[str, Union[str, _Template]] = {}
+    for key, text in messages.items():
+        if not isinstance(text, str):
+            continue
+        template = _Template(text)
+        # 无占位符的模板在编译时就渲染好 ('{{' 之类的转义也在此处理)
+        entries[key] = template.render({}) if not template.fields else template
+    return entries
+
+
 class I18N:
     """
     国际化(i18n)管理类，负责加载和提供翻译文本
@@ -12,43 +72,117 @@ class I18N:
         self.locale_dir = os.path.join(os.path.dirname(__file__), '..', locale_dir)
         self.default_lang = default_lang
         self.translations: Dict[str, Dict[str, str]] = {}
+        self.catalogs: Dict[str, Catalog] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._dir_missing = False
+        self._reload_task: Optional[asyncio.Task] = None
         self._load_translations()
 
-    def _load_translations(self):
-        """加载所有语言文件"""
-        if not os.path.isdir(self.locale_dir):
-            print(f"[错误] 语言目录不存在: {self.locale_dir}")
-            return
+    def _scan(self) -> Dict[str, Tuple[str, float]]:
+        files = {}
         for filename in os.listdir(self.locale_dir):
             if filename.endswith('.json'):
-                lang_code = filename[:-5]
                 filepath = os.path.join(self.locale_dir, filename)
                 try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        self.translations[lang_code] = json.load(f)
-                except (json.JSONDecodeError, IOError) as e:
-                    print(f"[错误] 加载语言文件失败 {filepath}: {e}")
+                    files[filename[:-5]] = (filepath, os.path.getmtime(filepath))
+                except OSError:
+                    continue
+        return files
+
+    def _load_translations(self) -> bool:
+        """加载所有语言文件并编译，返回是否有语言文件发生变化"""
+        if not os.path.isdir(self.locale_dir):
+            # 定期重载时只在目录刚消失时提示一次
+            if not self._dir_missing:
+                logging.warning(f"语言目录不存在: {self.locale_dir}")
+            self._dir_missing = True
+            return False
+        self._dir_missing = False
+        files = self._scan()
+        changed = False
+        for lang_code, (filepath, mtime) in files.items():
+            if self._mtimes.get(lang_code) == mtime:
+                continue
+            # 失败时同样记录 mtime: 同一版本的文件只报告一次，修正 (文件再次修改) 后重新尝试
+            self._mtimes[lang_code] = mtime
+            try:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    self.translations[lang_code] = json.load(f)
+                changed = True
+            except (ValueError, OSError) as e:
+                # 保留上一次成功加载的内容
+                logging.warning(f"加载语言文件失败 {filepath}: {e}")
+        if changed:
+            self._compile_catalogs()
+        return changed
+
+    def _compile_catalogs(self):
+        default_messages = self.translations.get(self.default_lang, {})
+        for lang_code, messages in self.translations.items():
+            merged = dict(default_messages)
+            merged.update(messages)
+            entries = _compile(merged)
+            catalog = self.catalogs.get(lang_code)
+            if catalog is None:
+                self.catalogs[lang_code] = Catalog(lang_code, entries)
+            else:
+                catalog._entries = entries
+        if self.default_lang not in self.catalogs:
+            self.catalogs[self.default_lang] = Catalog(self.default_lang, {})
+
+    def resolve_language(self, requested: Optional[str]) -> str:
+        """
+        把客户端给出的语言 (如 'zh-CN'、'zh'，或 Accept-Language 头) 解析为已有的语言代码，
+        依次尝试精确匹配和语言前缀匹配，都失败时返回默认语言
+        """
+        if not requested or not isinstance(requested, str):
+            return self.default_lang
+        for part in requested.split(','):
+            code = part.split(';', 1)[0].strip().replace('-', '_')
+            if not code or code == '*':
+                continue
+            for lang_code in self.catalogs:
+                if lang_code.lower() == code.lower():
+                    return lang_code
+            prefix = code.split('_', 1)[0].lower()
+            for lang_code in self.catalogs:
+                if lang_code.split('_', 1)[0].lower() == prefix:
+                    return lang_code
+        return self.default_lang
 
-    def t(self, key: str, lang: str = 'en_US', **kwargs) -> str:
+    def catalog(self, lang: Optional[str] = None) -> Catalog:
+        return self.catalogs.get(lang) or self.catalogs[self.default_lang]
+
+    def t(self, key: str, lang: Optional[str] = None, **kwargs) -> str:
         """
-        获取翻译文本
+        获取翻译文本 (没有会话上下文时使用，有会话时请用 session.t)
         :param key: 语言文件中的键
         :param lang: 目标语言代码
         :param kwargs: 用于格式化字符串的参数
         :return: 翻译后的字符串
         """
         # Issue #12: 实现服务器消息的国际化 (i18n)
-        lang_map = self.translations.get(lang)
-        if not lang_map:
-            lang_map = self.translations.get(self.default_lang, {})
+        return self.catalog(lang).t(key, **kwargs)
 
-        message = lang_map.get(key, key)
-        
-        try:
-            return message.format(**kwargs)
-        except (KeyError, IndexError):
-            # 如果格式化参数不匹配，返回原始模板以帮助调试
-            return message
+    def start_auto_reload(self, interval: float):
+        """定期检查 locales/*.json 的修改时间，有变化时重新编译 (interval <= 0 时不启用)"""
+        if interval <= 0 or self._reload_task:
+            return
+        self._reload_task = asyncio.create_task(self._auto_reload_loop(interval))
+
+    def stop_auto_reload(self):
+        if self._reload_task:
+            self._reload_task.cancel()
+            self._reload_task = None
+
+    async def _auto_reload_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self._load_translations():
+                    logging.info(f"语言文件已重新加载: {', '.join(sorted(self.catalogs))}")
+            except Exception as e:
+                logging.error(f"重新加载语言文件时出错: {e}", exc_info=True)
 
 # 添加: 创建一个全局翻译实例
-translator = I18N(default_lang='en_US')
\ No newline at end of file
+translator = I18N(default_lang=config.get('server.language', 'en_US'))
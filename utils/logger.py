@@ -1,43 +1,152 @@
 # server/utils/logger.py
+import json
 import logging
+import queue
 import sys
-from logging.handlers import TimedRotatingFileHandler
+import time
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 import os
+from typing import Optional
 
 # 添加: 日志模块 (Issue #17)
+# 修改: 事件循环只负责把日志记录放入队列，格式化和控制台/文件 I/O 由后台线程完成
 
-def setup_logger(log_dir: str, level: str = 'INFO', debug: bool = False):
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional['NonBlockingQueueHandler'] = None
+
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，通过 extra={...} 传入的字段会原样附加"""
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    队列满时丢弃日志而不是阻塞事件循环，丢弃数量在下一条成功入队的日志前补报。
+    prepare() 只合并 msg/args 和异常文本，完整格式化留给监听线程。
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.dropped:
+            try:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    "name": "logger", "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": f"日志队列已满，丢弃了 {self.dropped} 条日志",
+                }))
+                self.dropped = 0
+            except queue.Full:
+                pass
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _BlockingSentinelListener(QueueListener):
+    """停止时阻塞等待队列腾出空间再放入结束标记，保证已入队的日志全部写出"""
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class LogRateLimiter:
+    """
+    针对逐条消息日志 (聊天、命令) 的采样与限速。
+    每 sample_rate 条取 1 条，且每秒最多 rate 条 (令牌桶，0 表示不限速)；
+    被抑制的条数在下一条放行的日志中通过 suppressed 字段报告。
+    """
+    def __init__(self, sample_rate: int = 1, rate: float = 0, burst: Optional[float] = None):
+        self.sample_rate = max(1, int(sample_rate))
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(1.0, self.rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._seen = 0
+        self.suppressed = 0
+
+    def allow(self) -> bool:
+        self._seen += 1
+        if self._seen % self.sample_rate:
+            self.suppressed += 1
+            return False
+        if self.rate > 0:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens < 1:
+                self.suppressed += 1
+                return False
+            self._tokens -= 1
+        return True
+
+    def take_suppressed(self) -> int:
+        count, self.suppressed = self.suppressed, 0
+        return count
+
+
+def setup_logger(log_dir: str, level: str = 'INFO', debug: bool = False, log_format: str = 'text', queue_size: int = 10000, file_name: str = 'server.log'):
     """
     配置全局日志记录器
     """
+    global _listener, _queue_handler
     if debug:
         level = 'DEBUG'
 
     log_level = getattr(logging, level.upper(), logging.INFO)
-    
+
     # 获取根 logger
     logger = logging.getLogger()
     logger.setLevel(logging.DEBUG if debug else logging.INFO) # 修改: 根logger级别设为最低，由handler控制输出
 
+    stop_logger()
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
 
     os.makedirs(log_dir, exist_ok=True)
-    
-    formatter = logging.Formatter(
-        '%(asctime)s - [%(levelname)s] - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    
+
+    if log_format == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - [%(levelname)s] - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        )
+
     # 控制台 Handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(log_level)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-    
+
     # 文件 Handler (按天轮转)
     file_handler = TimedRotatingFileHandler(
-        os.path.join(log_dir, 'server.log'),
+        os.path.join(log_dir, file_name),
         when='midnight',
         interval=1,
         backupCount=7,
@@ -46,6 +155,30 @@ def setup_logger(log_dir: str, level: str = 'INFO', debug: bool = False):
     # 文件handler总是记录INFO及以上级别，除非开启debug
     file_handler.setLevel(logging.DEBUG if debug else logging.INFO)
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
 
-    logging.info(f"日志记录器已设置，级别: {level}")
\ No newline at end of file
+    # 根 logger 上只挂 QueueHandler，真正的 handler 由 QueueListener 在后台线程中调用
+    log_queue = queue.Queue(maxsize=max(0, queue_size))
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    logger.addHandler(_queue_handler)
+    _listener = _BlockingSentinelListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+
+    logging.info("日志记录器已设置，级别: %s，格式: %s", level, log_format)
+
+
+def stop_logger():
+    """
+    停止后台写日志线程并写出队列中剩余的日志。
+    之后的日志 (如退出信息) 直接由原 handler 同步输出。
+    """
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    root = logging.getLogger()
+    if _queue_handler is not None:
+        root.removeHandler(_queue_handler)
+        _queue_handler = None
+    listener.stop()
+    for handler in listener.handlers:
+        root.addHandler(handler)
@@ -1,58 +1,244 @@
 # server/utils/mailer.py
+"""
+邮件发件箱
+
+enqueue_email() 只把邮件写入 mail_outbox 表并唤醒后台发送任务，调用方 (注册等) 不再等待 SMTP。
+MailSender 按批取出到期的邮件，复用同一条已登录的 SMTP 连接逐封发送 (空闲 idle_timeout 秒后断开)；
+临时失败按指数退避重试，超过 max_attempts 次或遇到永久性错误 (5xx) 的邮件标记为 dead (死信) 并保留在表中。
+多进程模式下只有一个进程运行发送任务，其它进程写入的邮件在下一次轮询 (poll_interval) 时被发出。
+每批邮件先用一条 UPDATE ... RETURNING 原子地领取 (status 置为 sending 并设置租约 lease_until) 再发送，
+滚动重启或监听交接时新旧两个发送任务同时运行也不会重复发送；进程在发送中退出时，租约过期后邮件被重新领取。
+本地调试时可把 smtp_host/smtp_port 指向任意调试用 SMTP 服务 (例如 aiosmtpd 的 Debugging handler)。
+"""
 import asyncio
 import logging
+import random
+import time
 from email.mime.text import MIMEText
 from email.header import Header
 from email.utils import formataddr # 新增: 导入专门处理地址格式的工具
+from typing import Optional
 import aiosmtplib
 
 from .config import config
 from .database import db_manager
+from . import metrics
+
+_sent = metrics.registry.counter('mail_sent_total', '成功发送的邮件数')
+_failed = metrics.registry.counter('mail_failed_total', '发送失败的邮件数', ('result',))
+_outbox_pending = metrics.registry.gauge('mail_outbox_pending', '发件箱中待发送的邮件数')
+
+# 领取到期的待发送邮件，以及租约已过期 (领取它的进程在发送中退出) 的邮件
+_CLAIM_QUERY = """
+    UPDATE mail_outbox SET status = 'sending', lease_until = ?
+    WHERE id IN (
+        SELECT id FROM mail_outbox
+        WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'sending' AND lease_until < ?)
+        ORDER BY next_attempt_at LIMIT ?
+    ) AND (status = 'pending' OR (status = 'sending' AND lease_until < ?))
+    RETURNING id, to_email, subject, content, attempts
+"""
+
 
 async def get_smtp_password() -> str:
     password_row = await db_manager.fetchone("SELECT value FROM settings WHERE key = 'smtp_password'")
     return password_row['value'] if password_row else ""
 
-async def send_email(to_email: str, subject: str, content: str) -> bool:
-    if not config.get('security.email_verification.enabled'):
-        return False
-
-    host = config.get('security.email_verification.smtp_host')
-    port = config.get('security.email_verification.smtp_port')
-    use_ssl = config.get('security.email_verification.smtp_use_ssl')
-    username = config.get('security.email_verification.smtp_username')
-    sender_email = config.get('security.email_verification.sender_email')
-    password = await get_smtp_password()
-
-    if not all([host, port, username, password, sender_email]):
-        logging.error("SMTP 配置不完整，无法发送邮件")
-        return False
 
+def _build_message(sender_email: str, to_email: str, subject: str, content: str) -> MIMEText:
     message = MIMEText(content, 'html', 'utf-8')
-    
+
     # 修改: 使用 formataddr 来创建最安全、最符合 RFC 标准的 From 头
     # 第一个参数是显示名，第二个是邮箱地址
     message['From'] = formataddr((str(Header("ChatRoom", 'utf-8')), sender_email))
-    
+
     message['To'] = to_email
     message['Subject'] = Header(subject, 'utf-8')
+    return message
 
-    try:
-        await aiosmtplib.send(
-            message,
-            sender=sender_email,
-            recipients=[to_email],
-            hostname=host,
-            port=port,
-            use_tls=use_ssl,
-            username=username,
-            password=password
-        )
-        logging.info(f"邮件已成功发送至 {to_email}")
-        return True
-    except aiosmtplib.SMTPException as e:
-        logging.error(f"发送邮件至 {to_email} 失败 (SMTP Error): {e.code} - {e.message}")
+
+def _is_permanent(error: Exception) -> bool:
+    """5xx 应答 (收件人不存在、被拒收等) 重试也不会成功"""
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(500 <= e.code < 600 for e in error.recipients)
+    code = getattr(error, 'code', None)
+    return isinstance(error, aiosmtplib.SMTPResponseException) and isinstance(code, int) and 500 <= code < 600 \
+        and not isinstance(error, aiosmtplib.SMTPAuthenticationError)
+
+
+async def enqueue_email(to_email: str, subject: str, content: str) -> bool:
+    """把邮件写入发件箱，由后台发送任务投递，返回是否已入队"""
+    if not config.get('security.email_verification.enabled'):
         return False
-    except Exception as e:
-        logging.error(f"发送邮件至 {to_email} 失败 (General Error): {e}")
-        return False
\ No newline at end of file
+    await db_manager.execute(
+        "INSERT INTO mail_outbox (to_email, subject, content, next_attempt_at) VALUES (?, ?, ?, ?)",
+        (to_email, subject, content, time.time())
+    )
+    mail_sender.wake()
+    return True
+
+
+class MailSender:
+    def __init__(self):
+        self.batch_size = config.get('mail.batch_size', 20)
+        self.poll_interval = config.get('mail.poll_interval', 5.0)
+        self.max_attempts = config.get('mail.max_attempts', 6)
+        self.retry_base_delay = config.get('mail.retry_base_delay', 30.0)
+        self.retry_max_delay = config.get('mail.retry_max_delay', 3600.0)
+        self.idle_timeout = config.get('mail.idle_timeout', 30.0)
+        self.send_timeout = config.get('mail.send_timeout', 30.0)
+        self.sent_retention_days = config.get('mail.sent_retention_days', 7)
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._password: Optional[str] = None
+        self._last_used = 0.0
+        self._last_prune = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    def start(self):
+        if self._task or not config.get('security.email_verification.enabled'):
+            return
+        self._task = asyncio.create_task(self._run())
+        logging.info("邮件发送任务已启动")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._disconnect()
+
+    async def _run(self):
+        while True:
+            try:
+                more = await self._process_batch()
+                await self._prune_sent()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"处理邮件发件箱时出错: {e}", exc_info=True)
+                more = False
+            if more:
+                # 本批已满时立即处理下一批
+                continue
+            if self._smtp and time.monotonic() - self._last_used > self.idle_timeout:
+                await self._disconnect()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._next_wait())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _next_wait(self) -> float:
+        if self._smtp:
+            return max(0.1, min(self.poll_interval, self.idle_timeout - (time.monotonic() - self._last_used)))
+        return self.poll_interval
+
+    async def _process_batch(self) -> bool:
+        """发送一批到期邮件，返回本批是否取满 (可能还有更多)"""
+        now = time.time()
+        # 租约覆盖整批邮件逐封发送 (含建立连接) 的最长时间
+        lease_until = now + self.send_timeout * (self.batch_size + 1)
+        rows = await db_manager.execute_returning(_CLAIM_QUERY, (lease_until, now, now, self.batch_size, now))
+        _outbox_pending.set(await db_manager.fetchval("SELECT COUNT(*) FROM mail_outbox WHERE status = 'pending'") or 0)
+        if not rows:
+            return False
+        for row in rows:
+            await self._deliver(row)
+        return len(rows) >= self.batch_size
+
+    async def _deliver(self, row: dict):
+        try:
+            smtp = await self._connection()
+            sender_email = config.get('security.email_verification.sender_email')
+            message = _build_message(sender_email, row['to_email'], row['subject'], row['content'])
+            await asyncio.wait_for(smtp.send_message(message, sender=sender_email, recipients=[row['to_email']]), self.send_timeout)
+        except Exception as e:
+            await self._record_failure(row, e)
+            return
+        self._last_used = time.monotonic()
+        await db_manager.execute(
+            "UPDATE mail_outbox SET status = 'sent', attempts = attempts + 1, last_error = NULL, lease_until = NULL, sent_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') WHERE id = ?",
+            (row['id'],)
+        )
+        _sent.inc()
+        logging.info(f"邮件已成功发送至 {row['to_email']}")
+
+    async def _record_failure(self, row: dict, error: Exception):
+        if isinstance(error, aiosmtplib.SMTPResponseException):
+            description = f"SMTP Error: {error.code} - {error.message}"
+        else:
+            description = f"{type(error).__name__}: {error}"
+        # 针对单封邮件的拒绝 (收件人被拒等) 不影响连接，其它错误下次重新建立连接；认证失败时也重新读取密码
+        if not isinstance(error, (aiosmtplib.SMTPRecipientsRefused, aiosmtplib.SMTPResponseException)) \
+                or isinstance(error, aiosmtplib.SMTPAuthenticationError):
+            await self._disconnect()
+        if isinstance(error, aiosmtplib.SMTPAuthenticationError):
+            self._password = None
+
+        attempts = row['attempts'] + 1
+        if attempts >= self.max_attempts or _is_permanent(error):
+            await db_manager.execute(
+                "UPDATE mail_outbox SET status = 'dead', attempts = ?, last_error = ?, lease_until = NULL WHERE id = ?",
+                (attempts, description, row['id'])
+            )
+            _failed.labels('dead').inc()
+            logging.error(f"发送邮件至 {row['to_email']} 失败 ({description})，已尝试 {attempts} 次，移入死信")
+            return
+        delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** (attempts - 1)))
+        delay *= random.uniform(0.8, 1.2)
+        await db_manager.execute(
+            "UPDATE mail_outbox SET status = 'pending', attempts = ?, last_error = ?, next_attempt_at = ?, lease_until = NULL WHERE id = ?",
+            (attempts, description, time.time() + delay, row['id'])
+        )
+        _failed.labels('retry').inc()
+        logging.warning(f"发送邮件至 {row['to_email']} 失败 ({description})，{delay:.0f} 秒后第 {attempts + 1} 次尝试")
+
+    async def _connection(self) -> aiosmtplib.SMTP:
+        if self._smtp is not None and self._smtp.is_connected:
+            return self._smtp
+        host = config.get('security.email_verification.smtp_host')
+        port = config.get('security.email_verification.smtp_port')
+        use_ssl = config.get('security.email_verification.smtp_use_ssl')
+        username = config.get('security.email_verification.smtp_username')
+        sender_email = config.get('security.email_verification.sender_email')
+        if self._password is None:
+            self._password = await get_smtp_password()
+        if not all([host, port, sender_email]):
+            raise RuntimeError("SMTP 配置不完整，无法发送邮件")
+        smtp = aiosmtplib.SMTP(
+            hostname=host, port=port, use_tls=use_ssl, timeout=self.send_timeout,
+            username=username or None, password=self._password or None
+        )
+        await smtp.connect()
+        self._smtp = smtp
+        self._last_used = time.monotonic()
+        return smtp
+
+    async def _disconnect(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is None or not smtp.is_connected:
+            return
+        try:
+            await smtp.quit()
+        except Exception:
+            smtp.close()
+
+    async def _prune_sent(self):
+        now = time.monotonic()
+        if self.sent_retention_days <= 0 or now - self._last_prune < 3600:
+            return
+        self._last_prune = now
+        await db_manager.execute(
+            "DELETE FROM mail_outbox WHERE status = 'sent' AND sent_at < strftime('%Y-%m-%dT%H:%M:%fZ', 'now', ?)",
+            (f"-{int(self.sent_retention_days)} days",)
+        )
+
+
+mail_sender = MailSender()
@@ -0,0 +1,250 @@
+# server/utils/metrics.py
+"""
+进程内指标注册表，以 Prometheus 文本格式 (0.0.4) 在 /metrics 导出。
+
+热路径上的开销只有一次属性自增: 带标签的指标通过 labels() 取得子对象并缓存，
+调用方应在模块加载时预先绑定常用的子对象。单标签指标按标签值本身索引，
+不会为每次调用分配 tuple 或 dict。
+"""
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ('value', '_function')
+
+    def __init__(self):
+        self.value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """在抓取时才计算取值，适用于可以直接从现有状态读出的量"""
+        self._function = function
+
+    def get(self) -> float:
+        return self._function() if self._function else self.value
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> '_Timer':
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ('_child', '_start')
+
+    def __init__(self, child: _HistogramChild):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class _Metric(ABC):
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[object, object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    @abstractmethod
+    def _new_child(self):
+        """创建一个子指标 (不带标签的指标只有一个)"""
+        pass
+
+    def labels(self, *values: str):
+        """返回 (并缓存) 对应标签值的子指标"""
+        key = values[0] if len(values) == 1 else values
+        child = self._children.get(key)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"指标 {self.name} 需要 {len(self.labelnames)} 个标签值")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _label_values(self, key) -> Tuple:
+        return key if isinstance(key, tuple) else (key,)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for key, child in list(self._children.items()):
+            lines.extend(self._render_child(self._label_values(key), child))
+        return lines
+
+    @abstractmethod
+    def _render_child(self, values: Tuple, child) -> List[str]:
+        """以 Prometheus 文本格式输出一个子指标的样本行"""
+        pass
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+    def _render_child(self, values, child):
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {child.value}']
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._children[()].dec(amount)
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._children[()].set_function(function)
+
+    def _render_child(self, values, child):
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {child.get()}']
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def time(self) -> _Timer:
+        return self._children[()].time()
+
+    def total_count(self) -> int:
+        """所有标签组合的样本总数"""
+        return sum(child.count for child in list(self._children.values()))
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, child.counts):
+            cumulative += count
+            le = 'le="%s"' % bound
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}')
+        cumulative += child.counts[-1]
+        le = 'le="+Inf"'
+        lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(self.labelnames, values)} {child.sum}')
+        lines.append(f'{self.name}_count{_format_labels(self.labelnames, values)} {child.count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = 'chatroom'):
+        self.prefix = prefix
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(f'{self.prefix}_{name}', documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(f'{self.prefix}_{name}', documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(f'{self.prefix}_{name}', documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+# --- 全局指标定义，各模块直接导入使用 ---
+messages_in = registry.counter('messages_in_total', '收到的客户端消息数', ('type',))
+messages_out = registry.counter('messages_out_total', '发往客户端的消息数', ('type',))
+broadcast_fanout = registry.histogram('broadcast_fanout', '单次广播的接收会话数', ('scope',), buckets=SIZE_BUCKETS)
+broadcast_duration = registry.histogram('broadcast_duration_seconds', '单次广播耗时', ('scope',))
+command_duration = registry.histogram('command_duration_seconds', '聊天命令执行耗时', ('command',))
+db_query_duration = registry.histogram('db_query_duration_seconds', '数据库语句耗时', ('statement',))
+sessions_active = registry.gauge('sessions_active', '当前连接数', ('transport',))
+bcrypt_queue_depth = registry.gauge('bcrypt_queue_depth', '排队或执行中的 bcrypt 计算数')
+upload_bytes = registry.counter('upload_bytes_total', '上传字节数', ('path',))
+download_bytes = registry.counter('download_bytes_total', '下载字节数', ('path',))
+sfu_rooms = registry.gauge('sfu_rooms', '活跃的语音房间数')
+sfu_participants = registry.gauge('sfu_participants', '语音房间参与者总数')
+sfu_audio_slots = registry.gauge('sfu_audio_slots', '活跃发言者模式下转发给接收者的音频槽位总数')
+startup_phase_seconds = registry.gauge('startup_phase_seconds', '进程启动各阶段耗时', ('phase',))
@@ -1,6 +1,6 @@
 # server/utils/protocol.py
 import json
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Union, List
 from datetime import datetime, timezone
 
 # C2S (Client to Server)
@@ -14,6 +14,20 @@ MSG_TYPE_DOWNLOAD_REQUEST = "download_request"
 MSG_TYPE_JOIN_VOICE = "join_voice"
 MSG_TYPE_LEAVE_VOICE = "leave_voice"
 MSG_TYPE_WEBRTC_SIGNAL = "webrtc_signal"
+# 添加: TCP 分帧/压缩协商 (C2S)
+MSG_TYPE_PROTOCOL_NEGOTIATE = "protocol_negotiate"
+# 添加: 消息全文搜索 (C2S)
+MSG_TYPE_SEARCH_REQUEST = "search_request"
+# 添加: 设置订阅的频道 {channel_ids: [...]}，未聚焦的频道只推送未读数 (C2S)
+MSG_TYPE_SUBSCRIBE_CHANNELS = "subscribe_channels"
+# 添加: 分页获取频道成员 {channel_id, cursor?, limit?} (C2S)
+MSG_TYPE_CHANNEL_MEMBERS_REQUEST = "channel_members_request"
+
+C2S_MESSAGE_TYPES = frozenset({
+    MSG_TYPE_AUTH_REQUEST, MSG_TYPE_CHAT_MESSAGE, MSG_TYPE_COMMAND, MSG_TYPE_DOWNLOAD_REQUEST,
+    MSG_TYPE_JOIN_VOICE, MSG_TYPE_LEAVE_VOICE, MSG_TYPE_WEBRTC_SIGNAL, MSG_TYPE_PROTOCOL_NEGOTIATE,
+    MSG_TYPE_SEARCH_REQUEST, MSG_TYPE_SUBSCRIBE_CHANNELS, MSG_TYPE_CHANNEL_MEMBERS_REQUEST,
+})
 
 
 # S2C (Server to Client)
@@ -23,10 +37,13 @@ MSG_TYPE_AUTH_RESUME = "auth_resume"
 MSG_TYPE_CHAT_BROADCAST = "chat_broadcast"
 MSG_TYPE_SYSTEM_MESSAGE = "system_message"
 MSG_TYPE_ERROR_MESSAGE = "error_message"
-MSG_TYPE_USER_LIST_UPDATE = "user_list_update"
-MSG_TYPE_USER_LIST = "user_list"
+# 频道成员列表的一页 {channel_id, users|users_compact, members_cursor, member_count?}
+MSG_TYPE_CHANNEL_MEMBERS = "channel_members"
+# 当前频道中状态或资料有变化的成员 {channel_id, users|users_compact, member_count?}
+MSG_TYPE_CHANNEL_MEMBER_UPDATE = "channel_member_update"
 MSG_TYPE_WHOAMI_RESPONSE = "whoami_response"
 MSG_TYPE_CHANNEL_LIST = "channel_list"
+MSG_TYPE_CHANNEL_LIST_UPDATE = "channel_list_update"
 MSG_TYPE_JOIN_SUCCESS = "join_channel_success"
 MSG_TYPE_COMMAND_RESPONSE = "command_response"
 # 移除: MSG_TYPE_UPLOAD_READY 不再通过 WebSocket 发送
@@ -37,6 +54,24 @@ MSG_TYPE_FILE_BROADCAST = "file_broadcast"
 MSG_TYPE_JOIN_VOICE_SUCCESS = "join_voice_success"
 MSG_TYPE_USER_JOINED_VOICE = "user_joined_voice"
 MSG_TYPE_USER_LEFT_VOICE = "user_left_voice"
+# 语音房间当前的活跃发言者 {user_ids} (S2C)
+MSG_TYPE_ACTIVE_SPEAKERS = "active_speakers"
+# 添加: TCP 分帧/压缩协商结果 (S2C)
+MSG_TYPE_PROTOCOL_NEGOTIATED = "protocol_negotiated"
+# 添加: 服务器即将重启，客户端应在 reconnect_delay_ms 后重连 (S2C)
+MSG_TYPE_SERVER_RESTARTING = "server_restarting"
+# 添加: 搜索结果 (S2C)
+MSG_TYPE_SEARCH_RESULTS = "search_results"
+# 添加: 订阅频道的未读数快照 {unread: {channel_id: n}} 与单个频道的增量 {channel_id, unread, message_id} (S2C)
+MSG_TYPE_UNREAD_COUNTS = "unread_counts"
+MSG_TYPE_UNREAD_UPDATE = "unread_update"
+# 添加: 合并窗口内的多条消息 {messages: [...]}，按顺序处理 (S2C)
+MSG_TYPE_BATCH = "batch"
+
+# 客户端在 auth_request 的 capabilities 中声明的可选能力
+CAPABILITY_COMPACT_USER_LIST = "compact_user_list"
+CAPABILITY_BATCH = "batch"
+USER_LIST_FIELDS = ("id", "username", "display_name", "roles", "avatar_url", "status")
 
 # 移除: 重复定义
 # MSG_TYPE_UPLOAD_REQUEST = "upload_request"
@@ -49,9 +84,35 @@ def create_message(msg_type: str, payload: Optional[Dict[str, Any]] = None) -> s
     if payload is None: payload = {}
     return json.dumps({"type": msg_type, "payload": payload})
 
-def parse_message(message_str: str) -> Optional[Dict[str, Any]]:
+def peek_message_type(message: str) -> str:
+    """不解析 JSON，直接从 create_message 的输出中取出消息类型"""
+    if message.startswith('{"type": "'):
+        end = message.find('"', 10)
+        if end > 0:
+            return message[10:end]
+    return "unknown"
+
+def with_sequence(message: str, seq: int) -> str:
+    """在 create_message 的输出末尾追加顶层 seq 字段 (频道事件序号)，不重新序列化"""
+    return f'{message[:-1]}, "seq": {seq}}}'
+
+def create_batch_message(messages: List[str]) -> str:
+    """把已序列化的消息拼接为一个 batch 消息，不重新序列化"""
+    return '{"type": "%s", "payload": {"messages": [%s]}}' % (MSG_TYPE_BATCH, ', '.join(messages))
+
+def compact_user_list(users: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    用户列表的紧凑 (列式) 编码: 字段名只出现一次，每个用户为一行数组。
+    重复的键名是成员列表体积的主要来源，列式编码也能让 deflate 压缩得更好。
+    """
+    return {
+        "fields": USER_LIST_FIELDS,
+        "rows": [[user.get(field) for field in USER_LIST_FIELDS] for user in users]
+    }
+
+def parse_message(message_str: Union[str, bytes]) -> Optional[Dict[str, Any]]:
     try: return json.loads(message_str)
-    except json.JSONDecodeError: return None
+    except (json.JSONDecodeError, UnicodeDecodeError): return None
 
 def create_system_message(text: str, level: str = "info") -> str:
     """创建系统消息"""
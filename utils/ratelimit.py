@@ -0,0 +1,189 @@
+# server/utils/ratelimit.py
+"""
+客户端消息的令牌桶限速
+
+每条消息按类型计算消耗 (security.rate_limit.costs)，需要同时从三个桶中扣除:
+  - session: 每个连接一个桶
+  - user:    同一用户的所有连接共享 (登录后)
+  - ip:      同一来源 IP 的所有连接共享 (exempt_ips 中的地址除外)
+任一桶不足时:
+  1. 缺口在 throttle_max_delay 秒内可补齐的，延迟处理该消息 (软限速，连接的读取随之放慢)；
+  2. 否则丢弃该消息并回复 rate_limited 错误；
+  3. 以上两种情况都记一次违规，violation_window 秒内违规达到 max_violations 次的连接被断开。
+多进程模式下每个工作进程各自计数。
+"""
+import time
+from typing import Dict, Optional, Tuple
+
+from .config import config
+from . import metrics
+
+SCOPE_SESSION = 'session'
+SCOPE_USER = 'user'
+SCOPE_IP = 'ip'
+
+# 检查结果
+ALLOW = 'allow'
+THROTTLE = 'throttle'
+REJECT = 'reject'
+DISCONNECT = 'disconnect'
+
+DEFAULT_COSTS = {
+    'auth_request': 10,
+    'chat_message': 1,
+    'command': 2,
+    'download_request': 2,
+    'search_request': 3,
+    'subscribe_channels': 5,
+    'join_voice': 5,
+    'leave_voice': 1,
+    'webrtc_signal': 0.2,
+    'default': 1,
+}
+
+_limited = metrics.registry.counter('rate_limited_total', '因限速被延迟或丢弃的客户端消息数', ('scope', 'action'))
+_disconnects = metrics.registry.counter('rate_limit_disconnects_total', '因反复超出限速被断开的连接数')
+_tracked_buckets = metrics.registry.gauge('rate_limit_buckets', '当前跟踪的用户/IP 令牌桶数')
+
+
+class RateLimitExceeded(ConnectionError):
+    """连接因反复超出限速需要断开，由会话主循环按连接错误处理"""
+    pass
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def deficit_time(self, cost: float) -> float:
+        """补齐 cost 个令牌还需等待的秒数 (需先 refill)，0 表示足够"""
+        if self.tokens >= cost:
+            return 0.0
+        if self.rate <= 0:
+            return float('inf')
+        return (cost - self.tokens) / self.rate
+
+    def is_idle(self, now: float) -> bool:
+        """已经回满的桶与新建的桶等价，可以丢弃"""
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class SessionRateState:
+    """挂在会话上的限速状态: 会话自己的桶和近期违规记录"""
+    __slots__ = ('bucket', 'violations', 'window_start')
+
+    def __init__(self, bucket: Optional[TokenBucket]):
+        self.bucket = bucket
+        self.violations = 0
+        self.window_start = 0.0
+
+
+class RateLimiter:
+    def __init__(self):
+        self.enabled = config.get('security.rate_limit.enabled', True)
+        self._limits: Dict[str, Tuple[float, float]] = {}
+        for scope, (rate, burst) in ((SCOPE_SESSION, (10, 20)), (SCOPE_USER, (15, 30)), (SCOPE_IP, (30, 60))):
+            self._limits[scope] = (
+                float(config.get(f'security.rate_limit.{scope}.rate', rate)),
+                float(config.get(f'security.rate_limit.{scope}.burst', burst)),
+            )
+        self.costs = dict(DEFAULT_COSTS)
+        self.costs.update(config.get('security.rate_limit.costs', {}) or {})
+        self._default_cost = float(self.costs.get('default', 1))
+        self.throttle_max_delay = float(config.get('security.rate_limit.throttle_max_delay', 0.5))
+        self.max_violations = int(config.get('security.rate_limit.max_violations', 30))
+        self.violation_window = float(config.get('security.rate_limit.violation_window', 10))
+        self.exempt_ips = frozenset(config.get('security.rate_limit.exempt_ips', []) or [])
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._last_prune = time.monotonic()
+        _tracked_buckets.set_function(lambda: len(self._buckets))
+
+    def new_session_state(self) -> SessionRateState:
+        if not self.enabled:
+            return SessionRateState(None)
+        rate, burst = self._limits[SCOPE_SESSION]
+        return SessionRateState(TokenBucket(rate, burst, time.monotonic()))
+
+    def _bucket(self, scope: str, key: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get((scope, key))
+        if bucket is None:
+            rate, burst = self._limits[scope]
+            bucket = self._buckets[(scope, key)] = TokenBucket(rate, burst, now)
+        return bucket
+
+    def _prune(self, now: float):
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for key in [key for key, bucket in self._buckets.items() if bucket.is_idle(now)]:
+            del self._buckets[key]
+
+    def check(self, state: SessionRateState, msg_type: str, ip: Optional[str], username: Optional[str]) -> Tuple[str, float]:
+        """
+        为一条消息扣除令牌，返回 (结果, 秒数)。
+        THROTTLE 时调用方应等待返回的秒数后再处理消息 (令牌已预扣)；
+        REJECT 时返回的秒数为建议的重试等待时间。
+        """
+        if state.bucket is None:
+            return ALLOW, 0.0
+        now = time.monotonic()
+        self._prune(now)
+        cost = self.costs.get(msg_type, self._default_cost)
+        if cost <= 0:
+            return ALLOW, 0.0
+
+        buckets = [(SCOPE_SESSION, state.bucket)]
+        if username:
+            buckets.append((SCOPE_USER, self._bucket(SCOPE_USER, username, now)))
+        if ip and ip not in self.exempt_ips:
+            buckets.append((SCOPE_IP, self._bucket(SCOPE_IP, ip, now)))
+
+        wait, limiting_scope = 0.0, SCOPE_SESSION
+        for scope, bucket in buckets:
+            bucket.refill(now)
+            deficit = bucket.deficit_time(cost)
+            if deficit > wait:
+                wait, limiting_scope = deficit, scope
+
+        if wait <= 0:
+            for _, bucket in buckets:
+                bucket.tokens -= cost
+            return ALLOW, 0.0
+
+        # 被延迟和被丢弃的消息都计为违规，持续超速的连接最终会被断开
+        if now - state.window_start > self.violation_window:
+            state.window_start = now
+            state.violations = 0
+        state.violations += 1
+        if state.violations >= self.max_violations:
+            _limited.labels(limiting_scope, DISCONNECT).inc()
+            _disconnects.inc()
+            return DISCONNECT, wait
+        if wait <= self.throttle_max_delay:
+            # 短时间内可补齐: 预扣 (允许暂时为负)，由调用方等待后处理
+            for _, bucket in buckets:
+                bucket.tokens -= cost
+            _limited.labels(limiting_scope, THROTTLE).inc()
+            return THROTTLE, wait
+        _limited.labels(limiting_scope, REJECT).inc()
+        return REJECT, wait
+
+
+def peer_ip(peername) -> Optional[str]:
+    """TCP 的 peername 为 (host, port, ...)，WebSocket 为 request.remote 字符串"""
+    if isinstance(peername, (tuple, list)):
+        return str(peername[0]) if peername else None
+    return peername or None
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,136 @@
+# server/utils/replay.py
+"""
+频道事件序号与重放日志
+
+每条频道广播在投递前获得该频道内单调递增的序号 (消息顶层的 seq 字段)，
+并在日志中保留最近 max_events 条、不超过 max_age 秒的事件。
+断线重连的客户端在 auth_request (action: resume) 中带上
+    "replay": {"epoch": ..., "channel_id": ..., "seq": 最后收到的序号}
+若 epoch 与本进程一致且缺口仍在日志范围内，服务器只补发缺失的事件，
+否则回退为完整的历史与用户列表快照。
+
+序号由每个节点 (进程) 独立分配: 本节点的广播和经背板收到的其它节点的广播都在本地编号，
+epoch 在进程启动时随机生成。客户端重连到其它节点或进程重启后 epoch 不同，总是回退为快照。
+"""
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from .config import config
+from . import protocol as proto
+from . import metrics
+
+RESULT_REPLAYED = 'replayed'
+RESULT_EPOCH = 'epoch_mismatch'
+RESULT_GAP = 'gap'
+
+_resumes = metrics.registry.counter('replay_resumes_total', '带序号恢复频道的次数', ('result',))
+_replayed_events = metrics.registry.counter('replay_events_total', '重连时补发的频道事件数')
+
+
+class ReplayEvent:
+    """
+    日志中的一条事件: 已序列化的消息 (message)，或按接收者语言渲染的本地化系统消息 (key/level/kwargs)。
+    exclude 为广播时被排除的用户名 (小写)，重放时同样跳过。
+    """
+    __slots__ = ('seq', 'created', 'message', 'key', 'level', 'kwargs', 'exclude')
+
+    def __init__(self, seq: int, message: Optional[str] = None, key: Optional[str] = None,
+                 level: str = 'info', kwargs: Optional[dict] = None, exclude: Optional[str] = None):
+        self.seq = seq
+        self.created = time.monotonic()
+        self.message = message
+        self.key = key
+        self.level = level
+        self.kwargs = kwargs
+        self.exclude = exclude
+
+    def render(self, session) -> Optional[str]:
+        """为某个会话生成带序号的消息，该会话被排除时返回 None"""
+        if self.exclude and session.user and session.user.username.lower() == self.exclude:
+            return None
+        if self.message is not None:
+            return self.message
+        return proto.with_sequence(proto.create_system_message(session.t(self.key, **self.kwargs), level=self.level), self.seq)
+
+
+class _ChannelLog:
+    __slots__ = ('seq', 'events')
+
+    def __init__(self, max_events: int):
+        self.seq = 0
+        self.events: Deque[ReplayEvent] = deque(maxlen=max_events)
+
+
+class ReplayLog:
+    def __init__(self):
+        self.enabled = config.get('server.replay.enabled', True)
+        self.max_events = max(1, int(config.get('server.replay.max_events', 256)))
+        self.max_age = float(config.get('server.replay.max_age', 300))
+        self.epoch = uuid.uuid4().hex[:12]
+        self._channels: Dict[int, _ChannelLog] = {}
+
+    def _log(self, channel_id: int) -> _ChannelLog:
+        log = self._channels.get(channel_id)
+        if log is None:
+            log = self._channels[channel_id] = _ChannelLog(self.max_events)
+        return log
+
+    def current_seq(self, channel_id: int) -> int:
+        log = self._channels.get(channel_id)
+        return log.seq if log else 0
+
+    def append(self, channel_id: int, message: str, exclude: Optional[str] = None) -> str:
+        """为已序列化的频道广播编号并记录，返回带序号的消息"""
+        if not self.enabled:
+            return message
+        log = self._log(channel_id)
+        log.seq += 1
+        message = proto.with_sequence(message, log.seq)
+        log.events.append(ReplayEvent(log.seq, message=message, exclude=exclude))
+        return message
+
+    def append_localized(self, channel_id: int, key: str, level: str, kwargs: dict, exclude: Optional[str] = None) -> Optional[int]:
+        """为本地化系统消息编号并记录，返回序号 (调用方按语言渲染后用 with_sequence 附加)"""
+        if not self.enabled:
+            return None
+        log = self._log(channel_id)
+        log.seq += 1
+        log.events.append(ReplayEvent(log.seq, key=key, level=level, kwargs=kwargs, exclude=exclude))
+        return log.seq
+
+    def since(self, channel_id: int, seq: int) -> Optional[List[ReplayEvent]]:
+        """返回序号大于 seq 的全部事件；缺口超出日志范围 (或序号无效) 时返回 None"""
+        log = self._channels.get(channel_id)
+        current = log.seq if log else 0
+        if seq < 0 or seq > current:
+            return None
+        if seq == current:
+            return []
+        events = log.events
+        cutoff = time.monotonic() - self.max_age
+        while events and events[0].created < cutoff:
+            events.popleft()
+        if not events or seq < events[0].seq - 1:
+            return None
+        # 序号连续，可直接按偏移定位
+        return list(events)[seq - events[0].seq + 1:]
+
+    def can_resume(self, epoch: Optional[str], channel_id: int, seq: int) -> bool:
+        """校验客户端的恢复请求并记录结果指标，返回 False 表示需要回退为快照"""
+        if not self.enabled or epoch != self.epoch:
+            _resumes.labels(RESULT_EPOCH).inc()
+            return False
+        resumable = self.since(channel_id, seq) is not None
+        _resumes.labels(RESULT_REPLAYED if resumable else RESULT_GAP).inc()
+        return resumable
+
+    def record_replayed(self, count: int):
+        _replayed_events.inc(count)
+
+    def drop(self, channel_id: int):
+        self._channels.pop(channel_id, None)
+
+
+replay_log = ReplayLog()
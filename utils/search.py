@@ -0,0 +1,292 @@
+# server/utils/search.py
+"""
+基于 SQLite FTS5 的消息全文搜索
+
+索引表 messages_fts 由迁移 0012/0016 创建并由触发器维护，rowid 即 messages.id，文件消息按文件名索引；
+channel 列保存 '#<频道 ID>#'，频道条件写在 MATCH 表达式中，只遍历目标频道的命中。
+查询词按空白拆分，每个词作为一个短语 (FTS5 语法字符被转义)，所有词都须命中。
+排序:
+  - recent: 按消息 id 倒序，FTS5 按 rowid 倒序遍历命中，取满一页即停止，游标为 id；
+  - rank:   取该频道最近的 rank_candidates 条命中，在 Python 中按 BM25 的词频与长度归一化打分排序
+            (所有候选都包含全部查询词，省略 IDF)，游标为 (score, id)。
+            FTS5 的 bm25() 要统计每个短语在全表的命中数，百万级消息时单次查询需要上百毫秒，因此不用它；
+            相关度只在最近的候选中比较，更早的结果请用 recent 排序翻页。
+            每一页都重新取候选并打分，键集游标只用于跳过已返回的结果，并不减少每页的开销。
+trigram 分词下不足 3 个字符的词无法走索引: 与长词同时出现时只在长词的命中上用 LIKE 过滤；
+整个查询都由短词组成时按 recent 排序，沿 (channel_id, id) 索引每次最多扫描 short_term_window 条消息，
+窗口内未取满一页时游标指向窗口末尾，下一页从那里继续扫描 (因此一页的结果可能少于 limit，甚至为空)。
+"""
+import base64
+import html
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import config
+from .database import db_manager
+from . import metrics
+
+ORDER_RANK = 'rank'
+ORDER_RECENT = 'recent'
+ORDERS = (ORDER_RANK, ORDER_RECENT)
+
+# 摘要中的高亮标记: 先用私用区字符占位，转义 HTML 后再替换为 <mark>
+_MARK_START = '\ue000'
+_MARK_END = '\ue001'
+_ELLIPSIS = '…'
+TRIGRAM_MIN_LENGTH = 3
+
+# BM25 参数
+_K1 = 1.2
+_B = 0.75
+
+_searches = metrics.registry.counter('message_searches_total', '消息搜索次数', ('order',))
+
+# 与 messages_fts.body 相同的被索引文本 (迁移 0016)，短词扫描时直接在 messages 上计算，省去逐行查 FTS 表
+_INDEXED_TEXT = """(CASE WHEN json_valid(m.content) AND json_extract(m.content, '$.type') = 'file'
+    THEN json_extract(m.content, '$.name') ELSE m.content END)"""
+
+_RESULT_COLUMNS = """
+    m.channel_id, m.content, m.timestamp, m.username,
+    u.username AS sender_username, u.display_name AS sender_display_name, u.avatar_filename
+"""
+
+
+class SearchError(ValueError):
+    """查询或游标无效，错误信息可直接返回给客户端"""
+    pass
+
+
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_pattern(term: str) -> str:
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _channel_phrase(channel_id: int) -> str:
+    return f'channel : "#{int(channel_id)}#"'
+
+
+def _score(body: str, terms: List[str], avg_length: float) -> float:
+    """BM25 的词频与文档长度归一化部分 (不含 IDF)，词频按不区分大小写的子串计数，与 trigram 匹配一致"""
+    text = body.lower()
+    norm = _K1 * (1 - _B + _B * len(text) / avg_length) if avg_length else _K1
+    score = 0.0
+    for term in terms:
+        tf = text.count(term.lower())
+        score += tf * (_K1 + 1) / (tf + norm)
+    return round(score, 6)
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, order: str) -> Tuple:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if order == ORDER_RANK:
+            rank, message_id = values
+            return float(rank), int(message_id)
+        message_id, = values
+        return int(message_id),
+    except (ValueError, TypeError):
+        raise SearchError("无效的分页游标")
+
+
+def render_snippet(marked: str) -> str:
+    """把带占位标记的摘要转义为可直接插入页面的 HTML"""
+    return html.escape(marked).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def _mark_terms(text: str, terms: List[str], width: int) -> str:
+    """LIKE 查询没有 snippet()，在 Python 中截取第一个命中附近的文本并标记所有命中"""
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    first = pattern.search(text)
+    start = max(0, first.start() - width // 2) if first else 0
+    end = min(len(text), start + width)
+    fragment = pattern.sub(lambda m: _MARK_START + m.group(0) + _MARK_END, text[start:end])
+    return (_ELLIPSIS if start > 0 else '') + fragment + (_ELLIPSIS if end < len(text) else '')
+
+
+class MessageSearch:
+    def __init__(self):
+        self.default_limit = int(config.get('search.default_limit', 20))
+        self.max_limit = int(config.get('search.max_limit', 50))
+        self.max_terms = int(config.get('search.max_terms', 8))
+        self.max_query_length = int(config.get('search.max_query_length', 200))
+        self.snippet_tokens = max(1, min(64, int(config.get('search.snippet_tokens', 16))))
+        self.rank_candidates = max(1, int(config.get('search.rank_candidates', 200)))
+        self.short_term_window = max(1, int(config.get('search.short_term_window', 5000)))
+        self._trigram: Optional[bool] = None
+
+    async def _uses_trigram(self) -> bool:
+        if self._trigram is None:
+            sql = await db_manager.fetchval("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")
+            if sql is None:
+                raise SearchError("消息搜索不可用")
+            self._trigram = 'trigram' in sql
+        return self._trigram
+
+    def _parse_terms(self, query: str) -> List[str]:
+        if not isinstance(query, str) or not query.strip():
+            raise SearchError("搜索内容不能为空")
+        if len(query) > self.max_query_length:
+            raise SearchError(f"搜索内容不能超过 {self.max_query_length} 个字符")
+        terms = list(dict.fromkeys(query.split()))
+        if len(terms) > self.max_terms:
+            raise SearchError(f"搜索词不能超过 {self.max_terms} 个")
+        return terms
+
+    def clamp_limit(self, limit: Any) -> int:
+        try:
+            limit = int(limit) if limit is not None else self.default_limit
+        except (TypeError, ValueError):
+            raise SearchError("无效的 limit 参数")
+        return max(1, min(self.max_limit, limit))
+
+    async def search(self, channel_id: int, query: str, limit: Any = None,
+                     cursor: Optional[str] = None, order: str = ORDER_RANK) -> Dict[str, Any]:
+        """
+        在频道内搜索消息，返回 {"results": [...], "next_cursor": str|None, "order": str}。
+        每条结果包含消息原文 (message) 和 HTML 安全的高亮摘要 (snippet)。
+        """
+        if order not in ORDERS:
+            raise SearchError(f"无效的排序方式，可选: {', '.join(ORDERS)}")
+        terms = self._parse_terms(query)
+        limit = self.clamp_limit(limit)
+
+        if await self._uses_trigram():
+            match_terms = [term for term in terms if len(term) >= TRIGRAM_MIN_LENGTH]
+            like_terms = [term for term in terms if len(term) < TRIGRAM_MIN_LENGTH]
+        else:
+            match_terms, like_terms = terms, []
+        position = decode_cursor(cursor, order if match_terms else ORDER_RECENT) if cursor else None
+
+        if not match_terms:
+            order = ORDER_RECENT
+            rows, next_position = await self._scan_window(channel_id, like_terms, limit, position)
+        elif order == ORDER_RECENT:
+            rows, next_position = await self._match_recent(channel_id, match_terms, like_terms, limit, position)
+        else:
+            rows, next_position = await self._match_ranked(channel_id, terms, match_terms, like_terms, limit, position)
+        _searches.labels(order).inc()
+
+        highlight_terms = terms if not match_terms else like_terms
+        results = []
+        for row in rows:
+            snippet = row['snippet'] or ''
+            if highlight_terms:
+                if match_terms:
+                    # snippet() 只标记 MATCH 的词，短词另行标记
+                    snippet = re.sub('|'.join(re.escape(term) for term in highlight_terms),
+                                     lambda m: _MARK_START + m.group(0) + _MARK_END, snippet, flags=re.IGNORECASE)
+                else:
+                    snippet = _mark_terms(snippet, highlight_terms, self.snippet_tokens * 4)
+            username = row['sender_username'] or row['username']
+            results.append({
+                "id": row['id'],
+                "channel_id": row['channel_id'],
+                "sender_username": username,
+                "sender_display_name": row['sender_display_name'] or username,
+                "avatar_url": f"/uploads/avatars/{row['avatar_filename']}" if row['avatar_filename'] else None,
+                "message": row['content'],
+                "timestamp": row['timestamp'],
+                "snippet": render_snippet(snippet),
+            })
+
+        next_cursor = encode_cursor(next_position) if next_position else None
+        return {"results": results, "next_cursor": next_cursor, "order": order}
+
+    def _match_query(self, channel_id: int, match_terms: List[str], like_terms: List[str]) -> Tuple[str, List[Any]]:
+        """MATCH 表达式 (含频道条件) 与短词的 LIKE 条件"""
+        match = ' AND '.join([_channel_phrase(channel_id)] + [f'body : {_fts_phrase(term)}' for term in match_terms])
+        where = ["messages_fts MATCH ?"]
+        params: List[Any] = [match]
+        for term in like_terms:
+            where.append("f.body LIKE ? ESCAPE '\\'")
+            params.append(_like_pattern(term))
+        return ' AND '.join(where), params
+
+    def _snippet_sql(self) -> str:
+        return f"snippet(messages_fts, 0, '{_MARK_START}', '{_MARK_END}', '{_ELLIPSIS}', {self.snippet_tokens})"
+
+    async def _match_recent(self, channel_id: int, match_terms: List[str], like_terms: List[str],
+                            limit: int, position: Optional[Tuple]) -> Tuple[List[Dict[str, Any]], Optional[list]]:
+        where, params = self._match_query(channel_id, match_terms, like_terms)
+        if position:
+            where += " AND f.rowid < ?"
+            params.append(position[0])
+        params.append(limit + 1)
+        rows = await db_manager.fetchall(f"""
+            SELECT f.rowid AS id, {self._snippet_sql()} AS snippet, {_RESULT_COLUMNS}
+            FROM messages_fts f
+            JOIN messages m ON m.id = f.rowid
+            LEFT JOIN users u ON u.id = m.user_id
+            WHERE {where}
+            ORDER BY f.rowid DESC
+            LIMIT ?
+        """, tuple(params))
+        if len(rows) > limit:
+            return rows[:limit], [rows[limit - 1]['id']]
+        return rows, None
+
+    async def _match_ranked(self, channel_id: int, terms: List[str], match_terms: List[str], like_terms: List[str],
+                            limit: int, position: Optional[Tuple]) -> Tuple[List[Dict[str, Any]], Optional[list]]:
+        where, params = self._match_query(channel_id, match_terms, like_terms)
+        params.append(self.rank_candidates)
+        candidates = await db_manager.fetchall(f"""
+            SELECT f.rowid AS id, f.body, {self._snippet_sql()} AS snippet, {_RESULT_COLUMNS}
+            FROM messages_fts f
+            JOIN messages m ON m.id = f.rowid
+            LEFT JOIN users u ON u.id = m.user_id
+            WHERE {where}
+            ORDER BY f.rowid DESC
+            LIMIT ?
+        """, tuple(params))
+        if not candidates:
+            return [], None
+        avg_length = sum(len(row['body'] or '') for row in candidates) / len(candidates)
+        for row in candidates:
+            row['score'] = _score(row['body'] or '', terms, avg_length)
+        candidates.sort(key=lambda row: (-row['score'], -row['id']))
+        if position:
+            score, message_id = position
+            candidates = [row for row in candidates if (-row['score'], -row['id']) > (-score, -message_id)]
+        if len(candidates) > limit:
+            last = candidates[limit - 1]
+            return candidates[:limit], [last['score'], last['id']]
+        return candidates, None
+
+    async def _scan_window(self, channel_id: int, like_terms: List[str], limit: int,
+                           position: Optional[Tuple]) -> Tuple[List[Dict[str, Any]], Optional[list]]:
+        """只有短词时沿 (channel_id, id) 索引从游标处向前扫描至多 short_term_window 条消息"""
+        before = position[0] if position else 2 ** 63 - 1
+        # 窗口中最早的一条消息，None 表示剩余的消息不足一个窗口
+        bound = await db_manager.fetchval(
+            "SELECT id FROM messages WHERE channel_id = ? AND id < ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+            (channel_id, before, self.short_term_window - 1)
+        )
+        where = ["m.channel_id = ?", "m.id < ?", "m.id >= ?"]
+        params: List[Any] = [channel_id, before, bound or 0]
+        for term in like_terms:
+            where.append(f"{_INDEXED_TEXT} LIKE ? ESCAPE '\\'")
+            params.append(_like_pattern(term))
+        params.append(limit + 1)
+        rows = await db_manager.fetchall(f"""
+            SELECT m.id, {_INDEXED_TEXT} AS snippet, {_RESULT_COLUMNS}
+            FROM messages m
+            LEFT JOIN users u ON u.id = m.user_id
+            WHERE {' AND '.join(where)}
+            ORDER BY m.id DESC
+            LIMIT ?
+        """, tuple(params))
+        if len(rows) > limit:
+            return rows[:limit], [rows[limit - 1]['id']]
+        # 窗口已扫描完而更早的消息还未扫描，下一页从窗口末尾继续
+        return rows, [bound] if bound else None
+
+
+message_search = MessageSearch()
@@ -1,4 +1,5 @@
 # server/utils/security.py
+import asyncio
 import bcrypt
 import ssl
 import logging
@@ -6,6 +7,7 @@ import os
 from typing import Optional
 
 from .config import config
+from .metrics import bcrypt_queue_depth
 
 def hash_password(password: str) -> Optional[str]:
     try:
@@ -25,6 +27,20 @@ def check_password(password: str, hashed_password: str) -> bool:
     except Exception:
         return False
 
+async def _run_bcrypt(func, *args):
+    """在线程池中执行 bcrypt 计算，并记录排队深度"""
+    bcrypt_queue_depth.inc()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+    finally:
+        bcrypt_queue_depth.dec()
+
+async def hash_password_async(password: str) -> Optional[str]:
+    return await _run_bcrypt(hash_password, password)
+
+async def check_password_async(password: str, hashed_password: str) -> bool:
+    return await _run_bcrypt(check_password, password, hashed_password)
+
 # 新增: 将 SSL 上下文创建逻辑移到这里
 def create_ssl_context_from_path(tls_config_path: str) -> ssl.SSLContext | None:
     """根据配置文件中的路径创建 SSL 上下文"""
@@ -0,0 +1,234 @@
+# server/utils/supervisor.py
+"""
+多进程 (SO_REUSEPORT) 模式的主管进程
+
+server.workers > 1 时，main.py 不直接运行服务器，而是由 Supervisor:
+  1. 在主管进程中执行一次数据库迁移和初始化 (角色、内置管理员、默认频道)；
+  2. 启动 N 个工作进程 (重新执行 main.py，并设置 CHATROOM_WORKER_ID)，
+     每个工作进程都以 SO_REUSEPORT 绑定相同的 Web/TCP 端口，由内核分配连接；
+  3. 工作进程之间通过 SQLite 数据库和 unix 背板 (utils/backplane.py) 共享状态；
+  4. 工作进程异常退出时自动重启；收到 SIGHUP 时逐个滚动重启
+     (先启动新进程并等待其就绪，再让旧进程优雅退出)；
+  5. 收到 SIGTERM/SIGINT 时通知所有工作进程退出并等待。
+
+单进程模式下也可以通过 spawn_successor() 把监听套接字交给新启动的进程
+(SIGUSR2)，新进程就绪后旧进程再排空退出，期间端口始终有进程在监听。
+"""
+import asyncio
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, Optional
+
+WORKER_ID_ENV = 'CHATROOM_WORKER_ID'
+READY_FD_ENV = 'CHATROOM_READY_FD'
+INHERITED_FDS_ENV = 'CHATROOM_INHERITED_FDS'
+
+
+def is_worker() -> bool:
+    return WORKER_ID_ENV in os.environ
+
+
+def worker_id() -> Optional[int]:
+    value = os.environ.get(WORKER_ID_ENV)
+    return int(value) if value is not None else None
+
+
+def reuse_port_supported() -> bool:
+    return hasattr(socket, 'SO_REUSEPORT')
+
+
+def notify_ready():
+    """工作进程在所有监听端口就绪后调用，通知主管进程"""
+    fd = os.environ.get(READY_FD_ENV)
+    if fd is None:
+        return
+    try:
+        os.write(int(fd), b'1')
+        os.close(int(fd))
+    except OSError:
+        pass
+    os.environ.pop(READY_FD_ENV, None)
+
+
+def create_listen_socket(name: str, host: str, port: int, reuse_port: bool = False, backlog: Optional[int] = None) -> socket.socket:
+    """优先使用从上一个进程继承的监听套接字，否则新建并绑定"""
+    inherited = inherited_socket(name)
+    if inherited is not None:
+        return inherited
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    return socket.create_server((host, port), family=family, backlog=backlog, reuse_port=reuse_port)
+
+
+def inherited_socket(name: str) -> Optional[socket.socket]:
+    spec = os.environ.get(INHERITED_FDS_ENV, '')
+    for item in spec.split(','):
+        item_name, _, fd = item.partition(':')
+        if item_name == name and fd.isdigit():
+            sock = socket.socket(fileno=int(fd))
+            logging.info(f"使用继承的监听套接字 '{name}' (fd {fd})")
+            return sock
+    return None
+
+
+def _wait_for_ready(process: subprocess.Popen, ready_fd: int, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or process.poll() is not None:
+            return False
+        readable, _, _ = select.select([ready_fd], [], [], min(remaining, 0.5))
+        if readable:
+            return os.read(ready_fd, 1) == b'1'
+
+
+def spawn_successor(sockets: Dict[str, socket.socket], ready_timeout: float = 30.0) -> bool:
+    """
+    以相同参数启动新进程并把监听套接字传给它 (阻塞调用)，返回新进程是否已就绪。
+    调用方在返回 True 后应排空并退出。
+    """
+    ready_r, ready_w = os.pipe()
+    env = dict(os.environ)
+    env[READY_FD_ENV] = str(ready_w)
+    env[INHERITED_FDS_ENV] = ','.join(f"{name}:{sock.fileno()}" for name, sock in sockets.items())
+    fds = (ready_w,) + tuple(sock.fileno() for sock in sockets.values())
+    process = subprocess.Popen([sys.executable] + sys.argv, env=env, pass_fds=fds)
+    os.close(ready_w)
+    logging.info(f"已启动接替进程 (pid {process.pid})，等待其就绪...")
+    try:
+        ready = _wait_for_ready(process, ready_r, ready_timeout)
+    finally:
+        os.close(ready_r)
+    if not ready:
+        logging.error("接替进程未能就绪，继续由当前进程提供服务")
+        if process.poll() is None:
+            process.terminate()
+    return ready
+
+
+class _Worker:
+    def __init__(self, slot: int, process: subprocess.Popen, ready_fd: int):
+        self.slot = slot
+        self.process = process
+        self.ready_fd = ready_fd
+        self.started_at = time.monotonic()
+
+
+class Supervisor:
+    def __init__(self, num_workers: int, ready_timeout: float = 30.0, stop_timeout: float = 30.0):
+        self.num_workers = num_workers
+        self.ready_timeout = ready_timeout
+        self.stop_timeout = stop_timeout
+        self.workers: Dict[int, _Worker] = {}
+        self._stopping = False
+        self._restart_requested = False
+        self._restart_backoff: Dict[int, float] = {}
+
+    def _spawn(self, slot: int) -> _Worker:
+        ready_r, ready_w = os.pipe()
+        env = dict(os.environ)
+        env[WORKER_ID_ENV] = str(slot)
+        env[READY_FD_ENV] = str(ready_w)
+        process = subprocess.Popen([sys.executable] + sys.argv, env=env, pass_fds=(ready_w,))
+        os.close(ready_w)
+        logging.info(f"[主管] 已启动工作进程 #{slot} (pid {process.pid})")
+        return _Worker(slot, process, ready_r)
+
+    def _wait_ready(self, worker: _Worker) -> bool:
+        try:
+            return _wait_for_ready(worker.process, worker.ready_fd, self.ready_timeout)
+        finally:
+            os.close(worker.ready_fd)
+            worker.ready_fd = -1
+
+    def _stop_worker(self, worker: _Worker):
+        if worker.process.poll() is None:
+            worker.process.terminate()
+            try:
+                worker.process.wait(self.stop_timeout)
+            except subprocess.TimeoutExpired:
+                logging.warning(f"[主管] 工作进程 #{worker.slot} (pid {worker.process.pid}) 未在 {self.stop_timeout} 秒内退出，强制结束")
+                worker.process.kill()
+                worker.process.wait()
+        if worker.ready_fd >= 0:
+            os.close(worker.ready_fd)
+            worker.ready_fd = -1
+
+    def _start_slot(self, slot: int) -> bool:
+        worker = self._spawn(slot)
+        self.workers[slot] = worker
+        if self._wait_ready(worker):
+            logging.info(f"[主管] 工作进程 #{slot} 已就绪")
+            return True
+        logging.error(f"[主管] 工作进程 #{slot} 未能就绪")
+        return False
+
+    def _rolling_restart(self):
+        logging.info("[主管] 开始滚动重启工作进程")
+        for slot in range(self.num_workers):
+            if self._stopping:
+                return
+            old = self.workers.get(slot)
+            new = self._spawn(slot)
+            if not self._wait_ready(new):
+                logging.error(f"[主管] 新的工作进程 #{slot} 未能就绪，保留旧进程并中止滚动重启")
+                self._stop_worker(new)
+                return
+            self.workers[slot] = new
+            if old:
+                self._stop_worker(old)
+            logging.info(f"[主管] 工作进程 #{slot} 已替换 (pid {new.process.pid})")
+        logging.info("[主管] 滚动重启完成")
+
+    def _reap(self):
+        for slot, worker in list(self.workers.items()):
+            code = worker.process.poll()
+            if code is None or self._stopping:
+                continue
+            # 启动后很快退出的进程按指数退避重启，避免崩溃循环
+            uptime = time.monotonic() - worker.started_at
+            backoff = self._restart_backoff.get(slot, 0.5)
+            backoff = min(backoff * 2, 30.0) if uptime < 10 else 0.5
+            self._restart_backoff[slot] = backoff
+            logging.warning(f"[主管] 工作进程 #{slot} (pid {worker.process.pid}) 以状态 {code} 退出，{backoff:.1f} 秒后重启")
+            time.sleep(backoff)
+            self._start_slot(slot)
+
+    def _on_stop_signal(self, signum, frame):
+        self._stopping = True
+
+    def _on_restart_signal(self, signum, frame):
+        self._restart_requested = True
+
+    def run(self, bootstrap):
+        """bootstrap 为在启动工作进程之前执行一次的协程函数 (迁移、初始化等)"""
+        asyncio.run(bootstrap())
+
+        signal.signal(signal.SIGTERM, self._on_stop_signal)
+        signal.signal(signal.SIGINT, self._on_stop_signal)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._on_restart_signal)
+
+        logging.info(f"[主管] 以 {self.num_workers} 个工作进程运行 (pid {os.getpid()})，发送 SIGHUP 可滚动重启")
+        for slot in range(self.num_workers):
+            self._start_slot(slot)
+
+        while not self._stopping:
+            if self._restart_requested:
+                self._restart_requested = False
+                self._rolling_restart()
+            self._reap()
+            time.sleep(0.5)
+
+        logging.info("[主管] 正在停止所有工作进程...")
+        for worker in self.workers.values():
+            if worker.process.poll() is None:
+                worker.process.terminate()
+        for worker in self.workers.values():
+            self._stop_worker(worker)
+        logging.info("[主管] 所有工作进程已退出")
@@ -0,0 +1,136 @@
+# server/utils/timerwheel.py
+"""
+分层时间轮
+
+所有会话的认证期限、空闲超时和心跳都登记在同一个时间轮上，由一个后台任务每 tick 秒推进一次、
+批量触发到期的定时器，而不是每个连接各自持有 (并随每条消息重建) 一个 asyncio 定时器。
+
+时间轮共 levels 层，每层 slots 个槽: 第 0 层每槽 1 个 tick，第 n 层每槽 slots**n 个 tick。
+定时器按距到期的 tick 数放入能容纳它的最低一层；低一层转完一圈时，把高一层当前槽中的定时器
+重新分配到低层 (cascade)。插入和取消都是 O(1)，取消只做标记，到期时跳过。
+超出最高层范围的定时器暂存在 overflow 中，每转完一整圈重新分配一次。
+触发精度为一个 tick: 定时器在到期后的第一个 tick 边界触发。
+"""
+import asyncio
+import logging
+import math
+import time
+from typing import Callable, List, Optional
+
+from .config import config
+from . import metrics
+
+TimerCallback = Callable[[float], None]
+
+_expired = metrics.registry.counter('timer_wheel_expired_total', '时间轮触发的定时器数')
+_pending = metrics.registry.gauge('timer_wheel_pending', '时间轮中登记的定时器数 (含已取消未清理的)')
+
+
+class TimerEntry:
+    __slots__ = ('deadline', 'callback', 'cancelled')
+
+    def __init__(self, deadline: float, callback: TimerCallback):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 4):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._wheels: List[List[List[TimerEntry]]] = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._overflow: List[TimerEntry] = []
+        # 已处理到的 tick 序号
+        self._current = int(time.monotonic() / tick)
+        self._size = 0
+        self._task: Optional[asyncio.Task] = None
+        _pending.set_function(lambda: self._size)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def schedule(self, deadline: float, callback: TimerCallback) -> TimerEntry:
+        """登记在 deadline (time.monotonic() 时间) 调用 callback(now)，返回可取消的条目"""
+        entry = TimerEntry(deadline, callback)
+        self._insert(entry)
+        self._size += 1
+        return entry
+
+    def _insert(self, entry: TimerEntry, earliest: Optional[int] = None):
+        # 当前 tick 的槽已处理过，新登记的定时器最早在下一个 tick 触发；cascade 时当前槽尚未处理
+        expiry = max(math.ceil(entry.deadline / self.tick), self._current + 1 if earliest is None else earliest)
+        delta = expiry - self._current
+        span = self.slots
+        for level in range(self.levels):
+            if delta < span:
+                self._wheels[level][(expiry * self.slots // span) % self.slots].append(entry)
+                return
+            span *= self.slots
+        self._overflow.append(entry)
+
+    def _cascade(self, tick: int):
+        span = 1
+        for level in range(1, self.levels + 1):
+            span *= self.slots
+            if tick % span:
+                return
+            if level == self.levels:
+                entries, self._overflow = self._overflow, []
+            else:
+                index = (tick // span) % self.slots
+                entries, self._wheels[level][index] = self._wheels[level][index], []
+            for entry in entries:
+                if entry.cancelled:
+                    self._size -= 1
+                else:
+                    self._insert(entry, earliest=tick)
+
+    def advance(self, now: Optional[float] = None) -> int:
+        """推进到 now，触发所有到期的定时器，返回触发的个数"""
+        now = time.monotonic() if now is None else now
+        target = int(now / self.tick)
+        fired = 0
+        while self._current < target:
+            self._current += 1
+            self._cascade(self._current)
+            index = self._current % self.slots
+            entries, self._wheels[0][index] = self._wheels[0][index], []
+            self._size -= len(entries)
+            for entry in entries:
+                if entry.cancelled:
+                    continue
+                fired += 1
+                try:
+                    entry.callback(now)
+                except Exception as e:
+                    logging.error(f"时间轮定时器回调出错: {e}", exc_info=True)
+        if fired:
+            _expired.inc(fired)
+        return fired
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            # 对齐到下一个 tick 边界
+            await asyncio.sleep(self.tick - time.monotonic() % self.tick)
+            self.advance()
+
+
+timer_wheel = TimerWheel(tick=float(config.get('server.timer_wheel_tick', 1.0)))
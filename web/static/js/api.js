@@ -25,7 +25,7 @@ export async function uploadAvatar(file) {
 
         if (response.ok) {
             ui.showNotificationBar('头像上传成功！', false);
-            // 后端会通过 WebSocket 广播 user_list_update，UI 会自动更新
+            // 后端会通过 WebSocket 推送 channel_member_update，UI 会自动更新
         } else {
             throw new Error(result.error || '上传失败');
         }
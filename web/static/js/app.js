@@ -12,20 +12,59 @@ const config = {
 
 export { config };
 
+// 服务器可选能力: 用户列表以列式紧凑编码下发；短时间内的多条消息合并为一个 batch 帧
+const CLIENT_CAPABILITIES = ['compact_user_list', 'batch'];
+
+function renderUnreadBadges() {
+    const store = getStore();
+    Object.entries(store.unread).forEach(([channelId, count]) => ui.updateChannelUnread(channelId, count, store.unreadMaxCount));
+}
+
+function decodeUserList(payload) {
+    if (payload.users_compact) {
+        const { fields, rows } = payload.users_compact;
+        return rows.map(row => Object.fromEntries(fields.map((field, i) => [field, row[i]])));
+    }
+    return payload.users;
+}
+
+function updateMemberPaging(payload) {
+    const store = getStore();
+    store.members.cursor = payload.members_cursor;
+    store.members.loading = false;
+    if (payload.member_count !== undefined) {
+        store.members.count = payload.member_count;
+    }
+}
+
 // --- WebSocket 消息处理器 ---
 function handleAppWebSocketMessage(event) {
-    const store = getStore();
     const message = JSON.parse(event.data);
+    if (message.type === 'batch') {
+        message.payload.messages.forEach(handleServerMessage);
+        return;
+    }
+    handleServerMessage(message);
+}
+
+function handleServerMessage(message) {
+    const store = getStore();
 
     if (config.debug) {
         console.log('RECV:', message);
     }
+
+    // 频道广播带有序号，记录最后收到的序号
+    if (typeof message.seq === 'number' && store.replay) {
+        store.replay.seq = message.seq;
+    }
     
     const voiceSignalTypes = [
         'join_voice_success',
         'user_joined_voice',
         'user_left_voice',
-        'webrtc_signal'
+        'webrtc_signal',
+        'active_speakers'
     ];
     if (voiceSignalTypes.includes(message.type)) {
         webrtc.handleSignalingMessage(message);
@@ -34,7 +73,11 @@ function handleAppWebSocketMessage(event) {
 
     switch (message.type) {
         case 'auth_success':
-            const { user } = message.payload;
+            const { user, token, token_ttl } = message.payload;
+            if (token && token_ttl) {
+                // 服务器端令牌的有效期随使用顺延，每次恢复会话时同步延长 cookie
+                document.cookie = `session_token=${token};path=/;max-age=${token_ttl}`;
+            }
             if (user) {
                 ui.hideNotificationBar();
                 store.reconnectAttempts = 0;
@@ -72,20 +115,55 @@ function handleAppWebSocketMessage(event) {
         case 'system_message':
             ui.addSystemMessage(message.payload.message);
             break;
-        case 'user_list_update':
-            ui.updateUserList(message.payload.users);
+        case 'channel_members':
+            if (message.payload.channel_id === store.members.channelId) {
+                // 不带 cursor 的第一页 (例如重连补发后) 替换整个列表
+                const firstPage = message.payload.member_count !== undefined;
+                ui.updateUserList(decodeUserList(message.payload), firstPage);
+                updateMemberPaging(message.payload);
+            }
+            break;
+        case 'channel_member_update':
+            if (message.payload.channel_id === store.members.channelId) {
+                ui.updateUserList(decodeUserList(message.payload), false);
+                if (message.payload.member_count !== undefined) {
+                    store.members.count = message.payload.member_count;
+                }
+            }
             break;
         case 'channel_list_update':
             ui.updateChannelList(message.payload.channels);
+            // 订阅全部文本频道: 未聚焦的频道只接收未读数
+            sendMessageToServer({
+                type: 'subscribe_channels',
+                payload: { channel_ids: message.payload.channels.filter(c => c.type !== 'voice').map(c => c.id) }
+            });
+            renderUnreadBadges();
+            break;
+        case 'unread_counts':
+            store.unread = message.payload.unread;
+            store.unreadMaxCount = message.payload.max_count;
+            renderUnreadBadges();
+            break;
+        case 'unread_update':
+            store.unread[message.payload.channel_id] = message.payload.unread;
+            ui.updateChannelUnread(message.payload.channel_id, message.payload.unread, store.unreadMaxCount);
             break;
         case 'join_channel_success':
+            store.replay = { epoch: message.payload.epoch, channel_id: message.payload.channel_id, seq: message.payload.seq };
+            store.unread[message.payload.channel_id] = 0;
+            ui.updateChannelUnread(message.payload.channel_id, 0, store.unreadMaxCount);
+            if (message.payload.replayed) {
+                // 断线期间的事件随后逐条补发，保留现有的聊天记录和用户列表
+                break;
+            }
             ui.clearChatArea();
             ui.updateChannelInfo(message.payload.channel_id, message.payload.channel_name, message.payload.channel_topic);
             ui.updateActiveChannelUI(message.payload.channel_name);
 
-            if (message.payload.users) {
-                ui.updateUserList(message.payload.users);
-            }
+            store.members.channelId = message.payload.channel_id;
+            ui.updateUserList(decodeUserList(message.payload));
+            updateMemberPaging(message.payload);
 
             if (message.payload.history && Array.isArray(message.payload.history)) {
                 message.payload.history.forEach(msg => ui.addMessageToChat(msg, { isHistory: true }));
@@ -94,6 +172,11 @@ function handleAppWebSocketMessage(event) {
         case 'error_message':
             ui.showNotificationBar(`服务器错误: ${message.payload.message}`, true);
             break;
+        case 'server_restarting':
+            // 服务器给出的随机重连延迟，用于下一次断线重连
+            store.restartReconnectDelay = message.payload.reconnect_delay_ms;
+            ui.showNotificationBar(message.payload.message, false);
+            break;
         default:
             console.warn('收到未知的应用消息类型:', message.type);
     }
@@ -108,7 +191,11 @@ function handleAppWebSocketOpen() {
     ui.hideNotificationBar();
     
     console.log('正在请求恢复会话...');
-    sendMessageToServer({ type: "auth_request", payload: { action: "resume", token: token } });
+    const payload = { action: "resume", token: token, lang: navigator.language, capabilities: CLIENT_CAPABILITIES };
+    if (store.replay) {
+        payload.replay = store.replay;
+    }
+    sendMessageToServer({ type: "auth_request", payload });
 }
 
 function handleAppWebSocketClose(isManualDisconnect) {
@@ -128,9 +215,18 @@ function handleAppWebSocketClose(isManualDisconnect) {
         return;
     }
 
-    store.reconnectAttempts++;
-    const delay = Math.min(1000 * Math.pow(2, store.reconnectAttempts - 1), 30000);
-    ui.showNotificationBar(`连接已断开，${delay / 1000}秒后尝试重连... (${store.reconnectAttempts}/${MAX_RECONNECT_ATTEMPTS})`, true);
+    let delay;
+    if (store.restartReconnectDelay) {
+        // 服务器重启: 按服务器分配的延迟重连，不计入重连次数
+        delay = store.restartReconnectDelay;
+        store.restartReconnectDelay = null;
+    } else {
+        store.reconnectAttempts++;
+        // 指数退避并加入随机抖动，避免大量客户端同时重连
+        const base = Math.min(1000 * Math.pow(2, store.reconnectAttempts - 1), 30000);
+        delay = Math.round(base / 2 + Math.random() * base / 2);
+    }
+    ui.showNotificationBar(`连接已断开，${(delay / 1000).toFixed(1)}秒后尝试重连... (${store.reconnectAttempts}/${MAX_RECONNECT_ATTEMPTS})`, true);
 
     clearTimeout(store.reconnectTimer);
     store.reconnectTimer = setTimeout(initializeWebSocket, delay);
@@ -239,6 +335,11 @@ function initializeEventHandlers() {
         headphonesBtn.addEventListener('click', handlers.handleToggleHeadphoneMute);
     }
 
+    const userList = document.querySelector('.user-sidebar .user-list');
+    if (userList) {
+        userList.addEventListener('scroll', handlers.handleUserListScroll);
+    }
+
     const toggleUserSidebarBtn = document.getElementById('toggle-user-sidebar-btn');
     if (toggleUserSidebarBtn) {
         toggleUserSidebarBtn.addEventListener('click', handlers.handleToggleUserSidebar);
@@ -53,9 +53,9 @@ function handleAuthResponseMessage(event) {
     import('./auth.js').then(auth => {
         switch (message.type) {
             case 'auth_success':
-                const { user, token } = message.payload;
+                const { user, token, token_ttl } = message.payload;
                 if (user && token) {
-                    auth.dispatchAuthSuccess(token);
+                    auth.dispatchAuthSuccess(token, token_ttl);
                 } else {
                     auth.showAuthSuccessMessageInModal(message.payload.message);
                 }
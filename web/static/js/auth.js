@@ -205,8 +205,8 @@ export function showAuthSystemMessageInModal(message, isSuccess = false) {
     }
 }
 
-export function dispatchAuthSuccess(token) {
-    const event = new CustomEvent('authSuccess', { detail: { token } });
+export function dispatchAuthSuccess(token, ttl) {
+    const event = new CustomEvent('authSuccess', { detail: { token, ttl } });
     document.dispatchEvent(event);
 }
 
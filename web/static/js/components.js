@@ -49,11 +49,22 @@ export function updateChannelList(dom, channels) {
 
         channelItem.innerHTML = `
             <i class="channel-list__item-icon ${iconClass}"></i>
-            <span class="channel-list__item-name">${channel.name}</span>`;
+            <span class="channel-list__item-name">${channel.name}</span>
+            <span class="channel-list__item-badge" hidden></span>`;
         dom.channelList.appendChild(channelItem);
     });
 }
 
+export function updateChannelUnread(dom, channelId, count, maxCount) {
+    const item = dom.channelList.querySelector(`.channel-list__item[data-channel-id="${channelId}"]`);
+    const badge = item?.querySelector('.channel-list__item-badge');
+    if (!badge) {
+        return;
+    }
+    badge.hidden = !count;
+    badge.textContent = maxCount && count >= maxCount ? `${maxCount - 1}+` : String(count);
+}
+
 export function updateActiveChannelUI(activeChannelName) {
     document.querySelectorAll('.channel-list__item').forEach(item => { 
         item.classList.remove('channel-list__item--active'); 
@@ -248,6 +259,10 @@ export function updateChannelInfo(dom, id, name, topic) {
 function createUserListItem(user) {
     const userItem = document.createElement('div');
     userItem.classList.add('user-list__item');
+    userItem.dataset.userId = user.id;
+    if (getStore().activeSpeakers.includes(user.id)) {
+        userItem.classList.add('user-list__item--speaking');
+    }
     const avatarUrl = user.avatar_url || DEFAULT_AVATAR;
     const displayName = user.display_name || user.username;
 
@@ -276,13 +291,16 @@ function createUserListGroup(title, users) {
     return groupDiv;
 }
 
-export function updateUserList(dom, allRegisteredUsersInfo) {
+// replace 为 true 时替换整个列表 (进入频道)，否则合并到已加载的成员中 (下一页或成员状态更新)
+export function updateUserList(dom, usersInfo, replace = true) {
     const store = getStore();
     dom.userListDiv.innerHTML = '';
     
-    store.allKnownUsers = {};
-    if (allRegisteredUsersInfo) {
-        allRegisteredUsersInfo.forEach(userInfo => {
+    if (replace) {
+        store.allKnownUsers = {};
+    }
+    if (usersInfo) {
+        usersInfo.forEach(userInfo => {
             if (userInfo && userInfo.username) {
                 store.allKnownUsers[userInfo.username.toLowerCase()] = {
                     id: userInfo.id,
@@ -323,6 +341,15 @@ export function updateUserList(dom, allRegisteredUsersInfo) {
     });
 }
 
+export function updateActiveSpeakers(dom, userIds) {
+    const store = getStore();
+    store.activeSpeakers = userIds || [];
+    dom.userListDiv.querySelectorAll('.user-list__item').forEach(item => {
+        const speaking = store.activeSpeakers.includes(parseInt(item.dataset.userId, 10));
+        item.classList.toggle('user-list__item--speaking', speaking);
+    });
+}
+
 // User Panel Components
 export function updateUserProfile(dom, id, username, displayName, avatarUrl, status, roles, isMicrophoneMuted, isHeadphoneMuted) {
     const store = getStore();
@@ -436,10 +463,16 @@ export function triggerFileUpload(dom) {
     }
 }
 
-export function handleLogout() {
+export async function handleLogout() {
     const store = getStore();
     store.isManualDisconnect = true;
     
+    try {
+        // 在服务器端吊销令牌，失败时仍然清除本地 Cookie
+        await fetch('/api/logout', { method: 'POST', credentials: 'same-origin' });
+    } catch (error) {
+        console.error('登出请求失败:', error);
+    }
     document.cookie = 'session_token=;path=/;expires=Thu, 01 Jan 1970 00:00:00 GMT';
     
     window.location.href = '/login';
@@ -159,6 +159,19 @@ export function handleToggleUserSidebar() {
     ui.toggleUserSidebar();
 }
 
+// 成员列表滚动到底部附近时加载当前频道的下一页成员
+export function handleUserListScroll(e) {
+    const store = getStore();
+    const list = e.target;
+    if (!store.members.cursor || store.members.loading) return;
+    if (list.scrollTop + list.clientHeight < list.scrollHeight - 100) return;
+    store.members.loading = true;
+    sendMessageToServer({
+        type: 'channel_members_request',
+        payload: { channel_id: store.members.channelId, cursor: store.members.cursor }
+    });
+}
+
 export function handleToggleMicrophoneMute() {
     if (!webrtc.isInVoiceChannel()) {
         ui.showNotificationBar("请先加入语音频道", true);
@@ -10,10 +10,11 @@ document.addEventListener('DOMContentLoaded', () => {
     // 添加: 登录成功后重定向
     // 我们通过监听一个自定义事件来实现
     document.addEventListener('authSuccess', (event) => {
-        const { token } = event.detail;
+        const { token, ttl } = event.detail;
         if (token) {
-            // 将 token 存入 cookie，以便后端路由可以识别
-            document.cookie = `session_token=${token};path=/;max-age=86400`; // 有效期1天
+            // 将 token 存入 cookie，以便后端路由可以识别；有效期与服务器端令牌的 TTL (security.sessions.ttl) 一致
+            const maxAge = ttl ? `;max-age=${ttl}` : '';
+            document.cookie = `session_token=${token};path=/${maxAge}`;
             // 重定向到主应用页面
             ui.showNotificationBar("登录成功，正在跳转...", false);
             setTimeout(() => {
@@ -17,7 +17,12 @@ const state = {
     isManualDisconnect: false,
     reconnectAttempts: 0,
     reconnectTimer: null,
-    allKnownUsers: {} // 存储所有已知用户的 profile
+    replay: null, // 当前频道的事件序号 {epoch, channel_id, seq}，重连时用于只补发缺失的事件
+    unread: {}, // 已订阅频道的未读数 {channel_id: n}
+    unreadMaxCount: 0,
+    allKnownUsers: {}, // 存储当前频道已加载成员的 profile
+    members: { channelId: null, cursor: null, count: 0, loading: false }, // 当前频道成员列表的分页状态
+    activeSpeakers: [] // 所在语音房间中正在说话的用户 ID
 };
 
 // 导出一个函数，允许其他模块访问和修改状态
@@ -41,12 +41,14 @@ export function initializeUI() {
 // 重新导出所有 UI 函数，并将 dom 对象作为第一个参数传递
 export const updateChannelList = (channels) => components.updateChannelList(dom, channels);
 export const updateActiveChannelUI = (activeChannelName) => components.updateActiveChannelUI(activeChannelName);
+export const updateChannelUnread = (channelId, count, maxCount) => components.updateChannelUnread(dom, channelId, count, maxCount);
 export const addMessageToChat = (msg, options) => components.addMessageToChat(dom, msg, options);
 export const addSystemMessage = (content) => components.addSystemMessage(dom, content);
 export const addFileUploadCard = (file, uploadId) => components.addFileUploadCard(dom, file, uploadId);
 export const clearChatArea = () => components.clearChatArea(dom);
 export const updateChannelInfo = (id, name, topic) => components.updateChannelInfo(dom, id, name, topic);
-export const updateUserList = (allRegisteredUsersInfo) => components.updateUserList(dom, allRegisteredUsersInfo);
+export const updateUserList = (usersInfo, replace) => components.updateUserList(dom, usersInfo, replace);
+export const updateActiveSpeakers = (userIds) => components.updateActiveSpeakers(dom, userIds);
 export const updateUserProfile = (...args) => components.updateUserProfile(dom, ...args);
 export const updateMicrophoneUI = (isMuted, isDisabled) => components.updateMicrophoneUI(dom, isMuted, isDisabled);
 export const updateHeadphoneUI = (isMuted, isDisabled) => components.updateHeadphoneUI(dom, isMuted, isDisabled);
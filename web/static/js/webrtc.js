@@ -16,6 +16,8 @@ const PEER_CONNECTION_CONFIG = {
 let localStream = null;
 let screenStream = null;
 let peerConnection = null; 
+// 完美协商 (perfect negotiation): 客户端为 "polite" 一方
+let makingOffer = false;
 let voiceState = {
     isConnected: false,
     channelId: null,
@@ -77,6 +79,29 @@ async function startConnection() {
         mediaElement.srcObject = stream;
     };
 
+    // trickle ICE: 候选地址一经收集立即发送，null 表示收集结束
+    peerConnection.onicecandidate = ({ candidate }) => {
+        sendSignal({
+            type: 'ice_candidate',
+            candidate: candidate ? candidate.candidate : null,
+            sdpMid: candidate ? candidate.sdpMid : null,
+            sdpMLineIndex: candidate ? candidate.sdpMLineIndex : null
+        });
+    };
+
+    // 初始协商以及通话中新增轨道 (如屏幕共享音频) 都通过此事件发起 offer
+    peerConnection.onnegotiationneeded = async () => {
+        try {
+            makingOffer = true;
+            await peerConnection.setLocalDescription();
+            sendSignal({ type: 'offer', sdp: peerConnection.localDescription.sdp });
+        } catch (error) {
+            console.error(`[WebRTC] 创建 offer 时出错:`, error);
+        } finally {
+            makingOffer = false;
+        }
+    };
+
     peerConnection.onconnectionstatechange = () => {
         debugLog(`与 SFU 的连接状态变为: ${peerConnection.connectionState}`);
         updateOverallConnectionStatus();
@@ -90,10 +115,6 @@ async function startConnection() {
     }
 
     peerConnection.addTransceiver('video', { direction: 'sendrecv' });
-
-    const offer = await peerConnection.createOffer();
-    await peerConnection.setLocalDescription(offer);
-    sendSignal({ type: 'offer', sdp: offer.sdp });
 }
 
 
@@ -196,6 +217,7 @@ export async function leaveVoiceChannel() {
     });
     
     ui.hideVoiceStatusPanel();
+    ui.updateActiveSpeakers([]);
     ui.updateMicrophoneUI(false, true);
     ui.updateHeadphoneUI(false, true);
     ui.updateScreenshareUI(false);
@@ -317,6 +339,7 @@ export async function handleSignalingMessage(message) {
     switch (type) {
         case 'join_voice_success':
             await startConnection();
+            ui.updateActiveSpeakers(payload.active_speakers);
             ui.updateMicrophoneUI(voiceState.isMuted, false);
             ui.updateHeadphoneUI(voiceState.isDeafened, false);
             break;
@@ -328,12 +351,24 @@ export async function handleSignalingMessage(message) {
                 if (data && data.type === 'answer') {
                     debugLog("收到来自 SFU 的 answer");
                     await peerConnection.setRemoteDescription(new RTCSessionDescription(data));
+                } else if (data && data.type === 'offer') {
+                    // SFU 转发了新的轨道，发起重新协商；若与本地 offer 冲突则隐式回滚
+                    debugLog(`收到来自 SFU 的重新协商 offer (冲突: ${makingOffer || peerConnection.signalingState !== 'stable'})`);
+                    await peerConnection.setRemoteDescription(new RTCSessionDescription(data));
+                    await peerConnection.setLocalDescription();
+                    sendSignal({ type: 'answer', sdp: peerConnection.localDescription.sdp });
+                } else if (data && data.type === 'ice_candidate') {
+                    await peerConnection.addIceCandidate(data.candidate ? data : null);
                 }
             } catch (error) {
                 console.error(`[WebRTC] 处理信令时出错:`, error);
             }
             break;
 
+        case 'active_speakers':
+            if (voiceState.isConnected) ui.updateActiveSpeakers(payload.user_ids);
+            break;
+
         default:
             debugLog('警告: 收到未知的语音信令消息类型:', type);
     }